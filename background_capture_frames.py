@@ -1,60 +1,309 @@
 import os
+import time
+import queue
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 from tqdm import tqdm
 import config
+import image_cache
+import image_hash
+import metrics
+
+log = logging.getLogger(__name__)
 
 VIDEO_FOLDER = os.path.join(config.DATA_FOLDER, "raw_videos")
 EXTRACTED_FRAMES_FOLDER = os.path.join(config.DATA_FOLDER,
                                        "extracted_frames")
 FRAMES_INTERVAL = 300
+HASH_INDEX_PATH = os.path.join(config.DATA_FOLDER, "cache", "frame_hashes.json")
+METRICS_FOLDER = os.path.join(config.DATA_FOLDER, "cache", "metrics")
+
+# Sampling modes:
+#   read - decode every frame and keep one per interval (original behaviour)
+#   grab - grab every frame but only retrieve/convert the ones we keep
+#   seek - jump straight to each sampled frame; decoding starts at the nearest keyframe
+#   scene - check a frame every `check_interval` frames and keep it only when the
+#           scene has changed enough since the last kept frame
+SAMPLING_MODES = ("read", "grab", "seek", "scene")
+
+SCENE_CHECK_INTERVAL = 30
+# Bhattacharyya distance between colour histograms that counts as a new scene
+SCENE_THRESHOLD = 0.25
+# Frames whose perceptual hashes differ in at most this many bits are duplicates
+DEDUP_MAX_DISTANCE = 6
+
+
+class FrameWriter:
+    """
+    Encode and write JPEG frames on background threads. Frames that fail to
+    write are removed from dedup_index, so they do not suppress later frames.
+    """
+
+    def __init__(self, threads=2, max_pending=32, dedup_index=None):
+        self.queue = queue.Queue(max_pending)
+        self.dedup_index = dedup_index
+        self.written = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, daemon=True)
+                         for _ in range(max(threads, 1))]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, frame = item
+            # cv2.imwrite releases the GIL, so encoding overlaps with decoding
+            start = time.perf_counter()
+            ok = cv2.imwrite(path, frame)
+            metrics.observe("write_seconds", time.perf_counter() - start, stage="frames")
+            with self._lock:
+                if ok:
+                    self.written += 1
+                else:
+                    self.failed += 1
+            if ok:
+                metrics.inc("items_total", stage="frames")
+            else:
+                metrics.inc("failures_total", stage="frames")
+                log.error(f"Could not write frame {path}.")
+                if self.dedup_index is not None:
+                    self.dedup_index.remove(path)
+
+    def write(self, path, frame):
+        # Blocks when too many frames are pending, which bounds memory use
+        self.queue.put((path, frame))
+
+    def close(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def frame_signature(frame):
+    """Colour histogram of a downscaled frame, cheap enough to compute per check."""
+    small = cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA)
+    hist = cv2.calcHist([small], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+def scene_distance(first, second):
+    return cv2.compareHist(first, second, cv2.HISTCMP_BHATTACHARYYA)
+
+
+def next_frame_index(output_folder):
+    """First frame number not used in output_folder, so re-runs append instead of overwrite."""
+    indices = [int(name[6:12]) for name in os.listdir(output_folder)
+               if name.startswith("frame_") and name[6:12].isdigit()]
+    return max(indices) + 1 if indices else 0
+
 
+def _save(writer, output_folder, index, frame, dedup_index=None, dedup_distance=DEDUP_MAX_DISTANCE):
+    frame_filename = os.path.join(output_folder, f"frame_{index:06d}.jpg")
+    # Skip backgrounds that are already present anywhere in the extracted_frames tree
+    if dedup_index is not None and dedup_index.add_if_new(
+            frame_filename, image_hash.dhash(frame), dedup_distance) is not None:
+        metrics.inc("duplicates_total", stage="frames")
+        return False
+    if writer is None:
+        if cv2.imwrite(frame_filename, frame):
+            metrics.inc("items_total", stage="frames")
+        else:
+            metrics.inc("failures_total", stage="frames")
+            log.error(f"Could not write frame {frame_filename}.")
+            # The hash was recorded before the write; a missing file must not hide later frames
+            if dedup_index is not None:
+                dedup_index.remove(frame_filename)
+            return False
+    else:
+        writer.write(frame_filename, frame)
+    return True
 
-def extract_frames(video_path, output_folder, frame_interval=30):
-    # Ensure the output folder exists
-    if not os.path.exists(output_folder):
+
+def extract_frames(video_path, output_folder, frame_interval=30, mode="read", writer=None,
+                   check_interval=SCENE_CHECK_INTERVAL, scene_threshold=SCENE_THRESHOLD,
+                   dedup_index=None, dedup_distance=DEDUP_MAX_DISTANCE, max_side=None):
+    # Ensure the output folder exists (streaming writers keep the frames in memory)
+    if getattr(writer, "writes_files", True) and not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
+    if mode not in SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling mode '{mode}', expected one of {SAMPLING_MODES}")
+
     # Open the video file
     cap = cv2.VideoCapture(video_path)
 
     # Check if video opened successfully
     if not cap.isOpened():
-        print("Error: Could not open video.")
-        return
+        log.error(f"Could not open video {video_path}.")
+        metrics.inc("failures_total", stage="frames")
+        return 0
 
     frame_count = 0
     extracted_frame_count = 0
+    frame_index = next_frame_index(output_folder) if dedup_index is not None else 0
+    last_signature = None
+
+    def save(frame):
+        nonlocal extracted_frame_count, frame_index
+        # Store frames at training resolution once instead of downscaling them on every read
+        frame = image_cache.fit_max_side(frame, max_side)
+        if _save(writer, output_folder, frame_index, frame, dedup_index, dedup_distance):
+            extracted_frame_count += 1
+            frame_index += 1
 
     # Get the total number of frames in the video
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
     # Create a progress bar
-    pbar = tqdm(total=total_frames, desc="Processing frames")
+    pbar = tqdm(total=total_frames, desc=f"Processing {os.path.basename(video_path)}")
 
-    while True:
-        ret, frame = cap.read()
+    if mode == "seek":
+        # Only the sampled frames are decoded (plus the run-up from their keyframe)
+        for frame_count in range(0, total_frames, frame_interval):
+            if not cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count):
+                break
+            ret, frame = cap.read()
+            if not ret:
+                break
+            save(frame)
+            pbar.update(min(frame_interval, total_frames - frame_count))
+    else:
+        interval = check_interval if mode == "scene" else frame_interval
+        while True:
+            if mode in ("grab", "scene"):
+                # grab() advances without converting the frame to BGR
+                if not cap.grab():
+                    break
+                keep = frame_count % interval == 0
+                ret, frame = cap.retrieve() if keep else (True, None)
+                if not ret:
+                    break
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                keep = frame_count % interval == 0
 
-        if not ret:
-            break
+            if keep and mode == "scene":
+                # Keep the frame only if it differs enough from the last kept one
+                signature = frame_signature(frame)
+                keep = last_signature is None or scene_distance(last_signature, signature) >= scene_threshold
+                if keep:
+                    last_signature = signature
 
-        if frame_count % frame_interval == 0:
-            frame_filename = os.path.join(output_folder,
-                                          f"frame_{extracted_frame_count:06d}.jpg")
-            cv2.imwrite(frame_filename, frame)
-            extracted_frame_count += 1
+            if keep:
+                save(frame)
 
-        frame_count += 1
-        pbar.update(1)  # Update the progress bar
+            frame_count += 1
+            pbar.update(1)  # Update the progress bar
 
     cap.release()
     pbar.close()  # Close the progress bar
-    print(f"Extracted {extracted_frame_count} frames from the video.")
+    log.info(f"Extracted {extracted_frame_count} frames from {video_path}.")
+    return extracted_frame_count
+
+
+def extract_all(video_folder=VIDEO_FOLDER, output_root=EXTRACTED_FRAMES_FOLDER, frame_interval=FRAMES_INTERVAL,
+                mode="grab", video_workers=2, writer_threads=2, dedup=False, hash_index_path=HASH_INDEX_PATH,
+                **sampling):
+    """
+    Sample frames from every video in a folder, several videos at a time.
+
+    With dedup=True, every frame is checked against a perceptual-hash index of
+    the whole output tree and near-duplicates of existing backgrounds are skipped.
+    Extra keyword arguments (check_interval, scene_threshold, dedup_distance,
+    max_side) are passed to extract_frames.
+    """
+    video_paths = [os.path.join(video_folder, video_file) for video_file in sorted(os.listdir(video_folder))]
+    return extract_videos(video_paths, output_root, frame_interval, mode, video_workers, writer_threads,
+                          dedup, hash_index_path, **sampling)
+
+
+def extract_videos(video_paths, output_root=EXTRACTED_FRAMES_FOLDER, frame_interval=FRAMES_INTERVAL,
+                   mode="grab", video_workers=2, writer_threads=2, dedup=False, hash_index_path=HASH_INDEX_PATH,
+                   writer=None, **sampling):
+    """
+    Sample frames from the given videos; see extract_all. Returns the frame count per video.
+
+    Frames go to a FrameWriter with writer_threads threads unless another writer
+    (such as streaming.FrameStream) is given; a given writer is not closed.
+    """
+    dedup_index = None
+    if dedup:
+        dedup_index = image_hash.HashIndex(hash_index_path, root=output_root)
+        added, removed = dedup_index.update_from_tree(output_root)
+        print(f"Frame hash index: {len(dedup_index)} frames ({added} newly hashed, {removed} deleted frames "
+              f"forgotten).")
+
+    owns_writer = writer is None
+    writer = writer or FrameWriter(writer_threads, dedup_index=dedup_index)
+    try:
+        with ThreadPoolExecutor(max(video_workers, 1)) as pool:
+            futures = {}
+            for video_path in video_paths:
+                output_folder = video_output_folder(video_path, output_root)
+                futures[video_path] = pool.submit(extract_frames, video_path, output_folder, frame_interval, mode,
+                                                  writer, dedup_index=dedup_index, **sampling)
+            counts = {video_path: future.result() for video_path, future in futures.items()}
+    finally:
+        if owns_writer:
+            writer.close()
+
+    if dedup_index is not None:
+        dedup_index.save()
+
+    print(f"Extracted {sum(counts.values())} frames from {len(video_paths)} videos "
+          f"({writer.written} written, {writer.failed} failed).")
+    return counts
+
+
+def video_output_folder(video_path, output_root=EXTRACTED_FRAMES_FOLDER):
+    return os.path.join(output_root, os.path.splitext(os.path.basename(video_path))[0])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract background frames from videos.")
+    parser.add_argument("--interval", type=int, default=FRAMES_INTERVAL, help="keep one frame out of every N")
+    parser.add_argument("--mode", choices=SAMPLING_MODES, default="grab",
+                        help="how frames between samples are skipped; 'scene' keeps frames on scene change")
+    parser.add_argument("--scene-check", type=int, default=SCENE_CHECK_INTERVAL,
+                        help="scene mode: examine one frame out of every N")
+    parser.add_argument("--scene-threshold", type=float, default=SCENE_THRESHOLD,
+                        help="scene mode: histogram distance (0-1) that counts as a new scene")
+    parser.add_argument("--dedup", action="store_true",
+                        help="skip frames that are near-duplicates of any already extracted frame")
+    parser.add_argument("--dedup-distance", type=int, default=DEDUP_MAX_DISTANCE,
+                        help="maximum Hamming distance between perceptual hashes of duplicates")
+    parser.add_argument("--max-size", type=int, default=None,
+                        help="shrink stored frames so that the longer side is at most N pixels (e.g. 640)")
+    parser.add_argument("--video-workers", type=int, default=2, help="videos processed concurrently")
+    parser.add_argument("--writer-threads", type=int, default=2, help="background JPEG writer threads")
+    parser.add_argument("--verbose", action="store_true", help="log per-video progress")
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    for video_file in os.listdir(VIDEO_FOLDER):
-        video_path = os.path.join(VIDEO_FOLDER, video_file)
-        output_folder = os.path.join(EXTRACTED_FRAMES_FOLDER,
-                                     os.path.splitext(video_file)[0])
-        extract_frames(video_path, output_folder, FRAMES_INTERVAL)
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+    metrics.configure(METRICS_FOLDER, reset=True)
+    extract_all(VIDEO_FOLDER, EXTRACTED_FRAMES_FOLDER, args.interval, args.mode,
+                args.video_workers, args.writer_threads, args.dedup,
+                check_interval=args.scene_check, scene_threshold=args.scene_threshold,
+                dedup_distance=args.dedup_distance, max_side=args.max_size)
+    print(metrics.report())
@@ -0,0 +1,131 @@
+"""
+Micro-benchmark of alpha blending: the previous float64 overlay functions
+against the fixed-point kernels in compositing.
+
+Run from the repository root:
+
+    python -m benchmarks.blend_benchmark --width 3840 --height 2160
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+import compositing
+
+PREPARED_OBJECTS_FOLDER = os.path.join("data", "prepared_objects")
+
+
+def legacy_overlay_float(background, overlay, x=0, y=0):
+    """The float64 blend formerly in combine_background_and_object.overlay_image."""
+    overlay_height, overlay_width = overlay.shape[:2]
+    alpha_mask = overlay[:, :, 3] / 255.0
+    alpha_inv = 1.0 - alpha_mask
+    overlay_rgb = overlay[:, :, :3]
+    bg_height, bg_width = background.shape[:2]
+    y1, y2 = max(y, 0), min(y + overlay_height, bg_height)
+    x1, x2 = max(x, 0), min(x + overlay_width, bg_width)
+    overlay_y1 = max(0, -y)
+    overlay_y2 = overlay_height - max(0, y + overlay_height - bg_height)
+    overlay_x1 = max(0, -x)
+    overlay_x2 = overlay_width - max(0, x + overlay_width - bg_width)
+    roi = background[y1:y2, x1:x2].astype(float)
+    overlay_region = overlay_rgb[overlay_y1:overlay_y2, overlay_x1:overlay_x2].astype(float)
+    alpha = alpha_mask[overlay_y1:overlay_y2, overlay_x1:overlay_x2, np.newaxis]
+    alpha_inv_region = alpha_inv[overlay_y1:overlay_y2, overlay_x1:overlay_x2, np.newaxis]
+    background[y1:y2, x1:x2] = ((alpha * overlay_region) + (alpha_inv_region * roi)).astype("uint8")
+    return background
+
+
+def legacy_overlay_channels(background, overlay, x=0, y=0):
+    """The per-channel blend formerly in object_augment.overlay_image."""
+    h, w = overlay.shape[:2]
+    bg_h, bg_w = background.shape[:2]
+    crop_x1, crop_y1 = max(0, -x), max(0, -y)
+    crop_x2, crop_y2 = min(w, bg_w - x), min(h, bg_h - y)
+    bg_x1, bg_y1 = max(0, x), max(0, y)
+    bg_x2, bg_y2 = min(bg_w, x + w), min(bg_h, y + h)
+    overlay_cropped = overlay[crop_y1:crop_y2, crop_x1:crop_x2]
+    alpha = overlay_cropped[:, :, 3] / 255.0
+    alpha_inv = 1.0 - alpha
+    for c in range(3):
+        background[bg_y1:bg_y2, bg_x1:bg_x2, c] = (
+            alpha * overlay_cropped[:, :, c] +
+            alpha_inv * background[bg_y1:bg_y2, bg_x1:bg_x2, c]
+        )
+    return background
+
+
+def load_object(category, width, height):
+    """Load the first prepared object of a category, or synthesize a soft-edged blob."""
+    folder = os.path.join(PREPARED_OBJECTS_FOLDER, category)
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            obj = cv2.imread(os.path.join(folder, name), cv2.IMREAD_UNCHANGED)
+            if obj is not None and obj.ndim == 3 and obj.shape[2] == 4:
+                return cv2.resize(obj, (width, height), interpolation=cv2.INTER_LINEAR)
+    rng = np.random.default_rng(0)
+    obj = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.ellipse(mask, (width // 2, height // 2), (width // 2 - 1, height // 2 - 1), 0, 0, 360, 255, -1)
+    obj[:, :, 3] = cv2.GaussianBlur(mask, (31, 31), 0)
+    return obj
+
+
+def time_call(func, background, overlay, x, y, repeat):
+    timings = []
+    for _ in range(repeat):
+        target = background.copy()
+        start = time.perf_counter()
+        func(target, overlay, x, y)
+        timings.append(time.perf_counter() - start)
+    return min(timings), target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark alpha blending kernels.")
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--object-fraction", type=float, default=0.5,
+                        help="object size relative to the frame")
+    parser.add_argument("--categories", nargs="+", default=["truck", "tree"])
+    parser.add_argument("--batch", type=int, default=8, help="objects per frame for blend_each")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    obj_w = int(args.width * args.object_fraction)
+    obj_h = int(args.height * args.object_fraction)
+    x, y = (args.width - obj_w) // 2, (args.height - obj_h) * 3 // 4
+
+    candidates = [
+        ("legacy float64", legacy_overlay_float),
+        ("legacy per-channel", legacy_overlay_channels),
+        ("fixed-point numpy", compositing.blend),
+        ("fixed-point cv2", lambda bg, ov, px, py: compositing.blend(bg, ov, px, py, use_cv2=True)),
+    ]
+
+    print(f"Frame {args.width}x{args.height}, object {obj_w}x{obj_h}, best of {args.repeat}")
+    for category in args.categories:
+        overlay = load_object(category, obj_w, obj_h)
+        _, reference = time_call(legacy_overlay_float, background, overlay, x, y, 1)
+        baseline = None
+        for name, func in candidates:
+            best, result = time_call(func, background, overlay, x, y, args.repeat)
+            baseline = baseline or best
+            max_diff = int(np.abs(result.astype(np.int16) - reference).max())
+            print(f"  {category:>10} | {name:<20} {best * 1000:8.2f} ms  "
+                  f"x{baseline / best:5.2f}  max diff {max_diff}")
+
+        placements = [(overlay, int(px), y) for px in np.linspace(-obj_w // 2, args.width - obj_w // 2, args.batch)]
+        start = time.perf_counter()
+        compositing.blend_each(background.copy(), placements)
+        elapsed = time.perf_counter() - start
+        print(f"  {category:>10} | blend_each x{args.batch:<11} {elapsed * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
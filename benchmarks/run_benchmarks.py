@@ -0,0 +1,417 @@
+"""
+End-to-end benchmark of the data-generation stages on a fixed local fixture
+set: a synthetic video, a sample of data/prepared_objects and raw objects,
+and a stub download server (benchmarks/stub_server.py).
+
+Every stage runs in a fresh process and reports item throughput, p50/p99
+per-item latency and the process's peak RSS. Results are written as JSON so
+that runs can be compared:
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<previous>.json
+    python -m benchmarks.run_benchmarks --stages augment composite --profile sample
+
+With --profile the profiling hooks (see profiling.py) are enabled in the stage
+processes and their output is written next to the results.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+import cv2
+import numpy as np
+
+RESULTS_FOLDER = os.path.join("benchmarks", "results")
+PREPARED_OBJECTS_FOLDER = os.path.join("data", "prepared_objects")
+RAW_OBJECTS_FOLDER = os.path.join("data", "raw_objects")
+
+VIDEO_SIZE = (1280, 720)
+VIDEO_FRAMES = 300
+FRAME_INTERVAL = 10
+SEED = 1234
+
+
+def make_video(path, frames=VIDEO_FRAMES, size=VIDEO_SIZE, fps=25):
+    """Write a synthetic MJPG video: a moving gradient with a few shapes, new scene every 100 frames."""
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not create video {path}")
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :].repeat(height, axis=0)
+    for index in range(frames):
+        rng = np.random.default_rng(index // 100)
+        tint = rng.integers(0, 256, 3)
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        for channel in range(3):
+            frame[:, :, channel] = ((gradient + index * 2 + tint[channel]) % 256).astype(np.uint8)
+        for _ in range(5):
+            center = tuple(int(v) for v in rng.integers(0, (width, height)))
+            cv2.circle(frame, (center[0] + index, center[1]), int(rng.integers(20, 120)),
+                       tuple(int(v) for v in rng.integers(0, 256, 3)), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def sample_files(root, per_category, categories=None):
+    """{category: [paths]} with the first per_category files of each category folder."""
+    if not os.path.isdir(root):
+        return {}
+    samples = {}
+    for category in sorted(os.listdir(root)):
+        folder = os.path.join(root, category)
+        if not os.path.isdir(folder) or (categories and category not in categories):
+            continue
+        files = [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                 if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp"))]
+        if files:
+            samples[category] = files[:per_category]
+    return samples
+
+
+def build_fixture(workdir, options):
+    video = make_video(os.path.join(workdir, "fixture.avi"), options["video_frames"])
+    objects = sample_files(PREPARED_OBJECTS_FOLDER, options["objects_per_category"], options["categories"])
+    if not objects:
+        raise SystemExit(f"No prepared objects found in {PREPARED_OBJECTS_FOLDER}")
+    return {
+        "workdir": workdir,
+        "video": video,
+        "objects": objects,
+        "raw_objects": sample_files(RAW_OBJECTS_FOLDER, 1, options["categories"]),
+    }
+
+
+def fixture_frames(fixture, count):
+    """Frames decoded from the fixture video, every FRAME_INTERVAL-th, saved as JPEG."""
+    folder = os.path.join(fixture["workdir"], "frames")
+    os.makedirs(folder, exist_ok=True)
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder))
+    if len(paths) >= count:
+        return paths[:count]
+    cap = cv2.VideoCapture(fixture["video"])
+    index = 0
+    paths = []
+    while len(paths) < count and cap.grab():
+        if index % FRAME_INTERVAL == 0:
+            _, frame = cap.retrieve()
+            path = os.path.join(folder, f"frame_{index:06d}.jpg")
+            cv2.imwrite(path, frame)
+            paths.append(path)
+        index += 1
+    cap.release()
+    return paths
+
+
+def object_items(fixture):
+    return [(path, category) for category, paths in sorted(fixture["objects"].items()) for path in paths]
+
+
+def timed_loop(func, count, warmup=1):
+    """Call func(index) count times after warmup untimed calls; returns (latencies, wall seconds)."""
+    for index in range(warmup):
+        func(index)
+    latencies = []
+    start = time.perf_counter()
+    for index in range(count):
+        item_start = time.perf_counter()
+        func(index)
+        latencies.append(time.perf_counter() - item_start)
+    return latencies, time.perf_counter() - start
+
+
+# Every stage returns (per-item latencies in seconds, wall seconds of the timed part, note)
+
+def bench_frames(fixture, options):
+    import background_capture_frames
+
+    class TimedWriter(background_capture_frames.FrameWriter):
+        """Records the time between saved frames: decode plus hand-off to the writer."""
+
+        def __init__(self, threads):
+            super().__init__(threads)
+            self.latencies = []
+            self._last = time.perf_counter()
+
+        def write(self, path, frame):
+            now = time.perf_counter()
+            self.latencies.append(now - self._last)
+            self._last = now
+            super().write(path, frame)
+
+    output_folder = os.path.join(fixture["workdir"], "extracted")
+    start = time.perf_counter()
+    with TimedWriter(2) as writer:
+        background_capture_frames.extract_frames(fixture["video"], output_folder, FRAME_INTERVAL,
+                                                 options["frames_mode"], writer)
+    elapsed = time.perf_counter() - start
+    return writer.latencies, elapsed, f"mode={options['frames_mode']}, interval={FRAME_INTERVAL}"
+
+
+def bench_download(fixture, options):
+    import config
+    import object_download
+    from benchmarks.stub_server import StubServer
+
+    latencies = []
+
+    class TimedDownloader(object_download.Downloader):
+
+        def _download(self, task):
+            start = time.perf_counter()
+            try:
+                return super()._download(task)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+    folder = os.path.join(fixture["workdir"], "downloads")
+    os.makedirs(folder, exist_ok=True)
+    manifest = object_download.DownloadManifest(folder, os.path.join(fixture["workdir"], "manifests"))
+    # The stub server accepts any credentials
+    settings = config.Settings(None, fixture["workdir"], "benchmark", "benchmark")
+    with StubServer() as server, TimedDownloader() as downloader:
+        object_download.SEARCH_URL = server.url + "/search"
+        tasks = []
+        start_index = 1
+        while len(tasks) < options["downloads"]:
+            results = object_download.get_search_results("benchmark", start_index, downloader.session, settings)
+            start_index += len(results["items"])
+            tasks.extend((item["link"], folder, len(tasks) + 1) for item in results["items"])
+        start = time.perf_counter()
+        ok = downloader.download_all(tasks[:options["downloads"]], manifest=manifest)
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed, f"{sum(ok)}/{len(ok)} saved from the stub server"
+
+
+def bench_remove_background(fixture, options):
+    import object_remove_background
+
+    inputs = [paths[0] for paths in fixture["raw_objects"].values()][:options["remove_background"]]
+    if not inputs:
+        return None, 0.0, f"skipped: no raw objects in {RAW_OBJECTS_FOLDER}"
+    try:
+        session = object_remove_background.get_session()
+    except Exception as e:
+        return None, 0.0, f"skipped: rembg model unavailable ({e.__class__.__name__})"
+    output_folder = os.path.join(fixture["workdir"], "removed")
+
+    def remove(index):
+        object_remove_background.remove_background_and_center(
+            inputs[index], os.path.join(output_folder, f"{index}.png"), session)
+
+    return (*timed_loop(remove, len(inputs), warmup=0), f"model={object_remove_background.MODEL_NAME}")
+
+
+def bench_augment(fixture, options):
+    import object_augment
+
+    object_augment.configure(options["augment_preset"])
+    images = [cv2.imread(path, cv2.IMREAD_UNCHANGED) for path, _ in object_items(fixture)]
+
+    def augment(index):
+        object_augment.augment_object(images[index % len(images)], seed=SEED + index)
+
+    return (*timed_loop(augment, options["samples"]), f"preset={options['augment_preset']}")
+
+
+def bench_blend(fixture, options):
+    import compositing
+
+    frames = [cv2.imread(path) for path in fixture_frames(fixture, 8)]
+    objects = []
+    for path, _ in object_items(fixture):
+        obj = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        scale = VIDEO_SIZE[1] * 0.4 / max(obj.shape[:2])
+        objects.append(cv2.resize(obj, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA))
+    rng = random.Random(SEED)
+    placements = []
+    for index in range(options["samples"] + 1):
+        frame, obj = frames[index % len(frames)], objects[index % len(objects)]
+        placements.append((frame.copy(), obj, rng.randint(0, frame.shape[1] - obj.shape[1]),
+                           rng.randint(0, frame.shape[0] - obj.shape[0])))
+
+    def blend(index):
+        compositing.blend(*placements[index])
+
+    return (*timed_loop(blend, options["samples"]), "fixed-point numpy kernel, objects at 40% of the frame height")
+
+
+def bench_composite(fixture, options):
+    import combine_background_and_object as combine
+
+    combine.init_worker(augment_preset=options["augment_preset"])
+    frames = fixture_frames(fixture, 16)
+    items = object_items(fixture)
+
+    def composite(index):
+        object_path, category = items[index % len(items)]
+        combine.compose_sample(frames[index % len(frames)], object_path, category, seed=SEED + index)
+
+    return (*timed_loop(composite, options["samples"]), f"compose_sample, preset={options['augment_preset']}")
+
+
+def bench_encode(fixture, options):
+    import dataset_writer
+
+    frames = [cv2.imread(path) for path in fixture_frames(fixture, 8)]
+
+    def encode(index):
+        dataset_writer.encode_image(frames[index % len(frames)], options["encoding"])
+
+    return (*timed_loop(encode, options["samples"]), f"encoding={options['encoding']}")
+
+
+STAGES = {
+    "frames": bench_frames,
+    "download": bench_download,
+    "remove_background": bench_remove_background,
+    "augment": bench_augment,
+    "blend": bench_blend,
+    "composite": bench_composite,
+    "encode": bench_encode,
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_stage(name, fixture, options):
+    """Run one stage in the current process and summarize it."""
+    cv2.setNumThreads(options["threads"])
+    latencies, elapsed, note = STAGES[name](fixture, options)
+    if latencies is None:
+        return {"skipped": True, "note": note}
+    latencies = np.array(latencies) * 1000
+    return {
+        "items": len(latencies),
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+        "mean_ms": float(latencies.mean()) if len(latencies) else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "note": note,
+    }
+
+
+def run_isolated(name, fixture, options):
+    # A fresh interpreter per stage keeps peak RSS and warm caches from leaking between stages
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        result = pool.apply(run_stage, (name, fixture, options))
+        # A normal exit lets the profiling hooks dump their data
+        pool.close()
+        pool.join()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_delta(current, previous, higher_is_better):
+    if not previous:
+        return ""
+    change = (current - previous) / previous * 100
+    better = change > 0 if higher_is_better else change < 0
+    return f" ({change:+.1f}%{'' if abs(change) < 5 else (' better' if better else ' worse')})"
+
+
+def print_results(results, baseline=None):
+    baseline_stages = (baseline or {}).get("stages", {})
+    print(f"{'stage':<18} {'items':>6} {'items/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'peak RSS MB':>12}")
+    for name, stage in results["stages"].items():
+        if stage.get("skipped"):
+            print(f"{name:<18} {stage['note']}")
+            continue
+        print(f"{name:<18} {stage['items']:>6} {stage['throughput']:>10.2f} {stage['p50_ms']:>10.2f} "
+              f"{stage['p99_ms']:>10.2f} {stage['peak_rss_mb']:>12.1f}")
+        previous = baseline_stages.get(name)
+        if previous and not previous.get("skipped"):
+            print(f"{'':<18} vs baseline: throughput"
+                  f"{format_delta(stage['throughput'], previous['throughput'], True)}, "
+                  f"p50{format_delta(stage['p50_ms'], previous['p50_ms'], False)}, "
+                  f"p99{format_delta(stage['p99_ms'], previous['p99_ms'], False)}, "
+                  f"peak RSS{format_delta(stage['peak_rss_mb'], previous['peak_rss_mb'], False)}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the data-generation stages on local fixtures.")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--samples", type=int, default=100, help="items per augment/blend/composite/encode stage")
+    parser.add_argument("--downloads", type=int, default=50, help="images fetched from the stub server")
+    parser.add_argument("--remove-background", type=int, default=5, help="raw objects passed through rembg")
+    parser.add_argument("--video-frames", type=int, default=VIDEO_FRAMES)
+    parser.add_argument("--frames-mode", default="grab")
+    parser.add_argument("--objects-per-category", type=int, default=2)
+    parser.add_argument("--categories", nargs="+", default=None, help="limit the object sample to these categories")
+    parser.add_argument("--augment-preset", default="full")
+    parser.add_argument("--encoding", default="jpg")
+    parser.add_argument("--threads", type=int, default=1, help="OpenCV threads per stage process")
+    parser.add_argument("--profile", choices=("timing", "cprofile", "sample"), default=None,
+                        help="enable the profiling hooks in the stage processes")
+    parser.add_argument("--output", default=None, help="results file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", default=None, help="previous results file to compare against")
+    parser.add_argument("--in-process", action="store_true", help="run all stages in this process")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    output = args.output or os.path.join(RESULTS_FOLDER, f"{stamp}.json")
+    options = {key: value for key, value in vars(args).items()
+               if key not in ("stages", "profile", "output", "compare", "in_process")}
+
+    if args.profile:
+        # Stage processes configure profiling from the environment on import
+        os.environ["RAILROAD_PROFILE"] = args.profile
+        os.environ["RAILROAD_PROFILE_DIR"] = os.path.splitext(output)[0] + "-profiles"
+
+    results = {
+        "timestamp": stamp,
+        "revision": git_revision(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "options": options,
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="railroad-bench-") as workdir:
+        fixture = build_fixture(workdir, options)
+        for name in args.stages:
+            print(f"Running {name}...")
+            run = run_stage if args.in_process else run_isolated
+            results["stages"][name] = run(name, fixture, options)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+    if args.profile:
+        print(f"Profiles saved to {os.environ['RAILROAD_PROFILE_DIR']}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
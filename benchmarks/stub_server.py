@@ -0,0 +1,116 @@
+"""
+Local stand-in for the Custom Search API and the image hosts it links to.
+
+GET /search?start=N returns a page of PER_PAGE result items whose links point
+back at this server; GET /img/N.jpg returns a distinct synthetic JPEG for
+every N. Every MISSING_EVERY-th image answers 404 so the error path is
+exercised as well. GET /flaky/N.jpg?fail=K answers 503 to the first K
+requests for that path and then serves image N, and ?delay=S holds any
+image response for S seconds.
+
+Every request path is logged in StubServer.requests, so tests can check
+which requests reached the server. StubServer.max_active records the peak
+number of image requests served at once for each Host header.
+"""
+import json
+import time
+import threading
+import http.server
+import urllib.parse
+
+import cv2
+import numpy as np
+
+PER_PAGE = 10
+MISSING_EVERY = 10
+IMAGE_SIZE = (320, 240)
+
+
+def synthetic_jpeg(n, size=IMAGE_SIZE):
+    width, height = size
+    rng = np.random.default_rng(n)
+    image = np.full((height, width, 3), rng.integers(0, 256, 3), dtype=np.uint8)
+    for _ in range(6):
+        center = tuple(int(v) for v in rng.integers(0, (width, height)))
+        radius = int(rng.integers(10, height // 2))
+        cv2.circle(image, center, radius, tuple(int(v) for v in rng.integers(0, 256, 3)), -1)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/octet-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == "/search":
+            start = int(query.get("start", ["1"])[0])
+            host = f"http://127.0.0.1:{self.server.server_port}"
+            items = [{"link": f"{host}/img/{start + i}.jpg"} for i in range(PER_PAGE)]
+            self._send(200, json.dumps({"items": items}).encode("utf-8"), "application/json")
+        elif url.path.startswith(("/img/", "/flaky/")):
+            n = int(url.path.rsplit("/", 1)[-1].split(".")[0])
+            host = self.headers.get("Host", "")
+            with self.server.lock:
+                hits = self.server.hits[url.path] = self.server.hits.get(url.path, 0) + 1
+                active = self.server.active[host] = self.server.active.get(host, 0) + 1
+                self.server.max_active[host] = max(self.server.max_active.get(host, 0), active)
+            try:
+                time.sleep(float(query.get("delay", ["0"])[0]))
+                if url.path.startswith("/flaky/") and hits <= int(query.get("fail", ["1"])[0]):
+                    self._send(503)
+                elif n % MISSING_EVERY == 0:
+                    self._send(404)
+                else:
+                    self._send(200, synthetic_jpeg(n), "image/jpeg")
+            finally:
+                with self.server.lock:
+                    self.server.active[host] -= 1
+        else:
+            self._send(404)
+
+
+class StubServer:
+    """ThreadingHTTPServer on a free local port, served from a daemon thread."""
+
+    def __init__(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.hits = {}
+        self.server.active = {}
+        self.server.max_active = {}
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def requests(self):
+        with self.server.lock:
+            return list(self.server.requests)
+
+    @property
+    def max_active(self):
+        with self.server.lock:
+            return dict(self.server.max_active)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
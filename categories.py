@@ -0,0 +1,162 @@
+"""
+Category registry built once from categories.csv.
+
+Required columns are `Object name` and `scale factor`. The optional columns
+`weight` (relative sampling weight), `min scale` and `max scale` (range the
+scale factor is drawn from) default to 1.0 and to the scale factor itself.
+"""
+import os
+import csv
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SCALE_FACTOR = 1.0
+
+Category = namedtuple("Category", ["id", "name", "scale_factor", "weight", "min_scale", "max_scale"])
+
+
+def normalize_name(name):
+    """'Dead Cow' -> 'dead_cow', the form used for folder names."""
+    return name.strip().replace(" ", "_").lower()
+
+
+def _positive(value, default, what, name):
+    if value is None or str(value).strip() == "":
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        number = 0.0
+    if number <= 0:
+        log.warning(f"Invalid {what} '{value}' for category '{name}'. Using {default}.")
+        return default
+    return number
+
+
+class CategoryRegistry:
+    """
+    Categories indexed by id, with a name -> id dict for lookups.
+
+    Ids follow the order of first appearance in the CSV.
+    """
+
+    def __init__(self, categories=()):
+        self.categories = []
+        self.ids = {}
+        for category in categories:
+            self.add(category.name, category.scale_factor, category.weight, category.min_scale, category.max_scale)
+
+    def add(self, name, scale_factor=DEFAULT_SCALE_FACTOR, weight=1.0, min_scale=None, max_scale=None):
+        name = normalize_name(name)
+        min_scale = scale_factor if min_scale is None else min_scale
+        max_scale = scale_factor if max_scale is None else max_scale
+        if min_scale > max_scale:
+            log.warning(f"Scale range {min_scale}-{max_scale} of category '{name}' is reversed.")
+            min_scale, max_scale = max_scale, min_scale
+        category = Category(len(self.categories), name, scale_factor, weight, min_scale, max_scale)
+        self.categories.append(category)
+        self.ids[name] = category.id
+        return category
+
+    @classmethod
+    def from_csv(cls, path):
+        """Read and validate a categories CSV; for duplicate names the first row wins."""
+        registry = cls()
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                raw_name = row.get("Object name") or ""
+                name = normalize_name(raw_name)
+                if not name:
+                    log.warning(f"{path}:{line_number}: empty category name, row skipped.")
+                    continue
+                scale_factor = _positive(row.get("scale factor"), DEFAULT_SCALE_FACTOR, "scale factor", name)
+                weight = _positive(row.get("weight"), 1.0, "weight", name)
+                min_scale = _positive(row.get("min scale"), scale_factor, "min scale", name)
+                max_scale = _positive(row.get("max scale"), scale_factor, "max scale", name)
+
+                if name in registry:
+                    existing = registry[name]
+                    if existing.scale_factor != scale_factor:
+                        log.warning(f"{path}:{line_number}: duplicate category '{name}' with scale factor "
+                                    f"{scale_factor} ignored; using {existing.scale_factor}.")
+                    continue
+                registry.add(name, scale_factor, weight, min_scale, max_scale)
+        return registry
+
+    def validate(self, available_categories):
+        """
+        Compare the registry with the categories that have prepared objects.
+
+        Categories without objects are reported. Object folders without a CSV
+        entry are reported and registered with the default scale factor in a
+        copy; this registry (possibly shared through load_registry) is not changed.
+
+        Returns:
+            CategoryRegistry: The categories of this registry followed by the
+            ones added with defaults.
+        """
+        available = {normalize_name(name) for name in available_categories}
+        missing = [category.name for category in self.categories if category.name not in available]
+        unknown = sorted(available - set(self.ids))
+        if missing:
+            log.warning(f"Categories without prepared objects: {', '.join(missing)}")
+        validated = CategoryRegistry(self.categories)
+        for name in unknown:
+            log.warning(f"No scale factor found for category '{name}'. Using scale {DEFAULT_SCALE_FACTOR}.")
+            validated.add(name)
+        return validated
+
+    def __contains__(self, name):
+        return normalize_name(name) in self.ids
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.categories[self.ids[normalize_name(key)]]
+        return self.categories[key]
+
+    def __len__(self):
+        return len(self.categories)
+
+    def __iter__(self):
+        return iter(self.categories)
+
+    @property
+    def names(self):
+        return [category.name for category in self.categories]
+
+    def id_of(self, name):
+        return self.ids.get(normalize_name(name))
+
+    def scale_factor(self, name, rng=np.random):
+        """
+        Scale factor for a category, drawn from its size range when one is set.
+        Unknown categories use the default scale factor.
+        """
+        category_id = self.id_of(name)
+        if category_id is None:
+            return DEFAULT_SCALE_FACTOR
+        category = self.categories[category_id]
+        if category.min_scale == category.max_scale:
+            return category.scale_factor
+        return float(rng.uniform(category.min_scale, category.max_scale))
+
+    def sampling_weights(self, names=None):
+        """Normalized sampling weights for the given categories (all by default)."""
+        names = self.names if names is None else names
+        weights = np.array([self[name].weight for name in names], dtype=np.float64)
+        return weights / weights.sum() if weights.sum() > 0 else weights
+
+
+_registries = {}
+
+
+def load_registry(path):
+    """Build the registry for a CSV once per process."""
+    path = os.path.abspath(path)
+    if path not in _registries:
+        _registries[path] = CategoryRegistry.from_csv(path)
+    return _registries[path]
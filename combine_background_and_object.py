@@ -1,11 +1,28 @@
 import os
-import pandas as pd
+import argparse
+import random
+import time
+import zlib
+import multiprocessing
+from functools import partial
+from collections import namedtuple
 import logging
 
 import config
 import cv2
 import numpy as np
   
+import categories
+import compositing
+import dataset_writer
+import image_cache
+import job_scheduler
+import metrics
+import object_augment
+import object_index
+import profiling
+import scene_composer
+import streaming
 from object_augment import augment_object
 
 log = logging.getLogger(__name__)
@@ -14,72 +31,614 @@ log = logging.getLogger(__name__)
 EXTRACTED_FRAMES_FOLDER = os.path.join(config.DATA_FOLDER, "extracted_frames")
 PREPARED_OBJECTS_FOLDER = os.path.join(config.DATA_FOLDER, "prepared_objects")
 OUTPUT_FOLDER = os.path.join(config.DATA_FOLDER, "synthetic_images")
+SHARDS_FOLDER = os.path.join(config.DATA_FOLDER, "synthetic_shards")
+IMAGE_STORE_PATH = os.path.join(config.DATA_FOLDER, "cache", "decoded_images")
+# Маски путей: <video_name>.png, ненулевые пиксели - область рельсов для кадров этого видео
+TRACK_MASKS_FOLDER = os.path.join(config.DATA_FOLDER, "track_masks")
+METRICS_FOLDER = os.path.join(config.DATA_FOLDER, "cache", "metrics")
  
-# Загружаем категории с масштабами и приводим названия к нижнему регистру с заменой пробелов на _
-CATEGORIES = pd.read_csv(os.path.join(config.DATA_FOLDER, "categories.csv"))
-CATEGORIES["Object name"] = CATEGORIES["Object name"].str.replace(" ", "_").str.lower()
-
-def main():
-    # Собираем список всех кадров
+CATEGORIES_CSV = os.path.join(config.DATA_FOLDER, "categories.csv")
+
+FRAMES_PER_OBJECT = 10
+# Запас разрешения объекта перед аугментациями относительно итогового размера
+PRESCALE_MARGIN = 1.25
+DEFAULT_SEED = 42
+# Длинная сторона кадров при обучении детектора (--target-size); None - исходное разрешение
+DEFAULT_TARGET_SIZE = None
+# Как часто (в секундах) сводные метрики процессов переписываются в metrics.prom
+METRICS_REPORT_INTERVAL = 30.0
+
+# Одна задача генерации: индекс, кадр, объект, категория и собственный сид
+Job = namedtuple("Job", ["index", "frame_path", "object_path", "category", "seed"])
+# Задача сцены: несколько объектов ((object_path, category), ...) на одном кадре
+SceneJob = namedtuple("SceneJob", ["index", "frame_path", "objects", "seed"])
+# Задача потокового режима: декодированный кадр и задачи (Job/SceneJob), которые рисуются на нем
+FrameJob = namedtuple("FrameJob", ["frame", "jobs"])
+# Все, что init_worker меняет в процессе: init_worker возвращает прежнее состояние для restore_worker
+WorkerState = namedtuple("WorkerState", ["cv2_threads", "target_size", "image_cache", "augment", "object_index"])
+
+# Разрешение, в котором собираются образцы этого процесса; задается в init_worker
+_target_size = DEFAULT_TARGET_SIZE
+
+
+def get_categories():
+    # Реестр категорий с масштабами читается при первом обращении, один раз на процесс;
+    # названия приводятся к нижнему регистру с заменой пробелов на _
+    return categories.load_registry(CATEGORIES_CSV)
+
+
+def collect_frames(frames_folder=EXTRACTED_FRAMES_FOLDER):
+    # Собираем список всех кадров (сортируем, чтобы порядок не зависел от ФС)
     extracted_frames = []
-    for root, _, files in os.walk(EXTRACTED_FRAMES_FOLDER):
+    for root, _, files in os.walk(frames_folder):
         for file in files:
             extracted_frames.append(os.path.join(root, file))
+    return sorted(extracted_frames)
+
 
+def collect_objects(objects_folder=PREPARED_OBJECTS_FOLDER):
     # Собираем список всех подготовленных объектов по категориям
     prepared_objects = {}
-    for dir_name in os.listdir(PREPARED_OBJECTS_FOLDER):
-        dir_path = os.path.join(PREPARED_OBJECTS_FOLDER, dir_name)
+    for dir_name in sorted(os.listdir(objects_folder)):
+        dir_path = os.path.join(objects_folder, dir_name)
         if not os.path.isdir(dir_path):
             continue
         prepared_objects[dir_name] = []
-        for file in os.listdir(dir_path):
+        for file in sorted(os.listdir(dir_path)):
             file_path = os.path.join(dir_path, file)
             if os.path.isfile(file_path):
                 prepared_objects[dir_name].append(file_path)
+    return prepared_objects
+
 
-    # Создаем папку для синтетических изображений, если её нет
-    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+def job_seed(base_seed, index):
+    # Сид задачи зависит только от базового сида и номера задачи, но не от числа процессов
+    return int(np.random.SeedSequence([base_seed, index]).generate_state(1)[0])
 
-    # Проходим по каждой категории и объектам, накладываем объекты на случайные кадры
+
+def build_jobs(extracted_frames, prepared_objects, frames_per_object=FRAMES_PER_OBJECT, seed=DEFAULT_SEED):
+    # Для каждого объекта выбираем случайные кадры; выбор детерминирован сидом
+    rng = np.random.default_rng(seed)
+    jobs = []
     for category, objects in prepared_objects.items():
         for obj in objects:
-            for frame in np.random.choice(extracted_frames, min(10, len(extracted_frames)), replace=False):
-                try:
-                    synthetic_image = combine_images(frame, obj, category)
-                except Exception as e:
-                    log.error(f"Error combining images: {e}")
-                    continue
-
-                output_filename = f"{os.path.splitext(os.path.basename(frame))[0]}_{category}_{os.path.splitext(os.path.basename(obj))[0]}.png"
-                output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-                cv2.imwrite(output_path, synthetic_image)
-                print(f"Saved synthetic image to {output_path}")
-
-def combine_images(frame_path: str, object_path: str, category: str):
-    frame = cv2.imread(frame_path, cv2.IMREAD_COLOR)
-    if frame is None:
-        raise FileNotFoundError(f"Failed to load frame image from {frame_path}")
-
-    obj = cv2.imread(object_path, cv2.IMREAD_UNCHANGED)
+            count = min(frames_per_object, len(extracted_frames))
+            for frame in rng.choice(extracted_frames, count, replace=False):
+                index = len(jobs)
+                jobs.append(Job(index, str(frame), obj, category, job_seed(seed, index)))
+    return jobs
+
+
+def build_scene_jobs(extracted_frames, prepared_objects, objects_per_frame, frames_per_object=FRAMES_PER_OBJECT,
+                     seed=DEFAULT_SEED):
+    # Столько же экземпляров объектов, сколько в build_jobs, но по objects_per_frame на кадр
+    rng = np.random.default_rng(seed)
+    instances = [(obj, category) for category, objects in prepared_objects.items()
+                 for obj in objects for _ in range(min(frames_per_object, len(extracted_frames)))]
+    order = rng.permutation(len(instances))
+    jobs = []
+    for start in range(0, len(order), objects_per_frame):
+        objects = tuple(instances[i] for i in order[start:start + objects_per_frame])
+        index = len(jobs)
+        frame = str(extracted_frames[rng.integers(len(extracted_frames))])
+        jobs.append(SceneJob(index, frame, objects, job_seed(seed, index)))
+    return jobs
+
+
+def build_scheduled_jobs(extracted_frames, prepared_objects, samples, objects_per_frame=1, quotas=None,
+                         seed=DEFAULT_SEED, registry=None):
+    # Ровно samples задач, лениво: квоты категорий по весам из реестра (или заданные явно),
+    # объекты категории и кадры используются по кругу, равномерно.
+    # registry - реестр после validate, в котором есть все категории prepared_objects
+    registry = registry or get_categories()
+    weights = {name: registry[name].weight for name in prepared_objects}
+    schedule = job_scheduler.schedule(extracted_frames, prepared_objects, samples, weights, quotas,
+                                      objects_per_frame, seed)
+    for index, (frame, objects) in enumerate(schedule):
+        if objects_per_frame > 1:
+            yield SceneJob(index, frame, objects, job_seed(seed, index))
+        else:
+            (obj, category), = objects
+            yield Job(index, frame, obj, category, job_seed(seed, index))
+
+
+def build_frame_jobs(stream, prepared_objects, samples_per_frame=1, objects_per_frame=1, seed=DEFAULT_SEED):
+    # Задачи для кадров из потока (path, frame). Объекты выбираются по сиду от имени кадра,
+    # а не от порядка, в котором кадры приходят из нескольких видео
+    # Проверка сразу, до первого кадра: сам перебор кадров - генератор
+    instances = [(obj, category) for category, objects in prepared_objects.items() for obj in objects]
+    if not instances:
+        raise ValueError("No prepared objects to place on the streamed frames")
+    return _frame_jobs(stream, instances, samples_per_frame, objects_per_frame, seed)
+
+
+def _frame_jobs(stream, instances, samples_per_frame, objects_per_frame, seed):
+    index = 0
+    for path, frame in stream:
+        video_name = os.path.basename(os.path.dirname(path))
+        frame_name = os.path.basename(path)
+        # Имя видео в имени кадра, чтобы результаты разных видео не перезаписывали друг друга
+        frame_path = os.path.join(os.path.dirname(path), f"{video_name}_{frame_name}")
+        frame_seed = job_seed(seed, zlib.crc32(f"{video_name}/{frame_name}".encode("utf-8")))
+        rng = np.random.default_rng(frame_seed)
+        # Разные объекты для образцов одного кадра, пока их хватает (имя PNG - кадр и объект)
+        order = rng.permutation(len(instances))
+        jobs = []
+        for sample in range(samples_per_frame):
+            if objects_per_frame > 1:
+                picks = rng.integers(len(instances), size=objects_per_frame)
+                jobs.append(SceneJob(index, frame_path, tuple(instances[i] for i in picks),
+                                     job_seed(frame_seed, sample)))
+            else:
+                obj, category = instances[order[sample % len(order)]]
+                jobs.append(Job(index, frame_path, obj, category, job_seed(frame_seed, sample)))
+            index += 1
+        yield FrameJob(frame, tuple(jobs))
+
+
+def output_path_for(job, output_folder=OUTPUT_FOLDER, numbered=False):
+    # numbered: имя по номеру задачи, а не по объекту. Нужно для --samples: пары кадр/объект
+    # в расписании повторяются, и одинаковые имена перезаписали бы друг друга
+    frame_name = os.path.splitext(os.path.basename(job.frame_path))[0]
+    if isinstance(job, SceneJob):
+        return os.path.join(output_folder, f"{frame_name}_scene_{job.index:06d}.png")
+    if numbered:
+        return os.path.join(output_folder, f"{frame_name}_{job.category}_{job.index:06d}.png")
+    object_name = os.path.splitext(os.path.basename(job.object_path))[0]
+    return os.path.join(output_folder, f"{frame_name}_{job.category}_{object_name}.png")
+
+
+def init_worker(cache_bytes=image_cache.DEFAULT_CACHE_BYTES, store_path=None, augment_preset="full",
+                target_size=DEFAULT_TARGET_SIZE, index_folder=None, config_path=None):
+    global _target_size
+    previous = WorkerState(cv2.getNumThreads(), _target_size, image_cache.snapshot(), object_augment.snapshot(),
+                           object_index.snapshot())
+    # Конфигурация родителя передается явно: процесс, запущенный через spawn, сам бы ее не нашел
+    if config_path is not None:
+        config.load(config_path)
+    # Каждый процесс работает в один поток OpenCV, чтобы не было переподписки ядер
+    cv2.setNumThreads(1)
+    # Кадры уменьшаются до target_size при декодировании, и вся композиция идет в этом разрешении
+    _target_size = target_size
+    # Свой LRU-кэш декодированных изображений и, при наличии, общее mmap-хранилище
+    image_cache.configure(cache_bytes, store_path)
+    # Пайплайн аугментаций строится один раз на процесс
+    object_augment.configure(augment_preset)
+    # С индексом объекты читаются из общего хранилища индекса вместо PNG
+    object_index.configure(index_folder)
+    return previous
+
+
+def restore_worker(state):
+    # Возвращает процесс в состояние до init_worker (для генерации в вызывающем процессе)
+    global _target_size
+    cv2.setNumThreads(state.cv2_threads)
+    _target_size = state.target_size
+    image_cache.restore(state.image_cache)
+    object_augment.restore(state.augment)
+    object_index.restore(state.object_index)
+
+
+def preload_images(extracted_frames, prepared_objects, store_path=IMAGE_STORE_PATH, target_size=None):
+    # Декодируем все кадры и объекты один раз в общее хранилище для всех процессов;
+    # кадры хранятся уже уменьшенными до target_size
+    sources = [(frame, cv2.IMREAD_COLOR, target_size) for frame in extracted_frames]
+    for objects in prepared_objects.values():
+        sources.extend((obj, cv2.IMREAD_UNCHANGED) for obj in objects)
+    store = image_cache.build_store(store_path, sources)
+    print(f"Preloaded {len(store)} decoded images into {store_path}")
+    return store_path
+
+
+def render_job(job, frame=None):
+    # frame - уже декодированный кадр (потоковый режим); без него кадр читается по job.frame_path
+    source = job.frame_path if frame is None else frame
+    if isinstance(job, SceneJob):
+        return compose_scene_sample(source, job.objects, seed=job.seed, frame_path=job.frame_path,
+                                    target_size=_target_size)
+    return compose_sample(source, job.object_path, job.category, seed=job.seed, target_size=_target_size)
+
+
+def run_job(job, output_folder=OUTPUT_FOLDER, frame=None, numbered=False):
+    # Сидируем все генераторы случайных чисел, чтобы результат не зависел от процесса
+    random.seed(job.seed)
+    np.random.seed(job.seed)
+    start = time.perf_counter()
+    try:
+        synthetic_image, _ = render_job(job, frame)
+    except Exception as e:
+        log.error(f"Error combining images: {e}")
+        metrics.inc("failures_total", stage="composite")
+        return None
+
+    output_path = output_path_for(job, output_folder, numbered)
+    save_image(output_path, synthetic_image)
+    metrics.inc("items_total", stage="composite")
+    metrics.observe("item_seconds", time.perf_counter() - start, stage="composite")
+    log.debug(f"Saved synthetic image to {output_path}")
+    return output_path
+
+
+@profiling.hook("encode")
+def save_image(path, image):
+    return cv2.imwrite(path, image)
+
+
+def encode_job(job, encoding="jpg", quality=95, frame=None):
+    # Вместо записи файла возвращаем закодированный образец с рамками для ShardWriter
+    random.seed(job.seed)
+    np.random.seed(job.seed)
+    start = time.perf_counter()
+    try:
+        synthetic_image, boxes = render_job(job, frame)
+    except Exception as e:
+        log.error(f"Error combining images: {e}")
+        metrics.inc("failures_total", stage="composite")
+        return None
+
+    objects = [path for path, _ in job.objects] if isinstance(job, SceneJob) else [job.object_path]
+    metadata = {"frame": job.frame_path, "objects": objects, "seed": job.seed}
+    sample = dataset_writer.make_sample(f"{job.index:09d}", synthetic_image, boxes, encoding, quality, metadata)
+    metrics.inc("items_total", stage="composite")
+    metrics.observe("item_seconds", time.perf_counter() - start, stage="composite")
+    return sample
+
+
+def run_frame_job(frame_job, encoding=None, quality=95, output_folder=OUTPUT_FOLDER):
+    # Все задачи одного кадра выполняются в одном процессе, чтобы кадр передавался один раз.
+    # Возвращает размер кадра (для освобождения бюджета памяти) и результаты задач
+    if encoding is None:
+        results = [run_job(job, output_folder, frame_job.frame) for job in frame_job.jobs]
+    else:
+        results = [encode_job(job, encoding, quality, frame_job.frame) for job in frame_job.jobs]
+    return frame_job.frame.nbytes, results
+
+
+def map_jobs(job_func, jobs, workers=1, chunksize=8, initargs=()):
+    # Результаты задач в порядке готовности; при workers=1 все выполняется в текущем процессе
+    if workers <= 1:
+        init_worker(*initargs)
+        yield from map(job_func, jobs)
+        return
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+        yield from pool.imap_unordered(job_func, jobs, chunksize=chunksize)
+        # Даем процессам завершиться штатно, чтобы сработали их обработчики выхода
+        pool.close()
+        pool.join()
+
+
+def report_metrics(last_report):
+    # Периодически сводим метрики всех процессов в metrics.prom
+    if time.perf_counter() - last_report > METRICS_REPORT_INTERVAL:
+        log.info(metrics.report())
+        return time.perf_counter()
+    return last_report
+
+
+def run_jobs(jobs, workers=1, chunksize=8, cache_bytes=image_cache.DEFAULT_CACHE_BYTES, store_path=None,
+             augment_preset="full", writer=None, encoding="jpg", quality=95, target_size=DEFAULT_TARGET_SIZE,
+             index_folder=None, numbered=False):
+    # Раздаем задачи пулу процессов; при workers=1 работаем в текущем процессе.
+    # jobs может быть генератором: задачи создаются по мере раздачи процессам.
+    # С writer процессы кодируют образцы, а запись в шарды идет последовательно здесь
+    # Пайплайн (и albumentations) строится один раз до fork, чтобы процессы не импортировали его заново
+    object_augment.configure(augment_preset)
+    start = time.perf_counter()
+    saved = total = 0
+    last_report = start
+    if writer is None:
+        # Папка вывода передается явно, а не берется из конфигурации процесса
+        job_func = partial(run_job, output_folder=OUTPUT_FOLDER, numbered=numbered)
+    else:
+        job_func = partial(encode_job, encoding=encoding, quality=quality)
+
+    initargs = (cache_bytes, store_path, augment_preset, target_size, index_folder, config.load().path)
+    for result in map_jobs(job_func, jobs, workers, chunksize, initargs):
+        total += 1
+        if result is not None:
+            saved += 1
+            if writer is not None:
+                writer.write(result)
+        last_report = report_metrics(last_report)
+    elapsed = time.perf_counter() - start
+    rate = saved / elapsed if elapsed > 0 else 0.0
+    print(f"Generated {saved}/{total} synthetic images in {elapsed:.1f}s "
+          f"({rate:.2f} images/sec, {workers} workers)")
+    return saved
+
+
+def main(workers=None, frames_per_object=FRAMES_PER_OBJECT, seed=DEFAULT_SEED,
+         cache_bytes=image_cache.DEFAULT_CACHE_BYTES, preload=False, augment_preset="full",
+         output_format="png", encoding="jpg", quality=95, shard_size=1000,
+         annotations=dataset_writer.ANNOTATION_FORMATS, objects_per_frame=1, metrics_folder=METRICS_FOLDER,
+         stream=False, samples_per_frame=1, stream_bytes=streaming.DEFAULT_MAX_BYTES, frame_interval=None,
+         target_size=DEFAULT_TARGET_SIZE, samples=None, quotas=None, use_index=False, min_coverage=None):
+    # Метрики процессов-воркеров собираются через снимки в metrics_folder
+    metrics.configure(metrics_folder, reset=True)
+    index_folder = None
+    if use_index or min_coverage is not None:
+        # Индекс обновляется только для изменившихся категорий
+        index = object_index.build(PREPARED_OBJECTS_FOLDER)
+        index_folder = index.folder
+        print(f"Using the object index in {index_folder} ({len(index)} objects)")
+    if min_coverage is not None:
+        # Отбор по метаданным индекса, без чтения пикселей
+        prepared_objects = index.objects(min_coverage)
+    else:
+        prepared_objects = collect_objects()
+    # Проверяем реестр: дубликаты уже отброшены, сверяем категории с подготовленными объектами
+    registry = get_categories().validate(prepared_objects)
+
+    if stream:
+        # Кадры берутся прямо из видео, без extracted_frames на диске
+        import background_capture_frames
+        video_folder = background_capture_frames.VIDEO_FOLDER
+        video_paths = [os.path.join(video_folder, name) for name in sorted(os.listdir(video_folder))]
+        run = partial(run_stream, video_paths, prepared_objects, workers or os.cpu_count() or 1,
+                      samples_per_frame, objects_per_frame, seed, stream_bytes, frame_interval,
+                      cache_bytes=cache_bytes, augment_preset=augment_preset, target_size=target_size,
+                      index_folder=index_folder)
+    else:
+        extracted_frames = collect_frames()
+        store_path = (preload_images(extracted_frames, prepared_objects, target_size=target_size)
+                      if preload else None)
+
+        # Проходим по каждой категории и объектам, накладываем объекты на случайные кадры
+        chunksize = 8
+        if samples:
+            # Сбалансированный запуск на заданное число образцов; задачи создаются по мере раздачи
+            jobs = build_scheduled_jobs(extracted_frames, prepared_objects, samples, objects_per_frame, quotas, seed,
+                                        registry)
+            chunksize = job_scheduler.chunk_size(samples, workers or os.cpu_count() or 1)
+        elif objects_per_frame > 1:
+            jobs = build_scene_jobs(extracted_frames, prepared_objects, objects_per_frame, frames_per_object, seed)
+        else:
+            jobs = build_jobs(extracted_frames, prepared_objects, frames_per_object, seed)
+        run = partial(run_jobs, jobs, workers or os.cpu_count() or 1, chunksize, cache_bytes=cache_bytes,
+                      store_path=store_path, augment_preset=augment_preset, target_size=target_size,
+                      index_folder=index_folder, numbered=bool(samples))
+
+    if output_format == "shards":
+        # Образцы и аннотации (COCO/YOLO) пишутся потоком в tar-шарды
+        with dataset_writer.ShardWriter(SHARDS_FOLDER, registry.names, max_samples=shard_size,
+                                        annotations=annotations) as writer:
+            run(writer=writer, encoding=encoding, quality=quality)
+        print(f"Wrote {writer.samples} samples with {writer.boxes} boxes "
+              f"into {writer.shard_index + 1} shards in {SHARDS_FOLDER}")
+        if writer.skipped_boxes:
+            print(f"Skipped {writer.skipped_boxes} boxes of categories missing from {CATEGORIES_CSV}")
+    else:
+        # Создаем папку для синтетических изображений, если её нет
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        run()
+    print(metrics.report())
+
+
+def quota_arg(value):
+    # "category=count" -> (category, count)
+    name, _, count = value.partition("=")
+    if not name or not count.isdigit():
+        raise argparse.ArgumentTypeError(f"expected category=count, got '{value}'")
+    return categories.normalize_name(name), int(count)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic images by placing objects on frames.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--frames-per-object", type=int, default=FRAMES_PER_OBJECT,
+                        help="random frames to combine with each object")
+    parser.add_argument("--samples", type=int, default=None,
+                        help="generate exactly N samples, balanced between categories by their registry weights "
+                             "and using every frame evenly (instead of --frames-per-object per object)")
+    parser.add_argument("--quota", type=quota_arg, nargs="+", default=None, metavar="CATEGORY=COUNT",
+                        help="with --samples: exact object count for some categories; the rest is split by weight")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED,
+                        help="base seed; results are identical for any number of workers")
+    parser.add_argument("--cache-mb", type=int, default=image_cache.DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="per-process LRU cache of decoded images, in MiB (0 disables)")
+    parser.add_argument("--preload", action="store_true",
+                        help="decode all frames and objects once into a shared memory-mapped store")
+    parser.add_argument("--augment-preset", choices=object_augment.PRESETS, default="full",
+                        help="'cheap' skips the elastic/grid/optical distortions for quick iterations")
+    parser.add_argument("--output-format", choices=("png", "shards"), default="png",
+                        help="one PNG per sample, or tar shards with COCO/YOLO annotations")
+    parser.add_argument("--encoding", choices=tuple(dataset_writer.ENCODINGS), default="jpg",
+                        help="image encoding inside shards")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG/WebP quality inside shards")
+    parser.add_argument("--shard-size", type=int, default=1000, help="samples per shard")
+    parser.add_argument("--annotations", nargs="+", choices=dataset_writer.ANNOTATION_FORMATS,
+                        default=list(dataset_writer.ANNOTATION_FORMATS), help="annotation formats for shards")
+    parser.add_argument("--objects-per-frame", type=int, default=1,
+                        help="place several objects per frame with depth scaling and overlap control")
+    parser.add_argument("--metrics-dir", default=METRICS_FOLDER,
+                        help="folder for per-process metric snapshots and metrics.prom")
+    parser.add_argument("--target-size", type=int, default=DEFAULT_TARGET_SIZE,
+                        help="longer side of the output in pixels (e.g. 640); frames are decoded at reduced size "
+                             "and composited at this resolution (default: frame resolution)")
+    parser.add_argument("--object-index", action="store_true",
+                        help="build or update the prepared-object index and read objects from its "
+                             "pre-decoded store instead of decoding PNGs")
+    parser.add_argument("--min-object-coverage", type=float, default=None,
+                        help="skip objects whose alpha coverage (share of opaque pixels) is below this; "
+                             "decided from the object index, implies --object-index")
+    parser.add_argument("--stream", action="store_true",
+                        help="decode frames from raw_videos straight into compositing instead of extracted_frames")
+    parser.add_argument("--samples-per-frame", type=int, default=1, help="stream mode: composites per frame")
+    parser.add_argument("--stream-memory-mb", type=int, default=streaming.DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="stream mode: ceiling for decoded frames in flight, in MiB")
+    parser.add_argument("--frame-interval", type=int, default=None,
+                        help="stream mode: keep one frame out of every N (default: as in frame extraction)")
+    parser.add_argument("--verbose", action="store_true", help="log every sample")
+    return parser.parse_args(argv)
+
+def run_stream(video_paths, prepared_objects, workers=1, samples_per_frame=1, objects_per_frame=1,
+               seed=DEFAULT_SEED, max_bytes=streaming.DEFAULT_MAX_BYTES, frame_interval=None, mode="grab",
+               video_workers=1, cache_bytes=image_cache.DEFAULT_CACHE_BYTES, augment_preset="full",
+               writer=None, encoding="jpg", quality=95, target_size=DEFAULT_TARGET_SIZE, index_folder=None):
+    # Кадры идут из декодера видео прямо в процессы композиции, минуя JPEG на диске.
+    # Все кадры в пути (в очереди, у процессов, в работе) ограничены max_bytes:
+    # декодер ждет, пока результаты кадров не вернутся из процессов.
+    # С target_size кадры уменьшаются сразу после декодирования, до очереди
+    import background_capture_frames
+    object_augment.configure(augment_preset)
+    start = time.perf_counter()
+    stream = streaming.FrameStream(max_bytes, target_size)
+    # Задачи строятся до запуска декодера, чтобы ошибка в объектах не оставила его работать впустую
+    frame_jobs = build_frame_jobs(stream, prepared_objects, samples_per_frame, objects_per_frame, seed)
+    stream.start(background_capture_frames.extract_videos, video_paths, EXTRACTED_FRAMES_FOLDER,
+                 frame_interval or background_capture_frames.FRAMES_INTERVAL, mode, video_workers)
+    job_func = partial(run_frame_job, encoding=None if writer is None else encoding, quality=quality,
+                       output_folder=OUTPUT_FOLDER)
+    saved = total = 0
+    last_report = start
+    # Кадр - одна задача: chunksize=1, чтобы кадры не копились у процессов
+    initargs = (cache_bytes, None, augment_preset, target_size, index_folder, config.load().path)
+    for nbytes, results in map_jobs(job_func, frame_jobs, workers, 1, initargs):
+        stream.release(nbytes)
+        for result in results:
+            total += 1
+            if result is not None:
+                saved += 1
+                if writer is not None:
+                    writer.write(result)
+        last_report = report_metrics(last_report)
+    elapsed = time.perf_counter() - start
+    print(f"Generated {saved}/{total} synthetic images from {stream.written} streamed frames "
+          f"in {elapsed:.1f}s ({saved / max(elapsed, 1e-9):.1f} img/s, {workers} workers, "
+          f"peak {stream.budget.peak / (1024 * 1024):.0f} MiB of frames in flight)")
+    return saved
+
+
+def combine_images(frame_path: str, object_path: str, category: str, seed=None):
+    return compose_sample(frame_path, object_path, category, seed)[0]
+
+
+def load_frame(frame, target_size=None):
+    # frame - путь к кадру или уже декодированный кадр (потоковый режим).
+    # Кадр из кэша только для чтения, а кадр из потока общий для нескольких задач: рисуем на копии.
+    # С target_size длинная сторона кадра уменьшается до target_size (JPEG декодируется сразу в 1/2-1/8)
+    if isinstance(frame, np.ndarray):
+        image = image_cache.fit_max_side(frame, target_size)
+        return image.copy() if image is frame else image
+    image = image_cache.imread(frame, cv2.IMREAD_COLOR, target_size)
+    if image is None:
+        raise FileNotFoundError(f"Failed to load frame image from {frame}")
+    return image.copy()
+
+
+def compose_sample(frame_path, object_path: str, category: str, seed=None, target_size=None):
+    # То же, что combine_images, но дополнительно возвращает рамки объектов:
+    # [{"category": ..., "bbox": [x, y, w, h]}] в пикселях кадра.
+    # Масштаб объекта задается относительно кадра, то есть относительно итогового разрешения
+    frame = load_frame(frame_path, target_size)
+
+    # Планируем геометрию: фактор из реестра и уменьшение объекта до аугментаций,
+    # затем аугментируем объект (например, повороты, сдвиги и т.п.)
+    scale_factor = get_categories().scale_factor(category)
+    obj, pre_scale = load_object(object_path, frame.shape, scale_factor, seed)
+
+    # Один финальный resize: подгонка под фон (без увеличения) и фактор из CSV
+    obj = final_resize(obj, frame.shape, pre_scale, scale_factor)
+
+    # Получаем случайные координаты для размещения объекта на фоне
+    x, y = get_random_position(frame, obj)
+
+    # Накладываем объект с прозрачностью
+    synthetic_image = overlay_image(frame, obj, x, y)
+
+    box = compositing.visible_box(frame.shape, obj, x, y)
+    boxes = [{"category": category, "bbox": box}] if box is not None else []
+    return synthetic_image, boxes
+
+
+def load_track_mask(frame_path, frame_shape):
+    # Маска ищется по имени папки видео, из которого извлечен кадр
+    video_name = os.path.basename(os.path.dirname(frame_path))
+    mask_path = os.path.join(TRACK_MASKS_FOLDER, video_name + ".png")
+    if not os.path.exists(mask_path):
+        return None
+    mask = image_cache.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    if mask is not None and mask.shape[:2] != frame_shape[:2]:
+        mask = cv2.resize(mask, (frame_shape[1], frame_shape[0]), interpolation=cv2.INTER_NEAREST)
+    return mask
+
+
+def compose_scene_sample(frame, objects, seed=None, max_overlap=scene_composer.MAX_OVERLAP, frame_path=None,
+                         target_size=None):
+    # Несколько объектов на одном кадре: размер зависит от глубины (y), пересечения ограничены,
+    # при наличии маски объекты ставятся на пути. Для кадра-массива маска ищется по frame_path
+    if frame_path is None and not isinstance(frame, np.ndarray):
+        frame_path = frame
+    frame = load_frame(frame, target_size)
+
+    items = []
+    for i, (object_path, category) in enumerate(objects):
+        scale_factor = get_categories().scale_factor(category)
+        # Запас на ближний план: глубина только уменьшает объект
+        obj, pre_scale = load_object(object_path, frame.shape, scale_factor, None if seed is None else seed + i)
+        items.append((obj, category, pre_scale, scale_factor))
+
+    def size(obj, pre_scale, scale_factor):
+        return final_size(obj.shape, frame.shape, pre_scale, scale_factor)[0]
+
+    def resize(obj, pre_scale, scale_factor):
+        return final_resize(obj, frame.shape, pre_scale, scale_factor)
+
+    track_mask = load_track_mask(frame_path, frame.shape) if frame_path else None
+    return scene_composer.compose_scene(frame, items, size, resize, np.random, track_mask, max_overlap)
+
+
+def load_object(object_path, frame_shape, scale_factor, seed=None):
+    # Объект, уменьшенный до аугментаций и аугментированный, и его pre_scale.
+    # Объект из индекса - те же пиксели, что дал бы cv2.imread, но без декодирования PNG;
+    # если объекта нет в индексе или его файл изменился, он декодируется как обычно
+    indexed = object_index.get(object_path)
+    obj = indexed if indexed is not None else image_cache.imread(object_path, cv2.IMREAD_UNCHANGED)
     if obj is None:
         raise FileNotFoundError(f"Failed to load object image from {object_path}")
+    obj, pre_scale = prescale_object(obj, frame_shape, scale_factor)
+    obj = augment_object(obj, seed=seed)
+    return obj, pre_scale
 
-    # Аугментируем объект (например, повороты, сдвиги и т.п.)
-    obj = augment_object(obj)
 
-    # Подгоняем размер объекта под фон, не увеличивая
-    obj = resize_image(obj, frame.shape)
+def fit_scale(image_shape, target_shape):
+    # Масштаб, при котором изображение помещается в целевой размер (без увеличения)
+    target_height, target_width = target_shape[:2]
+    height, width = image_shape[:2]
+    return min(target_width / width, target_height / height, 1.0)
 
-    # Масштабируем объект согласно фактору из CSV
-    obj = rescale_image(obj, category)
 
-    # Получаем случайные координаты для размещения объекта на фоне
-    x, y = get_random_position(frame, obj)
+def prescale_object(obj, frame_shape, scale_factor, margin=PRESCALE_MARGIN):
+    # Большинство объектов в итоге занимают 5-20% кадра: аугментировать их в полном
+    # разрешении незачем. Уменьшаем заранее до итогового размера с запасом margin
+    # (аугментации поворачивают и слегка масштабируют объект).
+    height, width = obj.shape[:2]
+    pre_scale = min(fit_scale(obj.shape, frame_shape) * scale_factor * margin, 1.0)
+    new_width, new_height = max(int(width * pre_scale), 1), max(int(height * pre_scale), 1)
+    if new_width >= width or new_height >= height:
+        return obj, 1.0
+    obj = cv2.resize(obj, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    return obj, new_width / width
+
+
+def final_size(obj_shape, frame_shape, pre_scale, scale_factor):
+    # Итоговые (ширина, высота) объекта и масштаб - без ресайза самих пикселей
+    height, width = obj_shape[:2]
+    full_shape = (height / pre_scale, width / pre_scale)
+    scale = fit_scale(full_shape, frame_shape) * scale_factor / pre_scale
+    return (max(int(width * scale), 1), max(int(height * scale), 1)), scale
+
+
+def final_resize(obj, frame_shape, pre_scale, scale_factor):
+    # Тот же результат, что resize_image + rescale_image для объекта исходного
+    # разрешения, но одним проходом cv2.resize
+    (new_width, new_height), scale = final_size(obj.shape, frame_shape, pre_scale, scale_factor)
+    if (new_width, new_height) == obj.shape[1::-1]:
+        return obj
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+    return cv2.resize(obj, (new_width, new_height), interpolation=interpolation)
 
-    # Накладываем объект с прозрачностью
-    synthetic_image = overlay_image(frame, obj, x, y)
-    return synthetic_image
 
 def resize_image(image, target_shape):
     target_height, target_width = target_shape[:2]
@@ -92,18 +651,9 @@ def resize_image(image, target_shape):
     return cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
 
 def rescale_image(image, category):
-    scale_factor_arr = CATEGORIES.loc[CATEGORIES["Object name"] == category, "scale factor"].values
-    if len(scale_factor_arr) == 0:
-        print(f"No scale factor found for category '{category}'. Using scale 1.0.")
-        scale_factor = 1.0
-    else:
-        scale_factor = scale_factor_arr[0]
-
-    if scale_factor <= 0:
-        print(f"Invalid scale factor '{scale_factor}' for category '{category}'. Using scale 1.0.")
-        scale_factor = 1.0
-
-    print(f"Scaling category '{category}' with factor {scale_factor}")
+    # Фактор берется из реестра (для неизвестных категорий 1.0, диапазон масштабов - случайно)
+    scale_factor = get_categories().scale_factor(category)
+    log.debug(f"Scaling category '{category}' with factor {scale_factor}")
 
     return cv2.resize(image, (0, 0), fx=scale_factor, fy=scale_factor, interpolation=cv2.INTER_AREA)
 
@@ -126,37 +676,19 @@ def overlay_image(background, overlay, x=0, y=0):
     if overlay.shape[2] != 4:
         raise ValueError("Overlay image must have an alpha channel (4 channels).")
 
-    overlay_height, overlay_width = overlay.shape[:2]
-
-    alpha_mask = overlay[:, :, 3] / 255.0
-    alpha_inv = 1.0 - alpha_mask
-    overlay_rgb = overlay[:, :, :3]
-
-    bg_height, bg_width = background.shape[:2]
-
-    y1, y2 = max(y, 0), min(y + overlay_height, bg_height)
-    x1, x2 = max(x, 0), min(x + overlay_width, bg_width)
-
-    if y1 >= y2 or x1 >= x2:
-        print("Overlay position is outside the background image. Skipping overlay.")
-        return background
-
-    overlay_y1 = max(0, -y)
-    overlay_y2 = overlay_height - max(0, y + overlay_height - bg_height)
-    overlay_x1 = max(0, -x)
-    overlay_x2 = overlay_width - max(0, x + overlay_width - bg_width)
-
-    roi = background[y1:y2, x1:x2].astype(float)
-    overlay_region = overlay_rgb[overlay_y1:overlay_y2, overlay_x1:overlay_x2].astype(float)
-    alpha = alpha_mask[overlay_y1:overlay_y2, overlay_x1:overlay_x2, np.newaxis]
-    alpha_inv_region = alpha_inv[overlay_y1:overlay_y2, overlay_x1:overlay_x2, np.newaxis]
-
-    blended = (alpha * overlay_region) + (alpha_inv_region * roi)
-    blended = blended.astype("uint8")
-
-    background[y1:y2, x1:x2] = blended
+    # Смешивание в целочисленной арифметике прямо в области фона
+    if not compositing.blend(background, overlay, x, y):
+        log.debug("Overlay position is outside the background image. Skipping overlay.")
+        metrics.inc("skipped_overlays_total", stage="composite")
 
     return background
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+    main(args.workers, args.frames_per_object, args.seed, args.cache_mb * 1024 * 1024, args.preload,
+         args.augment_preset, args.output_format, args.encoding, args.quality, args.shard_size,
+         tuple(args.annotations), args.objects_per_frame, args.metrics_dir, args.stream,
+         args.samples_per_frame, args.stream_memory_mb * 1024 * 1024, args.frame_interval, args.target_size,
+         args.samples, dict(args.quota or ()), args.object_index, args.min_object_coverage)
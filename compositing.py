@@ -0,0 +1,146 @@
+import cv2
+import numpy as np
+
+import profiling
+
+
+def clip_region(background_shape, overlay_shape, x, y):
+    """
+    Intersect an overlay placed at (x, y) with the background.
+
+    Returns (background_slices, overlay_slices) or None if they do not overlap.
+    """
+    bg_height, bg_width = background_shape[:2]
+    overlay_height, overlay_width = overlay_shape[:2]
+
+    y1, y2 = max(y, 0), min(y + overlay_height, bg_height)
+    x1, x2 = max(x, 0), min(x + overlay_width, bg_width)
+    if y1 >= y2 or x1 >= x2:
+        return None
+
+    overlay_y1, overlay_x1 = y1 - y, x1 - x
+    overlay_slices = (slice(overlay_y1, overlay_y1 + y2 - y1), slice(overlay_x1, overlay_x1 + x2 - x1))
+    return (slice(y1, y2), slice(x1, x2)), overlay_slices
+
+
+def visible_box(background_shape, overlay, x, y):
+    """
+    Bounding box [x, y, w, h] of the overlay's non-transparent pixels in
+    background coordinates, clipped to the background; None if nothing is visible.
+    """
+    region = clip_region(background_shape, overlay.shape, x, y)
+    if region is None:
+        return None
+    (bg_rows, bg_cols), overlay_slices = region
+    if overlay.shape[2] == 3:
+        return [bg_cols.start, bg_rows.start, bg_cols.stop - bg_cols.start, bg_rows.stop - bg_rows.start]
+    alpha = overlay[overlay_slices][:, :, 3]
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(alpha.any(axis=0))
+    return [int(bg_cols.start + cols[0]), int(bg_rows.start + rows[0]),
+            int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)]
+
+
+def _div255(values):
+    # Exact round(v / 255) for v in [0, 255 * 255] without a division
+    values += 128
+    values += values >> 8
+    values >>= 8
+    return values
+
+
+# Rows blended per step; keeps the uint16 temporaries small enough to stay in cache
+BLEND_ROWS = 16
+
+
+def _blend_rows(roi, overlay_rgb, alpha):
+    alpha = alpha[:, :, np.newaxis].astype(np.uint16)
+    blended = overlay_rgb.astype(np.uint16)
+    blended *= alpha
+    background = roi.astype(np.uint16)
+    np.subtract(255, alpha, out=alpha)
+    background *= alpha
+    blended += background
+    np.copyto(roi, _div255(blended), casting="unsafe")
+
+
+def _blend_numpy(roi, overlay_rgb, alpha):
+    for row in range(0, roi.shape[0], BLEND_ROWS):
+        rows = slice(row, row + BLEND_ROWS)
+        alpha_rows = alpha[rows]
+        # Fully transparent and fully opaque strips need no arithmetic
+        if not alpha_rows.any():
+            continue
+        if alpha_rows.min() == 255:
+            roi[rows] = overlay_rgb[rows]
+            continue
+        _blend_rows(roi[rows], overlay_rgb[rows], alpha_rows)
+
+
+def _blend_cv2(roi, overlay_rgb, alpha):
+    alpha = cv2.merge([alpha, alpha, alpha])
+    foreground = cv2.multiply(overlay_rgb, alpha, scale=1 / 255.0)
+    background = cv2.multiply(roi, cv2.bitwise_not(alpha), scale=1 / 255.0)
+    roi[...] = cv2.add(foreground, background)
+
+
+@profiling.hook("overlay")
+def blend(background, overlay, x=0, y=0, use_cv2=False):
+    """
+    Alpha-blend a BGRA (or opaque BGR) overlay onto a uint8 background in place.
+
+    The blend is done in 16-bit fixed point on the overlapping ROI only, so no
+    float copies of the frame are made. `use_cv2=True` runs the same blend
+    through OpenCV arithmetic (within one intensity level of the numpy path).
+
+    Args:
+        background (np.ndarray): HxWx3 uint8 image, modified in place.
+        overlay (np.ndarray): hxwx4 or hxwx3 uint8 image.
+        x (int), y (int): Position of the overlay's top-left corner; may be negative.
+
+    Returns:
+        bool: False if the overlay lies completely outside the background.
+    """
+    region = clip_region(background.shape, overlay.shape, x, y)
+    if region is None:
+        return False
+    background_slices, overlay_slices = region
+
+    roi = background[background_slices]
+    overlay_region = overlay[overlay_slices]
+    if overlay.shape[2] == 3:
+        roi[...] = overlay_region
+        return True
+
+    overlay_rgb = overlay_region[:, :, :3]
+    alpha = overlay_region[:, :, 3]
+    if use_cv2:
+        _blend_cv2(roi, np.ascontiguousarray(overlay_rgb), np.ascontiguousarray(alpha))
+    else:
+        _blend_numpy(roi, overlay_rgb, alpha)
+    return True
+
+
+def blend_each(background, placements, use_cv2=False):
+    """
+    Blend several overlays into one background, one blend() per overlay.
+
+    Each overlay gets its own ROI and strip temporaries. A variant that walks
+    the union of the ROIs once, sharing a uint16 copy of each background
+    strip, measured slower, because numpy's in-place arithmetic on strided
+    sub-views is slower than on the small contiguous copies blend() makes.
+
+    Args:
+        background (np.ndarray): HxWx3 uint8 image, modified in place.
+        placements (iterable): (overlay, x, y) tuples, blended in order so later
+            overlays end up on top.
+
+    Returns:
+        int: Number of overlays that intersected the background.
+    """
+    blended = 0
+    for overlay, x, y in placements:
+        blended += blend(background, overlay, x, y, use_cv2=use_cv2)
+    return blended
@@ -1,8 +1,68 @@
+"""
+Project configuration from config.ini.
+
+The file is found through an explicit path, the RAILROAD_CONFIG environment
+variable, or next to this module, independent of the working directory. It
+is read once per process by load(); worker processes are given the path of
+the parent's file and call load(path) themselves. The data folder is always
+an absolute path: a relative one is resolved against the directory of
+config.ini, and it defaults to data/. The Google keys are optional here and
+only checked by search_credentials(), so stages that never touch the network
+run without them.
+
+The module attributes DATA_FOLDER, API_KEY and SEARCH_ENGINE_ID are kept for
+existing callers and are resolved on first access.
+"""
+import os
 import configparser
+from collections import namedtuple
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.ini")
+DEFAULT_DATA_FOLDER = "data"
+
+Settings = namedtuple("Settings", ["path", "data_folder", "api_key", "search_engine_id"])
+
+_settings = None
+
+
+def read(path=None):
+    """Parse a config file into Settings without caching it."""
+    path = os.path.abspath(path or os.environ.get("RAILROAD_CONFIG") or DEFAULT_PATH)
+    parser = configparser.ConfigParser()
+    # A missing file leaves every option at its default
+    parser.read(path, encoding="utf-8")
+    section = parser["DEFAULT"]
+    data_folder = section.get("path_to_data_folder", "").strip() or DEFAULT_DATA_FOLDER
+    # The same file gives the same folder whatever the working directory
+    data_folder = os.path.join(os.path.dirname(path), data_folder)
+    return Settings(path, os.path.normpath(data_folder),
+                    section.get("google_api_key", "").strip() or None,
+                    section.get("custom_search_engine_id", "").strip() or None)
+
+
+def load(path=None):
+    """
+    Settings of this process. The first call (or the first call with a path)
+    reads the file; later calls without a path return the same Settings.
+    """
+    global _settings
+    if path is not None or _settings is None:
+        _settings = read(path)
+    return _settings
+
+
+def search_credentials(settings=None):
+    """(api key, search engine id) for the Custom Search API; raises if either is missing."""
+    settings = settings or load()
+    if not settings.api_key or not settings.search_engine_id:
+        raise ValueError(f"google_api_key and custom_search_engine_id must be set in {settings.path} "
+                         f"to download images")
+    return settings.api_key, settings.search_engine_id
 
-config = configparser.ConfigParser()
-config.read("config.ini")
 
-API_KEY = config["DEFAULT"]["google_api_key"]
-SEARCH_ENGINE_ID = config["DEFAULT"]["custom_search_engine_id"]
-DATA_FOLDER = config["DEFAULT"]["path_to_data_folder"]
\ No newline at end of file
+def __getattr__(name):
+    # Lazy module attributes for code written against the old import-time constants
+    attributes = {"DATA_FOLDER": "data_folder", "API_KEY": "api_key", "SEARCH_ENGINE_ID": "search_engine_id"}
+    if name in attributes:
+        return getattr(load(), attributes[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
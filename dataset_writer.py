@@ -0,0 +1,223 @@
+"""
+Streaming writer for synthetic samples.
+
+Samples are packed into tar shards in the WebDataset layout: every sample is
+stored as `<key>.<ext>` (the encoded image), `<key>.json` (metadata and boxes)
+and, optionally, `<key>.txt` (YOLO labels). COCO annotations for the whole run
+are streamed to `annotations_coco.json` next to the shards, so neither the
+images nor the annotations are held in memory. Opening a writer removes the
+shards and annotation files of an earlier run in the same folder, so a
+shorter run does not leave stale shards mixed into the dataset.
+"""
+import os
+import io
+import glob
+import json
+import logging
+import tarfile
+import time
+
+import cv2
+
+import profiling
+
+log = logging.getLogger(__name__)
+
+ENCODINGS = {"jpg": ".jpg", "png": ".png", "webp": ".webp"}
+ANNOTATION_FORMATS = ("coco", "yolo")
+
+
+@profiling.hook("encode")
+def encode_image(image, encoding="jpg", quality=95):
+    """Encode an image to bytes with OpenCV."""
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding '{encoding}', expected one of {tuple(ENCODINGS)}")
+    params = []
+    if encoding == "jpg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif encoding == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    ok, buffer = cv2.imencode(ENCODINGS[encoding], image, params)
+    if not ok:
+        raise ValueError(f"Failed to encode image as {encoding}")
+    return buffer.tobytes()
+
+
+def make_sample(key, image, boxes, encoding="jpg", quality=95, metadata=None):
+    """
+    Build a sample record ready for ShardWriter.write.
+
+    Args:
+        key (str): Unique sample key without dots.
+        image (np.ndarray): Composited BGR image.
+        boxes (list): [{"category": name, "bbox": [x, y, w, h]}] in pixels.
+        metadata (dict): Extra fields stored in the sample's JSON.
+    """
+    height, width = image.shape[:2]
+    return {
+        "key": key,
+        "data": encode_image(image, encoding, quality),
+        "ext": encoding,
+        "width": width,
+        "height": height,
+        "boxes": boxes,
+        "metadata": metadata or {},
+    }
+
+
+def yolo_labels(sample, category_ids):
+    lines = []
+    for box in sample["boxes"]:
+        x, y, w, h = box["bbox"]
+        lines.append(f"{category_ids[box['category']]} {(x + w / 2) / sample['width']:.6f} "
+                     f"{(y + h / 2) / sample['height']:.6f} {w / sample['width']:.6f} {h / sample['height']:.6f}")
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+class ShardWriter:
+    """
+    Write samples into size-bounded tar shards plus COCO/YOLO annotations.
+
+    Args:
+        output_dir (str): Folder for the shards and annotation files.
+        categories (list): Category names; YOLO ids are list positions and COCO
+            ids are positions + 1.
+        max_samples (int): Samples per shard.
+        max_bytes (int): Approximate byte limit per shard.
+        annotations (tuple): Any of "coco" and "yolo".
+
+    Boxes whose category is not in categories are left out of the sample and
+    counted in skipped_boxes, with one warning per unknown category.
+    """
+
+    def __init__(self, output_dir, categories, prefix="shard", max_samples=1000, max_bytes=1024 ** 3,
+                 annotations=ANNOTATION_FORMATS):
+        for annotation_format in annotations:
+            if annotation_format not in ANNOTATION_FORMATS:
+                raise ValueError(f"Unknown annotation format '{annotation_format}'")
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_samples = max_samples
+        self.max_bytes = max_bytes
+        self.annotations = annotations
+        self.category_ids = {name: idx for idx, name in enumerate(categories)}
+        self.categories = list(categories)
+
+        self.shard_index = -1
+        self.shard_samples = 0
+        self.shard_bytes = 0
+        self.samples = 0
+        self.boxes = 0
+        self.skipped_boxes = 0
+        self._unknown_categories = set()
+        self._tar = None
+        self._shard_name = None
+
+        os.makedirs(output_dir, exist_ok=True)
+        # Outputs of an earlier run; the shard set is always rewritten as a whole
+        stale = glob.glob(os.path.join(glob.escape(output_dir), glob.escape(prefix) + "-*.tar"))
+        stale += [os.path.join(output_dir, name) for name in ("annotations_coco.json", "classes.txt")]
+        for path in stale:
+            if os.path.isfile(path):
+                os.remove(path)
+        self._coco_images = None
+        self._coco_annotations = None
+        if "coco" in annotations:
+            # Streamed into temporary parts and joined on close
+            self._coco_images = open(os.path.join(output_dir, ".coco_images.part"), "w", encoding="utf-8")
+            self._coco_annotations = open(os.path.join(output_dir, ".coco_annotations.part"), "w", encoding="utf-8")
+
+    def _next_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+        self.shard_index += 1
+        self.shard_samples = 0
+        self.shard_bytes = 0
+        self._shard_name = f"{self.prefix}-{self.shard_index:06d}.tar"
+        self._tar = tarfile.open(os.path.join(self.output_dir, self._shard_name), "w")
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        self.shard_bytes += len(data)
+
+    def write(self, sample):
+        """Append one sample (see make_sample) to the current shard."""
+        boxes = [box for box in sample["boxes"] if box["category"] in self.category_ids]
+        if len(boxes) < len(sample["boxes"]):
+            for box in sample["boxes"]:
+                if box["category"] not in self.category_ids and box["category"] not in self._unknown_categories:
+                    self._unknown_categories.add(box["category"])
+                    log.warning(f"Boxes of unknown category '{box['category']}' are left out of the annotations")
+            self.skipped_boxes += len(sample["boxes"]) - len(boxes)
+            sample = dict(sample, boxes=boxes)
+
+        if self._tar is None or self.shard_samples >= self.max_samples or self.shard_bytes >= self.max_bytes:
+            self._next_shard()
+
+        key = sample["key"]
+        file_name = f"{key}.{sample['ext']}"
+        metadata = dict(sample["metadata"], width=sample["width"], height=sample["height"],
+                        boxes=[dict(box, category_id=self.category_ids[box["category"]])
+                               for box in sample["boxes"]])
+        self._add_member(file_name, sample["data"])
+        self._add_member(f"{key}.json", json.dumps(metadata).encode("utf-8"))
+        if "yolo" in self.annotations:
+            self._add_member(f"{key}.txt", yolo_labels(sample, self.category_ids).encode("utf-8"))
+
+        if self._coco_images is not None:
+            image_id = self.samples + 1
+            separator = "," if self.samples else ""
+            self._coco_images.write(separator + json.dumps({
+                "id": image_id, "file_name": f"{self._shard_name}/{file_name}",
+                "width": sample["width"], "height": sample["height"]}))
+            for box in sample["boxes"]:
+                x, y, w, h = box["bbox"]
+                separator = "," if self.boxes else ""
+                self.boxes += 1
+                self._coco_annotations.write(separator + json.dumps({
+                    "id": self.boxes, "image_id": image_id, "category_id": self.category_ids[box["category"]] + 1,
+                    "bbox": [x, y, w, h], "area": w * h, "iscrowd": 0}))
+        else:
+            self.boxes += len(sample["boxes"])
+
+        self.shard_samples += 1
+        self.samples += 1
+
+    def _write_coco(self):
+        images_path = self._coco_images.name
+        annotations_path = self._coco_annotations.name
+        self._coco_images.close()
+        self._coco_annotations.close()
+        categories = [{"id": idx + 1, "name": name} for idx, name in enumerate(self.categories)]
+        with open(os.path.join(self.output_dir, "annotations_coco.json"), "w", encoding="utf-8") as f:
+            f.write('{"images":[')
+            with open(images_path, "r", encoding="utf-8") as part:
+                for chunk in iter(lambda: part.read(1024 * 1024), ""):
+                    f.write(chunk)
+            f.write('],"annotations":[')
+            with open(annotations_path, "r", encoding="utf-8") as part:
+                for chunk in iter(lambda: part.read(1024 * 1024), ""):
+                    f.write(chunk)
+            f.write('],"categories":' + json.dumps(categories) + "}")
+        os.remove(images_path)
+        os.remove(annotations_path)
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+        if self._coco_images is not None:
+            self._write_coco()
+            self._coco_images = None
+        if "yolo" in self.annotations:
+            with open(os.path.join(self.output_dir, "classes.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(self.categories) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
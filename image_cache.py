@@ -0,0 +1,270 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import profiling
+
+# Default per-process budget for decoded images kept in memory.
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+STORE_DATA_SUFFIX = ".bin"
+STORE_INDEX_SUFFIX = ".json"
+
+# Decode flags that let libjpeg produce a 1/2, 1/4 or 1/8 size image directly, largest factor first
+REDUCED_FLAGS = {
+    cv2.IMREAD_COLOR: ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                       (2, cv2.IMREAD_REDUCED_COLOR_2)),
+    cv2.IMREAD_GRAYSCALE: ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                           (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)),
+}
+
+
+def fit_max_side(image, max_side):
+    """Shrink an image so that its longer side is at most max_side pixels (never enlarges)."""
+    if image is None or not max_side or max(image.shape[:2]) <= max_side:
+        return image
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def image_size(path):
+    """(width, height) read from the file header without decoding, or None."""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, ValueError):
+        return None
+
+
+def decode(path, flags=cv2.IMREAD_COLOR, max_side=None):
+    """
+    cv2.imread, shrunk to at most max_side pixels on the longer side. JPEGs are
+    decoded at 1/2, 1/4 or 1/8 scale when that still leaves max_side pixels,
+    so the full-resolution image is never produced.
+    """
+    if not max_side:
+        return cv2.imread(path, flags)
+    size = image_size(path)
+    for factor, reduced in REDUCED_FLAGS.get(flags, ()):
+        if size is not None and max(size) // factor >= max_side:
+            flags = reduced
+            break
+    return fit_max_side(cv2.imread(path, flags), max_side)
+
+
+class LRUImageCache:
+    """
+    Least-recently-used cache of decoded images, bounded by total pixel bytes.
+
+    Cached arrays are marked read-only; callers that need to draw on an image
+    must copy it first.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, flags=cv2.IMREAD_COLOR, max_side=None):
+        """Return the decoded image for path, decoding it on a miss."""
+        key = (path, flags, max_side)
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        image = decode(path, flags, max_side)
+        if image is None:
+            return None
+        image.setflags(write=False)
+        self.put(key, image)
+        return image
+
+    def put(self, key, image):
+        """Insert a decoded image and evict the oldest entries over budget."""
+        if image.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = image
+            self.current_bytes += image.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SharedImageStore:
+    """
+    Read-only store of pre-decoded images backed by one memory-mapped file.
+
+    The pixel data lives in `<store_path>.bin` and the per-image offsets and
+    shapes in `<store_path>.json`. Worker processes that open the same store
+    share the pages through the OS page cache instead of decoding again.
+    """
+
+    def __init__(self, store_path):
+        with open(store_path + STORE_INDEX_SUFFIX, "r", encoding="utf-8") as f:
+            self.index = json.load(f)["images"]
+        data_path = store_path + STORE_DATA_SUFFIX
+        if os.path.getsize(data_path) > 0:
+            self.data = np.memmap(data_path, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+
+    def get(self, path, flags=cv2.IMREAD_COLOR, max_side=None):
+        entry = self.index.get(path)
+        if entry is None or entry.get("failed") or entry["flags"] != flags or entry.get("max_side") != max_side:
+            return None
+        size = int(np.prod(entry["shape"]))
+        offset = entry["offset"]
+        return self.data[offset:offset + size].reshape(entry["shape"])
+
+    def __contains__(self, path):
+        return path in self.index and not self.index[path].get("failed")
+
+    def __len__(self):
+        """Number of decoded images; sources that failed to decode are not counted."""
+        return sum(not entry.get("failed") for entry in self.index.values())
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _source(source):
+    # Sources are (path, flags) or (path, flags, max_side)
+    path, flags, *rest = source
+    return path, flags, rest[0] if rest else None
+
+
+def store_is_current(store_path, sources):
+    """Check whether an existing store covers exactly these (path, flags[, max_side]) sources."""
+    try:
+        with open(store_path + STORE_INDEX_SUFFIX, "r", encoding="utf-8") as f:
+            index = json.load(f)["images"]
+    except (OSError, ValueError, KeyError):
+        return False
+    if len(index) != len(sources):
+        return False
+    try:
+        for path, flags, max_side in map(_source, sources):
+            entry = index.get(path)
+            if (entry is None or entry["flags"] != flags or entry.get("max_side") != max_side
+                    or entry["stamp"] != _source_stamp(path)):
+                return False
+    except OSError:
+        return False
+    return True
+
+
+def build_store(store_path, sources, threads=None):
+    """
+    Decode every (path, flags[, max_side]) source and write the pixels into a shared store.
+
+    Images that fail to decode are recorded as failed, with their stamp, so
+    the store stays current while the file is unchanged; readers fall back to
+    a normal decode (and report the error) for them.
+    """
+    if store_is_current(store_path, sources):
+        return SharedImageStore(store_path)
+
+    os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+    index = {}
+    offset = 0
+
+    def decode_source(source):
+        path, flags, max_side = _source(source)
+        return path, flags, max_side, decode(path, flags, max_side)
+
+    with open(store_path + STORE_DATA_SUFFIX, "wb") as data_file, \
+            ThreadPoolExecutor(threads or os.cpu_count() or 1) as pool:
+        # cv2.imread releases the GIL, so threads decode in parallel
+        for path, flags, max_side, image in pool.map(decode_source, sources):
+            if image is None:
+                index[path] = {"failed": True, "flags": flags, "max_side": max_side,
+                               "stamp": _source_stamp(path) if os.path.exists(path) else None}
+                continue
+            image = np.ascontiguousarray(image)
+            data_file.write(image.tobytes())
+            index[path] = {
+                "offset": offset,
+                "shape": list(image.shape),
+                "flags": flags,
+                "max_side": max_side,
+                "stamp": _source_stamp(path),
+            }
+            offset += image.nbytes
+
+    with open(store_path + STORE_INDEX_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump({"images": index}, f)
+    return SharedImageStore(store_path)
+
+
+# Process-wide state used by imread(); configured once per worker.
+_cache = None
+_store = None
+
+
+def configure(max_bytes=DEFAULT_CACHE_BYTES, store_path=None):
+    """Set up the process-wide cache and, optionally, open a shared store."""
+    global _cache, _store
+    _cache = LRUImageCache(max_bytes) if max_bytes > 0 else None
+    _store = SharedImageStore(store_path) if store_path else None
+
+
+def snapshot():
+    """The process-wide cache and store, to be put back with restore()."""
+    return _cache, _store
+
+
+def restore(state):
+    global _cache, _store
+    _cache, _store = state
+
+
+@profiling.hook("decode")
+def imread(path, flags=cv2.IMREAD_COLOR, max_side=None):
+    """
+    Drop-in replacement for cv2.imread that serves decoded pixels from the
+    shared store or the LRU cache. The returned array is read-only whenever it
+    comes from either of them. With max_side the image is decoded at reduced
+    size (see decode()).
+    """
+    if _store is not None:
+        image = _store.get(path, flags, max_side)
+        if image is not None:
+            return image
+    if _cache is not None:
+        return _cache.get(path, flags, max_side)
+    return decode(path, flags, max_side)
+
+
+def cache_stats():
+    if _cache is None:
+        return {"hits": 0, "misses": 0, "bytes": 0, "items": 0}
+    return {"hits": _cache.hits, "misses": _cache.misses,
+            "bytes": _cache.current_bytes, "items": len(_cache)}
@@ -0,0 +1,204 @@
+import os
+import json
+import threading
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 8
+# Hashes the index has room for before its array first grows
+INITIAL_CAPACITY = 1024
+
+# Popcount of every byte value, used when numpy has no bitwise_count
+_POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """
+    Compute a 64-bit difference hash of an image.
+
+    The image is reduced to a (hash_size + 1) x hash_size grayscale thumbnail
+    and each bit records whether a pixel is brighter than its left neighbour,
+    so the hash survives re-encoding, small resizes and brightness shifts.
+    """
+    if image.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        image = cv2.cvtColor(image, code)
+    thumbnail = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def popcount(values):
+    """Number of set bits in each element of a uint64 array."""
+    values = np.asarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def hamming_distance(first, second):
+    return bin(first ^ second).count("1")
+
+
+class HashIndex:
+    """
+    Perceptual-hash index with vectorized Hamming-distance lookup.
+
+    Hashes are kept in a uint64 array, so a lookup is one XOR and popcount
+    over the whole index. The array grows by doubling its capacity and new
+    hashes are written in place, so adding N hashes costs O(N) copies. Keys
+    are stored relative to `root` when given, so the index file can move
+    together with the tree it describes; a key -> position dict makes
+    membership and removal O(1).
+    """
+
+    def __init__(self, path=None, root=None):
+        self.path = path
+        self.root = root
+        self.keys = []
+        self._positions = {}
+        self._array = np.zeros(INITIAL_CAPACITY, dtype=np.uint64)
+        self._count = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def _key(self, file_path):
+        return os.path.relpath(file_path, self.root) if self.root else file_path
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        self.keys = list(entries)
+        self._positions = {key: position for position, key in enumerate(self.keys)}
+        self._array = np.array([int(value, 16) for value in entries.values()], dtype=np.uint64)
+        self._count = len(self._array)
+
+    def save(self):
+        with self._lock:
+            entries = {key: f"{int(value):016x}" for key, value in zip(self.keys, self._array[:self._count])}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=0)
+        os.replace(temp_path, self.path)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, file_path):
+        return self._key(file_path) in self._positions
+
+    def _hash_array(self):
+        return self._array[:self._count]
+
+    def _append(self, file_path, value):
+        if self._count == len(self._array):
+            grown = np.zeros(max(2 * len(self._array), INITIAL_CAPACITY), dtype=np.uint64)
+            grown[:self._count] = self._array[:self._count]
+            self._array = grown
+        self._array[self._count] = value
+        self._count += 1
+        key = self._key(file_path)
+        self._positions[key] = len(self.keys)
+        self.keys.append(key)
+
+    def nearest(self, value):
+        """Return (key, distance) of the closest stored hash, or (None, None) if empty."""
+        with self._lock:
+            hashes = self._hash_array()
+            if len(hashes) == 0:
+                return None, None
+            distances = popcount(hashes ^ np.uint64(value))
+            best = int(np.argmin(distances))
+            return self.keys[best], int(distances[best])
+
+    def find_duplicate(self, value, max_distance):
+        """Return the key of a stored hash within max_distance bits, or None."""
+        key, distance = self.nearest(value)
+        return key if distance is not None and distance <= max_distance else None
+
+    def add(self, file_path, value):
+        with self._lock:
+            self._append(file_path, value)
+
+    def remove(self, file_path):
+        """Forget a file, e.g. one whose write failed after add_if_new; returns whether it was indexed."""
+        with self._lock:
+            position = self._positions.pop(self._key(file_path), None)
+            if position is None:
+                return False
+            # The last hash takes the freed slot
+            last = self._count - 1
+            if position != last:
+                self.keys[position] = self.keys[last]
+                self._array[position] = self._array[last]
+                self._positions[self.keys[position]] = position
+            self.keys.pop()
+            self._count = last
+            return True
+
+    def _prune(self, keys):
+        # Drops many keys in one pass, keeping the order of the others
+        with self._lock:
+            keep = np.array([key not in keys for key in self.keys], dtype=bool)
+            self._array = np.concatenate([self._array[:self._count][keep],
+                                          np.zeros(INITIAL_CAPACITY, dtype=np.uint64)])
+            self.keys = [key for key in self.keys if key not in keys]
+            self._positions = {key: position for position, key in enumerate(self.keys)}
+            self._count = len(self.keys)
+
+    def add_if_new(self, file_path, value, max_distance):
+        """
+        Atomically add a hash unless a near-duplicate is already indexed.
+
+        Returns the key of the existing duplicate, or None if the hash was added.
+        """
+        with self._lock:
+            hashes = self._hash_array()
+            if len(hashes):
+                distances = popcount(hashes ^ np.uint64(value))
+                best = int(np.argmin(distances))
+                if distances[best] <= max_distance:
+                    return self.keys[best]
+            self._append(file_path, value)
+            return None
+
+    def _under(self, key, root):
+        path = os.path.abspath(os.path.join(self.root, key) if self.root else key)
+        root = os.path.abspath(root)
+        return os.path.commonpath([path, root]) == root
+
+    def update_from_tree(self, root, extensions=(".jpg", ".jpeg", ".png")):
+        """
+        Hash every image under root that is not indexed yet, and forget indexed
+        files under root that no longer exist. A pruned index is saved at once.
+
+        Returns:
+            tuple: (hashes added, keys removed)
+        """
+        found = set()
+        added = 0
+        for folder, _, files in os.walk(root):
+            for file in sorted(files):
+                if not file.lower().endswith(extensions):
+                    continue
+                file_path = os.path.join(folder, file)
+                key = self._key(file_path)
+                if key in self._positions:
+                    found.add(key)
+                    continue
+                image = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+                if image is None:
+                    continue
+                self.add(file_path, dhash(image))
+                found.add(key)
+                added += 1
+
+        missing = {key for key in self.keys if key not in found and self._under(key, root)}
+        if missing:
+            self._prune(missing)
+            if self.path:
+                self.save()
+        return added, len(missing)
@@ -0,0 +1,150 @@
+"""
+Lazy, class-balanced schedule of compositing jobs.
+
+schedule() yields exactly `total` (frame, objects) pairs without building a
+list, so memory depends on the number of categories and not on the length
+of the run.
+
+* Every category gets a quota. A category with an explicit quota gets that
+  count. The remaining samples are split between the other categories in
+  proportion to their registry weights, with largest-remainder rounding so
+  that the quotas add up to the total. Categories are interleaved by stride
+  scheduling, so every prefix of the run is balanced as well.
+* Within a category the objects are used in turn. Their order is reshuffled
+  every cycle, and no object is used twice before all others have been used.
+* Frames are cycled the same way across the whole run, so every background
+  is used floor(total / frames) or ceil(total / frames) times.
+
+Cycle orders are affine permutations (a * i + b) mod n, with a coprime to n,
+drawn from the seed and the cycle number. They need O(1) memory however many
+frames or objects there are.
+"""
+import math
+import heapq
+
+import numpy as np
+
+# Chunks per worker process for Pool.imap; more chunks balance uneven jobs better
+CHUNKS_PER_WORKER = 4
+MAX_CHUNK_SIZE = 64
+
+
+def category_quotas(total, weights, quotas=None):
+    """
+    Split total samples between categories.
+
+    Args:
+        total (int): Samples in the run.
+        weights (dict): {category: relative weight}.
+        quotas (dict): {category: exact count} for some categories; the rest
+            of total is split between the others in proportion to weights.
+
+    Returns:
+        dict: {category: count}, in the order of weights, summing to total.
+    """
+    quotas = dict(quotas or {})
+    unknown = set(quotas) - set(weights)
+    if unknown:
+        raise ValueError(f"Quotas for unknown categories: {', '.join(sorted(unknown))}")
+    remaining = total - sum(quotas.values())
+    if remaining < 0:
+        raise ValueError(f"Category quotas add up to {sum(quotas.values())}, more than {total} samples")
+    shared = {name: weight for name, weight in weights.items() if name not in quotas and weight > 0}
+    if remaining and not shared:
+        raise ValueError(f"{remaining} samples left after quotas, but no other category has a positive weight")
+
+    counts = {}
+    if shared:
+        weight_sum = sum(shared.values())
+        exact = {name: remaining * weight / weight_sum for name, weight in shared.items()}
+        counts = {name: int(value) for name, value in exact.items()}
+        # Largest remainder: the samples lost to rounding down go to the largest fractions
+        leftover = remaining - sum(counts.values())
+        for name in sorted(exact, key=lambda name: counts[name] - exact[name])[:leftover]:
+            counts[name] += 1
+    return {name: quotas.get(name, counts.get(name, 0)) for name in weights}
+
+
+def interleave(quotas):
+    """
+    Yield category names, each as many times as its quota, spread evenly:
+    the k-th use of a category with quota q is placed at (k + 0.5) / q.
+    """
+    order = {name: i for i, name in enumerate(quotas)}
+    heap = [(0.5 / count, order[name], name, 0) for name, count in quotas.items() if count > 0]
+    heapq.heapify(heap)
+    while heap:
+        _, rank, name, used = heapq.heappop(heap)
+        yield name
+        used += 1
+        if used < quotas[name]:
+            heapq.heappush(heap, ((used + 0.5) / quotas[name], rank, name, used))
+
+
+class CyclicOrder:
+    """
+    Random access to the k-th item of an endless sequence that visits all n
+    items once per cycle, in a new order every cycle. seed is a tuple of ints.
+    """
+
+    def __init__(self, items, seed):
+        self.items = items
+        self.seed = tuple(seed)
+        self._cycle = None
+        self._affine = None
+
+    def _permutation(self, cycle):
+        n = len(self.items)
+        rng = np.random.default_rng([*self.seed, cycle])
+        if n == 1:
+            return 1, 0
+        while True:
+            a = int(rng.integers(1, n))
+            if math.gcd(a, n) == 1:
+                return a, int(rng.integers(n))
+
+    def __getitem__(self, k):
+        cycle, position = divmod(k, len(self.items))
+        if cycle != self._cycle:
+            self._cycle, self._affine = cycle, self._permutation(cycle)
+        a, b = self._affine
+        return self.items[(a * position + b) % len(self.items)]
+
+
+def schedule(frames, objects, total, weights=None, quotas=None, objects_per_frame=1, seed=0):
+    """
+    Yield total (frame, ((object, category), ...)) pairs.
+
+    Args:
+        frames (list): Background frame paths.
+        objects (dict): {category: [object paths]}; categories without
+            objects are left out.
+        total (int): Samples to schedule.
+        weights (dict): {category: weight}; equal weights by default.
+        quotas (dict): {category: exact count of object instances}.
+        objects_per_frame (int): Objects per sample; quotas count object
+            instances, so they add up to total * objects_per_frame.
+    """
+    if not frames:
+        raise ValueError("No background frames to schedule")
+    objects = {name: paths for name, paths in objects.items() if paths}
+    weights = {name: (weights or {}).get(name, 1.0) for name in objects}
+    counts = category_quotas(total * objects_per_frame, weights, quotas)
+    frame_order = CyclicOrder(frames, (seed, 0))
+    object_orders = {name: CyclicOrder(paths, (seed, 1, i)) for i, (name, paths) in enumerate(objects.items())}
+    used = dict.fromkeys(objects, 0)
+
+    categories = interleave(counts)
+    for index in range(total):
+        picks = []
+        for name in categories:
+            picks.append((object_orders[name][used[name]], name))
+            used[name] += 1
+            if len(picks) == objects_per_frame:
+                break
+        yield frame_order[index], tuple(picks)
+
+
+def chunk_size(total, workers):
+    """Pool.imap chunk size: a few chunks per worker, capped so results keep flowing."""
+    return max(1, min(MAX_CHUNK_SIZE, total // (max(workers, 1) * CHUNKS_PER_WORKER)))
@@ -1,17 +1,11 @@
-import subprocess
 import os
+import sys
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
 
-scripts = [
-    "background_capture_frames.py",
-    "object_download.py",
-    "object_remove_background.py",
-    "object_augment.py",
-    "combine_background_and_object.py"
-]
+import pipeline
 
-for script in scripts:
-    script_path = os.path.join(BASE_DIR, script)
-    print(f"\n▶️ Запуск: {script_path}")
-    subprocess.run(["python", script_path])
+# Все этапы выполняются в одном процессе; каждый обрабатывает только новые или изменённые входные данные
+if __name__ == "__main__":
+    pipeline.main()
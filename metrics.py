@@ -0,0 +1,240 @@
+"""
+Counters and histograms for the pipeline stages, aggregated across processes.
+
+Every process records into its own in-memory registry, which costs a dict
+update per call. When a metrics directory is configured (configure() or the
+RAILROAD_METRICS_DIR environment variable, inherited by worker processes),
+each process periodically writes a snapshot of its registry to <pid>.json
+there. report() merges the snapshots of all processes with the caller's own
+and writes them as a Prometheus text file (metrics.prom) that can be picked
+up by the node exporter's textfile collector, and returns a short summary.
+
+    metrics.inc("items_total", stage="composite")
+    with metrics.timer("item_seconds", stage="composite"):
+        ...
+"""
+import os
+import sys
+import json
+import time
+import glob
+import logging
+import threading
+import contextlib
+import multiprocessing.util
+
+log = logging.getLogger(__name__)
+
+PREFIX = "railroad_"
+PROMETHEUS_FILE = "metrics.prom"
+FLUSH_INTERVAL = 5.0
+# Upper bounds in seconds; the last bucket is +Inf
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_directory = None
+_counters = {}
+_histograms = {}
+_last_flush = 0.0
+_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def configure(directory=None, reset=False):
+    """
+    Write this process's snapshots to directory (and let worker processes do the same).
+    With reset=True, snapshots left by earlier runs are removed first.
+    """
+    global _directory, _last_flush
+    _directory = directory or os.environ.get("RAILROAD_METRICS_DIR") or None
+    _last_flush = time.monotonic()
+    if _directory is None:
+        return
+    os.environ["RAILROAD_METRICS_DIR"] = _directory
+    os.makedirs(_directory, exist_ok=True)
+    if reset:
+        for path in glob.glob(os.path.join(_directory, "*.json")):
+            os.remove(path)
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _maybe_flush()
+
+
+def observe(name, value, **labels):
+    """Record one value (usually seconds) in a histogram."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0}
+        bucket = 0
+        while bucket < len(BUCKETS) and value > BUCKETS[bucket]:
+            bucket += 1
+        histogram["buckets"][bucket] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+    _maybe_flush()
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """Observe the duration of the block in seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def snapshot():
+    """This process's metrics as a JSON-serializable dict."""
+    with _lock:
+        return {
+            "counters": [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            "histograms": [[name, dict(labels), dict(histogram, buckets=list(histogram["buckets"]))]
+                           for (name, labels), histogram in _histograms.items()],
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def merge(snapshots):
+    """Sum snapshots into ({key: value}, {key: histogram}) keyed by (name, labels)."""
+    counters = {}
+    histograms = {}
+    for data in snapshots:
+        for name, labels, value in data["counters"]:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in data["histograms"]:
+            key = _key(name, labels)
+            total = histograms.setdefault(key, {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0})
+            total["buckets"] = [a + b for a, b in zip(total["buckets"], histogram["buckets"])]
+            total["sum"] += histogram["sum"]
+            total["count"] += histogram["count"]
+    return counters, histograms
+
+
+def flush():
+    """Write this process's snapshot to the metrics directory, if one is configured."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    if _directory is None:
+        return
+    path = os.path.join(_directory, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def _maybe_flush():
+    if _directory is not None and time.monotonic() - _last_flush > FLUSH_INTERVAL:
+        flush()
+
+
+def collect():
+    """Merged metrics of this process and every snapshot in the metrics directory."""
+    snapshots = [snapshot()]
+    if _directory is not None:
+        own = os.path.join(_directory, f"{os.getpid()}.json")
+        for path in glob.glob(os.path.join(_directory, "*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                log.warning(f"Skipping unreadable metrics snapshot {path}: {e}")
+    return merge(snapshots)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def prometheus_text(counters, histograms):
+    """Render merged metrics in the Prometheus text exposition format."""
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {PREFIX}{name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(BUCKETS) + ["+Inf"], histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def quantile(histogram, q):
+    """Approximate quantile of a histogram: the upper bound of the bucket that contains it."""
+    target = q * histogram["count"]
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram["buckets"]):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+
+def summary(counters, histograms):
+    """One line per metric: counter totals and histogram count/mean/p50/p99."""
+    lines = []
+    for (name, labels), value in sorted(counters.items()):
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        if histogram["count"]:
+            lines.append(f"{name}{_format_labels(labels)} count={histogram['count']} "
+                         f"mean={histogram['sum'] / histogram['count'] * 1000:.1f}ms "
+                         f"p50<={quantile(histogram, 0.5) * 1000:g}ms p99<={quantile(histogram, 0.99) * 1000:g}ms")
+    return "\n".join(lines)
+
+
+def report(path=None):
+    """
+    Merge the metrics of all processes and write them to a Prometheus text file
+    (by default metrics.prom in the metrics directory). Returns the summary text.
+    """
+    counters, histograms = collect()
+    path = path or (os.path.join(_directory, PROMETHEUS_FILE) if _directory else None)
+    if path is not None:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(prometheus_text(counters, histograms))
+        os.replace(path + ".tmp", path)
+    return summary(counters, histograms)
+
+
+def _after_fork(_module):
+    # Children start from an empty registry and write their last snapshot on exit;
+    # multiprocessing children leave through os._exit, which skips atexit
+    reset()
+    if _directory is not None:
+        multiprocessing.util.Finalize(None, flush, exitpriority=0)
+
+
+multiprocessing.util.register_after_fork(sys.modules[__name__], _after_fork)
+
+if os.environ.get("RAILROAD_METRICS_DIR"):
+    configure()
@@ -1,27 +1,26 @@
-import albumentations as A
+import os
+import time
+import argparse
+
 import cv2
 import numpy as np
 
-def augment_object(image):
-    if image is None:
-        raise ValueError("Input image is None")
- 
-    # Разделяем изображение и альфа-канал
-    original_alpha = None
-    if image.shape[2] == 4:
-        b, g, r, original_alpha = cv2.split(image)
-        rgb = cv2.merge([b, g, r])
-    elif image.shape[2] == 3:
-        rgb = image.copy()
-        original_alpha = np.ones_like(rgb[:, :, 0]) * 255  # Создаем непрозрачный альфа-канал
-    else:
-        raise ValueError(f"Unsupported number of channels: {image.shape[2]}")
+import compositing
+import profiling
+
+PRESETS = ("full", "cheap")
+# Дорогие геометрические искажения, которые отключает пресет "cheap"
+COSTLY_TRANSFORMS = ("ElasticTransform", "GridDistortion", "OpticalDistortion")
+
 
-    # Преобразуем в RGB для Albumentations
-    rgb = cv2.cvtColor(rgb, cv2.COLOR_BGR2RGB)
+def build_pipeline(preset="full"):
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown augmentation preset '{preset}', expected one of {PRESETS}")
+    # albumentations (и scipy за ним) импортируется только там, где строится пайплайн
+    import albumentations as A
 
     # Определяем аугментации с учетом альфа-канала
-    transform = A.Compose([
+    transforms = [
         A.HorizontalFlip(p=0.5),
         A.VerticalFlip(p=0.5),
         A.RandomRotate90(p=0.5),
@@ -39,54 +38,120 @@ def augment_object(image):
         A.ElasticTransform(p=0.2),
         A.GridDistortion(p=0.2),
         A.OpticalDistortion(p=0.2),
-    ], additional_targets={'mask': 'mask'})
+    ]
+    if preset == "cheap":
+        transforms = [t for t in transforms if type(t).__name__ not in COSTLY_TRANSFORMS]
+
+    return A.Compose(transforms, additional_targets={'mask': 'mask'})
+
+
+# Пайплайн строится один раз на процесс и переиспользуется всеми вызовами
+PIPELINE = None
+PIPELINE_PRESET = "full"
 
-    # Применяем аугментации
-    augmented = transform(image=rgb, mask=original_alpha)
-    aug_rgb = augmented['image']
-    aug_alpha = augmented['mask']
 
+def configure(preset="full"):
+    global PIPELINE, PIPELINE_PRESET
+    PIPELINE = build_pipeline(preset)
+    PIPELINE_PRESET = preset
+    return PIPELINE
+
+
+def snapshot():
+    # Текущий пайплайн и пресет процесса, чтобы вернуть их через restore()
+    return PIPELINE, PIPELINE_PRESET
+
+
+def restore(state):
+    global PIPELINE, PIPELINE_PRESET
+    PIPELINE, PIPELINE_PRESET = state
+
+
+def get_pipeline():
+    if PIPELINE is None:
+        configure(PIPELINE_PRESET)
+    return PIPELINE
+
+
+def split_alpha(image):
+    if image is None:
+        raise ValueError("Input image is None")
+
+    # Отделяем альфа-канал и сразу переводим в RGB для Albumentations одним вызовом
+    if image.shape[2] == 4:
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+        alpha = np.ascontiguousarray(image[:, :, 3])
+    elif image.shape[2] == 3:
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        alpha = np.full(rgb.shape[:2], 255, dtype=np.uint8)  # Непрозрачный альфа-канал
+    else:
+        raise ValueError(f"Unsupported number of channels: {image.shape[2]}")
+    return rgb, alpha
+
+
+def merge_alpha(rgb, alpha):
     # Собираем обратно в BGRA
-    aug_bgr = cv2.cvtColor(aug_rgb, cv2.COLOR_RGB2BGR)
-    return cv2.merge([aug_bgr[:, :, 0], aug_bgr[:, :, 1], aug_bgr[:, :, 2], aug_alpha])
+    bgra = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGRA)
+    bgra[:, :, 3] = alpha
+    return bgra
+
+
+def _apply(transform, rgb, alpha, seed):
+    # Фиксируем сид пайплайна, если он задан (albumentations 2.x держит свой генератор)
+    if seed is not None and hasattr(transform, "set_random_seed"):
+        transform.set_random_seed(seed)
+    augmented = transform(image=rgb, mask=alpha)
+    return merge_alpha(augmented['image'], augmented['mask'])
+
+
+@profiling.hook("augment")
+def augment_object(image, seed=None, transform=None):
+    rgb, alpha = split_alpha(image)
+    return _apply(transform or get_pipeline(), rgb, alpha, seed)
+
+
+def augment_batch(images, seeds=None, transform=None):
+    # Аугментирует список объектов одним вызовом; seeds - сид на каждый объект
+    transform = transform or get_pipeline()
+    seeds = seeds if seeds is not None else [None] * len(images)
+    return [_apply(transform, *split_alpha(image), seed) for image, seed in zip(images, seeds)]
+
+
+def augment_variants(image, count, seed=None, transform=None):
+    # Несколько вариантов одного объекта: конвертация каналов делается один раз
+    transform = transform or get_pipeline()
+    rgb, alpha = split_alpha(image)
+    seeds = [None] * count if seed is None else [seed + i for i in range(count)]
+    return [_apply(transform, rgb, alpha, variant_seed) for variant_seed in seeds]
+
+
+def profile_transforms(images, preset="full", seed=0):
+    """
+    Время каждой аугментации на образец (в секундах), по убыванию.
+    Трансформации применяются по очереди, как в Compose, с их вероятностями p.
+    """
+    pipeline = build_pipeline(preset)
+    if hasattr(pipeline, "set_random_seed"):
+        pipeline.set_random_seed(seed)
+    totals = {}
+    for image in images:
+        rgb, alpha = split_alpha(image)
+        data = {"image": rgb, "mask": alpha}
+        for transform in pipeline.transforms:
+            start = time.perf_counter()
+            data = transform(**data)
+            name = type(transform).__name__
+            totals[name] = totals.get(name, 0.0) + time.perf_counter() - start
+    count = max(len(images), 1)
+    return dict(sorted(((name, total / count) for name, total in totals.items()),
+                       key=lambda item: item[1], reverse=True))
 
 def overlay_image(background, overlay, x=0, y=0):
     if overlay.shape[2] != 4:
         overlay = add_alpha_channel(overlay)
-    
-    h, w = overlay.shape[:2]
-    bg_h, bg_w = background.shape[:2]
-
-    # Проверка выхода за границы
-    if x >= bg_w or y >= bg_h:
-        return background
-    if x + w < 0 or y + h < 0:
-        return background
-
-    # Область наложения
-    crop_x1 = max(0, -x)
-    crop_y1 = max(0, -y)
-    crop_x2 = min(w, bg_w - x)
-    crop_y2 = min(h, bg_h - y)
-
-    # Область в фоне
-    bg_x1 = max(0, x)
-    bg_y1 = max(0, y)
-    bg_x2 = min(bg_w, x + w)
-    bg_y2 = min(bg_h, y + h)
-
-    # Вырезаем нужные части
-    overlay_cropped = overlay[crop_y1:crop_y2, crop_x1:crop_x2]
-    alpha = overlay_cropped[:, :, 3] / 255.0
-    alpha_inv = 1.0 - alpha
-
-    # Наложение с учетом альфа-канала
-    for c in range(3):
-        background[bg_y1:bg_y2, bg_x1:bg_x2, c] = (
-            alpha * overlay_cropped[:, :, c] + 
-            alpha_inv * background[bg_y1:bg_y2, bg_x1:bg_x2, c]
-        )
 
+    # Наложение с учетом альфа-канала (целочисленное, на месте)
+    compositing.blend(background, overlay, x, y)
     return background
 
 def add_alpha_channel(image):
@@ -94,3 +159,32 @@ def add_alpha_channel(image):
         alpha = np.ones_like(image[:, :, 0]) * 255
         return cv2.merge([image[:, :, 0], image[:, :, 1], image[:, :, 2], alpha])
     return image
+
+
+def main(objects_folder, preset="full", limit=50):
+    # Профилируем аугментации на подготовленных объектах
+    images = []
+    for root, _, files in os.walk(objects_folder):
+        for file in sorted(files):
+            image = cv2.imread(os.path.join(root, file), cv2.IMREAD_UNCHANGED)
+            if image is not None and image.ndim == 3 and len(images) < limit:
+                images.append(image)
+    if not images:
+        print(f"No objects found in {objects_folder}")
+        return
+
+    timings = profile_transforms(images, preset)
+    total = sum(timings.values())
+    print(f"Per-sample augmentation cost over {len(images)} objects ({preset} preset): {total * 1000:.2f} ms")
+    for name, seconds in timings.items():
+        print(f"  {name:<26} {seconds * 1000:8.3f} ms  {seconds / total * 100:5.1f}%")
+
+
+if __name__ == "__main__":
+    import config
+
+    parser = argparse.ArgumentParser(description="Profile the object augmentation pipeline.")
+    parser.add_argument("--preset", choices=PRESETS, default="full")
+    parser.add_argument("--limit", type=int, default=50, help="number of objects to profile on")
+    args = parser.parse_args()
+    main(os.path.join(config.DATA_FOLDER, "prepared_objects"), args.preset, args.limit)
@@ -1,16 +1,54 @@
 import os
+import io
+import json
+import time
+import hashlib
+import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import defaultdict, deque
+from urllib.parse import urlparse
+import threading
+import argparse
 from tqdm import tqdm
+import numpy as np
+from PIL import Image
 import sys
-import time
 import re
 import config
+import categories
+import image_hash
+import metrics
+
+log = logging.getLogger(__name__)
 
-API_KEY = config.API_KEY
-SEARCH_ENGINE_ID = config.SEARCH_ENGINE_ID
 IMAGE_FOLDER = os.path.join(config.DATA_FOLDER, "raw_objects")
 PER_PAGE = 10
 MAX_RESULTS = 50
+# RAILROAD_SEARCH_URL points the searches at a local stand-in server in tests and benchmarks
+SEARCH_URL = os.environ.get("RAILROAD_SEARCH_URL", "https://www.googleapis.com/customsearch/v1")
+CATEGORIES_CSV = os.path.join(config.DATA_FOLDER, "categories.csv")
+
+# Download engine limits
+MAX_WORKERS = 16
+PER_HOST_LIMIT = 4
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+TIMEOUT = 10
+
+# Validation of downloaded images
+MIN_WIDTH = 100
+MIN_HEIGHT = 100
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+NEAR_DUPLICATE_DISTANCE = 4
+MANIFEST_FOLDER = os.path.join(config.DATA_FOLDER, "cache", "downloads")
+METRICS_FOLDER = os.path.join(config.DATA_FOLDER, "cache", "metrics")
+SEARCH_CACHE_FOLDER = os.path.join(config.DATA_FOLDER, "cache", "search")
+SEARCH_CACHE_TTL = 7 * 24 * 3600
+SEARCH_CACHE_BYTES = 64 * 1024 * 1024
+IMAGE_FORMATS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "BMP": "bmp", "WEBP": "webp"}
 
 
 def sanitize_folder_name(name):
@@ -27,50 +65,413 @@ def create_folder(folder_path):
     """Create a folder if it doesn't exist."""
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
-        print(f"Created folder: {folder_path}")
+        log.debug(f"Created folder: {folder_path}")
+
+
+def make_session(pool_size=MAX_WORKERS, retries=RETRIES, backoff_factor=BACKOFF_FACTOR):
+    """
+    Create a requests session with a shared connection pool.
+
+    Failed connections, timeouts and 429/5xx responses are retried with
+    exponential backoff (honouring Retry-After headers).
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class SearchCache:
+    """
+    On-disk cache of Custom Search responses, one JSON file per request.
+
+    Entries are keyed by the endpoint and the request parameters without the
+    API key, so rotating the key keeps the cache. Entries older than ttl
+    seconds are fetched again. When the files exceed max_bytes, the least
+    recently used ones are removed. An offline cache never goes to the
+    network and serves every entry it has, however old.
+    """
+
+    def __init__(self, folder=SEARCH_CACHE_FOLDER, ttl=SEARCH_CACHE_TTL, max_bytes=SEARCH_CACHE_BYTES,
+                 offline=False):
+        self.folder = folder
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(folder) if entry.name.endswith(".json"))
+
+    @staticmethod
+    def key(url, params):
+        request = {name: value for name, value in params.items() if name != "key"}
+        return hashlib.sha256(json.dumps([url, request], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + ".json")
+
+    def get(self, url, params):
+        """Cached response for a request, or None if it is missing, expired or unreadable."""
+        path = self._path(self.key(url, params))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except OSError:
+            return None
+        except ValueError:
+            self._discard(path)
+            return None
+        try:
+            if not self.offline and time.time() - entry["fetched"] > self.ttl:
+                return None
+            response = entry["response"]
+        except (KeyError, TypeError):
+            # A truncated or hand-edited entry is a miss, and the next put replaces it
+            self._discard(path)
+            return None
+        # The file time records the last use, for eviction
+        os.utime(path)
+        return response
+
+    def put(self, url, params, response):
+        path = self._path(self.key(url, params))
+        request = {name: value for name, value in params.items() if name != "key"}
+        data = json.dumps({"url": url, "params": request, "fetched": time.time(), "response": response})
+        with self._lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+            self.size += os.path.getsize(path) - old_size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _discard(self, path):
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                return
+            self.size -= size
+
+    def _evict(self):
+        entries = sorted((entry for entry in os.scandir(self.folder) if entry.name.endswith(".json")),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.size <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            self.size -= size
+            metrics.inc("evictions_total", stage="search")
 
 
-def get_search_results(query, start_index=1):
-    """Fetch image search results from Google Custom Search API."""
-    search_url = "https://www.googleapis.com/customsearch/v1"
+def get_search_results(query, start_index=1, session=None, settings=None, cache=None):
+    """
+    Fetch image search results from Google Custom Search API.
+    The credentials come from settings (config.load() by default). With a
+    SearchCache, cached responses are served without a request.
+    """
+    settings = settings or config.load()
+    if cache is not None and cache.offline:
+        # No request is made, so the API key is not needed
+        api_key, search_engine_id = None, settings.search_engine_id
+    else:
+        api_key, search_engine_id = config.search_credentials(settings)
     params = {
         "q": query,
-        "cx": SEARCH_ENGINE_ID,
-        "key": API_KEY,
+        "cx": search_engine_id,
+        "key": api_key,
         "searchType": "image",
         # "imgLicense": "cc_publicdomain,cc_attribute,cc_sharealike,cc_noncommercial,cc_nonderived",
         "num": PER_PAGE,
         "start": start_index,
         "safe": "medium",
     }
+    if cache is not None:
+        results = cache.get(SEARCH_URL, params)
+        if results is not None:
+            metrics.inc("cache_hits_total", stage="search")
+            return results
+        if cache.offline:
+            log.warning(f"No cached search results for '{query}' starting at {start_index} (offline)")
+            metrics.inc("failures_total", stage="search", reason="offline")
+            return None
     try:
-        response = requests.get(search_url, params=params)
+        response = (session or requests).get(SEARCH_URL, params=params, timeout=TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        metrics.inc("items_total", stage="search")
+        results = response.json()
+        if cache is not None:
+            cache.put(SEARCH_URL, params, results)
+        return results
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching search results: {e}")
+        log.error(f"Error fetching search results: {e}")
+        metrics.inc("failures_total", stage="search", reason="error")
         return None
 
 
-def download_image(url, folder, idx):
-    """Download a single image from a URL."""
+def validate_image(data):
+    """
+    Check that downloaded bytes are a decodable image of at least MIN_WIDTH x MIN_HEIGHT.
+
+    Returns:
+        tuple: (info, reason) where info is a dict with the file extension, size and
+        perceptual hash, or None with the reason the payload was rejected.
+    """
     try:
-        response = requests.get(url, stream=True, timeout=10)
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            image.load()  # Decode fully so truncated files are caught
+            width, height = image.size
+            gray = np.asarray(image.convert("L"))
+    except Exception as e:
+        return None, f"not an image ({e.__class__.__name__})"
+    if image_format not in IMAGE_FORMATS:
+        return None, f"unsupported format {image_format}"
+    if width < MIN_WIDTH or height < MIN_HEIGHT:
+        return None, f"too small ({width}x{height})"
+    return {"ext": IMAGE_FORMATS[image_format], "width": width, "height": height,
+            "dhash": image_hash.dhash(gray)}, None
+
+
+class DownloadManifest:
+    """
+    Per-category record of downloaded and rejected images.
+
+    Accepted images are indexed by SHA-256 of their content and by perceptual
+    hash, so exact and near duplicates are rejected before they are written.
+    URLs that were already accepted or rejected are not downloaded again.
+    """
+
+    def __init__(self, folder, manifest_folder=MANIFEST_FOLDER):
+        self.folder = folder
+        self.path = os.path.join(manifest_folder, os.path.basename(os.path.normpath(folder)) + ".json")
+        self.images = {}
+        self.rejected = {}
+        self.hashes = image_hash.HashIndex()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.images = data.get("images", {})
+            self.rejected = data.get("rejected", {})
+        else:
+            self._index_existing_files()
+        for entry in self.images.values():
+            self.hashes.add(entry["file"], int(entry["dhash"], 16))
+        self.urls = {entry["url"] for entry in self.images.values()} | set(self.rejected)
+
+    def _index_existing_files(self):
+        # Images downloaded before the manifest existed still count for deduplication
+        if not os.path.isdir(self.folder):
+            return
+        for file in sorted(os.listdir(self.folder)):
+            file_path = os.path.join(self.folder, file)
+            if not os.path.isfile(file_path):
+                continue
+            try:
+                with open(file_path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                log.warning(f"Could not read {file_path}: {e}")
+                continue
+            info, _ = validate_image(data)
+            if info is not None:
+                self.images[hashlib.sha256(data).hexdigest()] = {
+                    "url": None, "file": file, "width": info["width"], "height": info["height"],
+                    "dhash": f"{info['dhash']:016x}"}
+
+    def seen(self, url):
+        with self._lock:
+            return url in self.urls
+
+    def reject(self, url, reason):
+        with self._lock:
+            self.rejected[url] = reason
+            self.urls.add(url)
+
+    def accept(self, url, data, info, file_path):
+        """Record an image unless it duplicates one already accepted; returns the rejection reason."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self.urls.add(url)
+            if digest in self.images:
+                self.rejected[url] = f"duplicate of {self.images[digest]['file']}"
+                return self.rejected[url]
+            duplicate = self.hashes.add_if_new(os.path.basename(file_path), info["dhash"], NEAR_DUPLICATE_DISTANCE)
+            if duplicate is not None:
+                self.rejected[url] = f"near-duplicate of {duplicate}"
+                return self.rejected[url]
+            self.images[digest] = {"url": url, "file": os.path.basename(file_path), "width": info["width"],
+                                   "height": info["height"], "dhash": f"{info['dhash']:016x}"}
+            return None
+
+    def discard(self, url, data, file_path):
+        """Undo accept(), e.g. when the image could not be written; the URL may be tried again."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self.urls.discard(url)
+            if self.images.get(digest, {}).get("url") == url:
+                del self.images[digest]
+                self.hashes.remove(os.path.basename(file_path))
+
+    def save(self):
+        with self._lock:
+            data = {"images": self.images, "rejected": self.rejected}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(temp_path, self.path)
+
+
+def next_image_index(folder):
+    """First free N in image_N.* so new downloads never overwrite existing ones."""
+    indices = [int(match.group(1)) for match in (re.match(r"image_(\d+)\.", name) for name in os.listdir(folder))
+               if match]
+    return max(indices) + 1 if indices else 1
+
+
+def permanent_failure(error):
+    """
+    Reason to remember a failed download, or None when it may succeed later.
+
+    Client errors (4xx) are permanent, except 408 and 429. Timeouts, connection
+    errors and server errors that outlasted the retries are not recorded, so
+    the URL is tried again on the next run.
+    """
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.exceptions.HTTPError) and response is not None and \
+            400 <= response.status_code < 500 and response.status_code not in (408, 429):
+        return f"HTTP {response.status_code}"
+    return None
+
+
+def download_image(url, folder, idx, session=None, manifest=None):
+    """Download a single image from a URL, validating (and deduplicating) it before it is saved."""
+    if manifest is not None and manifest.seen(url):
+        return False
+    start = time.perf_counter()
+    reason = None
+    try:
+        response = (session or requests).get(url, stream=True, timeout=TIMEOUT)
         response.raise_for_status()
-        ext = url.split(".")[-1].split("?")[0].lower()
-        if ext not in ["jpg", "jpeg", "png", "gif", "bmp", "webp"]:
-            ext = "jpg"
-        image_name = os.path.join(folder, f"image_{idx}.{ext}")
-        with open(image_name, "wb") as f:
-            for chunk in response.iter_content(1024):
-                f.write(chunk)
-        return True
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(64 * 1024):
+            size += len(chunk)
+            if size > MAX_IMAGE_BYTES:
+                response.close()
+                reason = f"larger than {MAX_IMAGE_BYTES} bytes"
+                break
+            chunks.append(chunk)
+        data = b"".join(chunks)
     except requests.exceptions.RequestException as e:
-        print(f"Failed to download {url}: {e}")
+        log.warning(f"Failed to download {url}: {e}")
+        metrics.inc("failures_total", stage="download", reason="error")
+        permanent = permanent_failure(e)
+        if manifest is not None and permanent is not None:
+            manifest.reject(url, f"download failed ({permanent})")
+        return False
+
+    info = None
+    if reason is None:
+        info, reason = validate_image(data)
+    image_name = os.path.join(folder, f"image_{idx}.{info['ext']}") if info else None
+    if info is not None and manifest is not None:
+        reason = manifest.accept(url, data, info, image_name)
+    if reason is not None:
+        log.info(f"Rejected {url}: {reason}")
+        metrics.inc("failures_total", stage="download", reason="rejected")
+        if manifest is not None and info is None:
+            manifest.reject(url, reason)
+        return False
+
+    try:
+        with open(image_name, "wb") as f:
+            f.write(data)
+    except OSError as e:
+        log.error(f"Could not write {image_name}: {e}")
+        metrics.inc("failures_total", stage="download", reason="write")
+        if manifest is not None:
+            manifest.discard(url, data, image_name)
+        if os.path.exists(image_name):
+            os.remove(image_name)
         return False
+    metrics.inc("items_total", stage="download")
+    metrics.observe("item_seconds", time.perf_counter() - start, stage="download")
+    return True
+
+
+class Downloader:
+    """
+    Concurrent image downloader.
+
+    Downloads run on a thread pool that shares one pooled session. At most
+    max_workers requests are in flight, and at most per_host of them go to
+    the same host. Tasks wait in per-host queues until their host has a free
+    slot, so a host with many images never ties up the threads that other
+    hosts could use.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, per_host=PER_HOST_LIMIT, session=None):
+        self.session = session or make_session(max_workers)
+        self.per_host = per_host
+        self.pool = ThreadPoolExecutor(max_workers)
+
+    def _download(self, task):
+        url, folder, idx, manifest = task
+        return download_image(url, folder, idx, self.session, manifest)
+
+    def download_all(self, tasks, desc="Downloading images", manifest=None):
+        """Download (url, folder, idx) tasks concurrently; returns a success flag per task."""
+        queues = defaultdict(deque)
+        for position, (url, folder, idx) in enumerate(tasks):
+            queues[urlparse(url).netloc].append((position, (url, folder, idx, manifest)))
+        results = [False] * sum(map(len, queues.values()))
+        running = {}
 
+        def submit(host):
+            position, task = queues[host].popleft()
+            running[self.pool.submit(self._download, task)] = position, host
 
-def main():
+        for host, queue in queues.items():
+            for _ in range(min(self.per_host, len(queue))):
+                submit(host)
+        with tqdm(total=len(results), desc=desc, unit="image") as progress:
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    position, host = running.pop(future)
+                    results[position] = future.result()
+                    progress.update()
+                    # The finished download frees a slot of its host
+                    if queues[host]:
+                        submit(host)
+        return results
+
+    def close(self):
+        self.pool.shutdown()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(cache=None):
     query = input("Enter search query: ").strip()
     if not query:
         print("Search query cannot be empty.")
@@ -89,44 +490,131 @@ def main():
         print("Invalid input. Using default number of images: 50.")
         max_results = 50
 
+    download_query(query, max_results, cache=cache)
+
+
+def download_query(query, max_results=MAX_RESULTS, image_folder=IMAGE_FOLDER, downloader=None, settings=None,
+                   cache=None):
+    """Download up to max_results images for a query into its own folder."""
+    # Fail before creating folders when the search credentials are missing (offline they are not used)
+    if cache is None or not cache.offline:
+        config.search_credentials(settings)
     sanitized_query = sanitize_folder_name(query)
-    target_folder = os.path.join(IMAGE_FOLDER, sanitized_query)
+    target_folder = os.path.join(image_folder, sanitized_query)
     create_folder(target_folder)
 
+    owns_downloader = downloader is None
+    downloader = downloader or Downloader()
+    manifest = DownloadManifest(target_folder)
+
     images_downloaded = 0
-    idx = 1
+    idx = next_image_index(target_folder)
     start_index = 1
 
-    while images_downloaded < max_results:
-        print(f"\nFetching results starting at index {start_index}...")
-        results = get_search_results(query, start_index)
-        if not results or "items" not in results:
-            print("No more results found or an error occurred.")
-            break
-
-        for item in tqdm(
-            results["items"],
-            desc=f"Downloading images {images_downloaded + 1} to {min(images_downloaded + PER_PAGE, max_results)}",
-            unit="image",
-        ):
-            if images_downloaded >= max_results:
+    try:
+        while images_downloaded < max_results and start_index <= 100:
+            # Collect enough search results to cover the missing images, then download them together
+            tasks = []
+            needed = max_results - images_downloaded
+            while len(tasks) < needed and start_index <= 100:
+                log.debug(f"Fetching results starting at index {start_index}...")
+                results = get_search_results(query, start_index, downloader.session, settings, cache)
+                start_index += PER_PAGE
+                if not results or "items" not in results:
+                    log.info("No more results found or an error occurred.")
+                    start_index = 101
+                    break
+                for item in results["items"]:
+                    image_url = item.get("link")
+                    if image_url and len(tasks) < needed and not manifest.seen(image_url):
+                        tasks.append((image_url, target_folder, idx))
+                        idx += 1
+
+            if not tasks:
                 break
-            image_url = item.get("link")
-            if image_url:
-                success = download_image(image_url, target_folder, idx)
-                if success:
-                    images_downloaded += 1
-                    idx += 1
-
-        start_index += PER_PAGE
-        if start_index > 100:
-            print("Reached the maximum number of retrievable results (100).")
-            break
+            images_downloaded += sum(downloader.download_all(
+                tasks, desc=f"Downloading images {images_downloaded + 1} to {images_downloaded + len(tasks)}",
+                manifest=manifest))
 
-        time.sleep(1)
+        if start_index > 100 and images_downloaded < max_results:
+            print("Reached the maximum number of retrievable results (100).")
+    finally:
+        manifest.save()
+        if owns_downloader:
+            downloader.close()
 
     print(f"\nDownloaded {images_downloaded} images to '{target_folder}'.")
+    return images_downloaded
+
+
+def read_queries_file(path, default_count=MAX_RESULTS):
+    """
+    Read queries from a text file, one per line, optionally followed by a comma and a count.
+    Empty lines and lines starting with '#' are ignored.
+    """
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            query, _, count = line.partition(",")
+            queries.append((query.strip(), int(count) if count.strip() else default_count))
+    return queries
+
+
+def read_categories(path=CATEGORIES_CSV, default_count=MAX_RESULTS):
+    """Use every category of the categories CSV as a query ('dead_cow' -> 'dead cow')."""
+    registry = categories.CategoryRegistry.from_csv(path)
+    return [(name.replace("_", " "), default_count) for name in registry.names]
+
+
+def download_batch(queries, max_workers=MAX_WORKERS, per_host=PER_HOST_LIMIT, image_folder=IMAGE_FOLDER,
+                   settings=None, cache=None):
+    """Download images for several (query, count) pairs, sharing one connection pool."""
+    totals = {}
+    with Downloader(max_workers, per_host) as downloader:
+        for query, count in queries:
+            count = min(max(count, 1), MAX_RESULTS)
+            totals[query] = download_query(query, count, image_folder, downloader, settings, cache)
+    print(f"\nDownloaded {sum(totals.values())} images for {len(totals)} queries.")
+    return totals
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download hazardous object images from Google.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--queries-file", help="text file with one query per line ('query[,count]')")
+    source.add_argument("--categories", nargs="?", const=CATEGORIES_CSV, metavar="CSV",
+                        help="use every category of the categories CSV as a query")
+    parser.add_argument("--count", type=int, default=MAX_RESULTS, help=f"images per query (1-{MAX_RESULTS})")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="concurrent downloads")
+    parser.add_argument("--per-host", type=int, default=PER_HOST_LIMIT, help="concurrent downloads per host")
+    parser.add_argument("--cache-ttl", type=float, default=SEARCH_CACHE_TTL / 3600,
+                        help="hours a cached search response stays valid")
+    parser.add_argument("--cache-mb", type=int, default=SEARCH_CACHE_BYTES // (1024 * 1024),
+                        help="size limit of the search response cache, in MiB")
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument("--no-cache", action="store_true", help="always query the search API")
+    cache_mode.add_argument("--offline", action="store_true",
+                        help="serve searches only from the cache, whatever their age; no API quota is used")
+    parser.add_argument("--verbose", action="store_true", help="log every download")
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+    metrics.configure(METRICS_FOLDER, reset=True)
+    search_cache = None if args.no_cache else SearchCache(SEARCH_CACHE_FOLDER, args.cache_ttl * 3600,
+                                                          args.cache_mb * 1024 * 1024, args.offline)
+    if args.queries_file:
+        download_batch(read_queries_file(args.queries_file, args.count), args.workers, args.per_host,
+                       cache=search_cache)
+    elif args.categories:
+        download_batch(read_categories(args.categories, args.count), args.workers, args.per_host,
+                       cache=search_cache)
+    else:
+        main(search_cache)
+    print(metrics.report())
@@ -0,0 +1,215 @@
+"""
+Index of prepared objects with a pre-decoded pixel store.
+
+build() decodes every prepared object once and records its size, alpha
+coverage (share of non-transparent pixels), the bounding box of those pixels
+and its category id in index.json. The decoded pixels, exactly as
+cv2.imread(path, cv2.IMREAD_UNCHANGED) returns them, go into one
+image_cache.SharedImageStore per category (stores/<category>.bin/.json).
+ObjectIndex serves objects as read-only memory-mapped views of those stores,
+so worker processes share the pages and never decode a PNG, and the
+composites are the same as without the index. Objects can be filtered and
+sized from the metadata alone, before any pixels are read.
+
+    python object_index.py            # build or update the index
+"""
+import os
+import json
+import logging
+import argparse
+
+import cv2
+import numpy as np
+
+import config
+import categories
+import image_cache
+
+log = logging.getLogger(__name__)
+
+OBJECTS_FOLDER = os.path.join(config.DATA_FOLDER, "prepared_objects")
+INDEX_FOLDER = os.path.join(config.DATA_FOLDER, "cache", "object_index")
+CATEGORIES_CSV = os.path.join(config.DATA_FOLDER, "categories.csv")
+INDEX_FILE = "index.json"
+STORES_FOLDER = "stores"
+
+
+def describe(image):
+    """Size, alpha coverage and bbox [x, y, w, h] of the non-transparent pixels."""
+    height, width = image.shape[:2]
+    if image.ndim == 2 or image.shape[2] != 4:
+        return {"width": width, "height": height, "coverage": 1.0, "bbox": [0, 0, width, height]}
+    opaque = image[:, :, 3] > 0
+    rows = np.flatnonzero(opaque.any(axis=1))
+    cols = np.flatnonzero(opaque.any(axis=0))
+    bbox = None
+    if rows.size:
+        bbox = [int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)]
+    return {"width": width, "height": height, "coverage": round(float(opaque.mean()), 4), "bbox": bbox}
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _read_index(index_folder):
+    try:
+        with open(os.path.join(index_folder, INDEX_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)["objects"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _category_files(objects_folder):
+    # Same layout and path form as combine_background_and_object.collect_objects
+    files = {}
+    for name in sorted(os.listdir(objects_folder)):
+        folder = os.path.join(objects_folder, name)
+        if os.path.isdir(folder):
+            files[name] = [os.path.join(folder, file) for file in sorted(os.listdir(folder))
+                           if os.path.isfile(os.path.join(folder, file))]
+    return files
+
+
+def build(objects_folder=OBJECTS_FOLDER, index_folder=INDEX_FOLDER, registry=None):
+    """
+    Index every object in objects_folder/<category>/ and write the pixel
+    stores. Categories whose files are unchanged keep their store. Objects
+    that fail to decode are logged and left out.
+
+    Returns:
+        ObjectIndex: The updated index.
+    """
+    if registry is None and os.path.exists(CATEGORIES_CSV):
+        registry = categories.load_registry(CATEGORIES_CSV)
+    stores_folder = os.path.join(index_folder, STORES_FOLDER)
+    os.makedirs(stores_folder, exist_ok=True)
+    previous = _read_index(index_folder)
+    objects = {}
+    rebuilt = 0
+
+    for category, paths in _category_files(objects_folder).items():
+        store_path = os.path.join(stores_folder, category)
+        sources = [(path, cv2.IMREAD_UNCHANGED) for path in paths]
+        old = {path: entry for path, entry in previous.items() if entry["category"] == category}
+        # A current store has the same sources, so objects that failed to decode are simply absent from old
+        if image_cache.store_is_current(store_path, sources) and set(old) <= set(paths) and \
+                all(entry["stamp"] == _stamp(path) for path, entry in old.items()):
+            objects.update(old)
+            continue
+
+        store = image_cache.build_store(store_path, sources)
+        for path in paths:
+            image = store.get(path, cv2.IMREAD_UNCHANGED)
+            if image is None:
+                log.warning(f"Could not decode prepared object {path}; left out of the index.")
+                continue
+            entry = describe(image)
+            entry.update({"category": category,
+                          "category_id": registry.id_of(category) if registry is not None else None,
+                          "stamp": _stamp(path)})
+            objects[path] = entry
+        rebuilt += 1
+
+    # Stores of categories that no longer exist
+    indexed = set(_category_files(objects_folder))
+    for file in os.listdir(stores_folder):
+        if os.path.splitext(file)[0] not in indexed:
+            os.remove(os.path.join(stores_folder, file))
+
+    index_path = os.path.join(index_folder, INDEX_FILE)
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"objects": objects}, f)
+    os.replace(index_path + ".tmp", index_path)
+    log.info(f"Object index: {len(objects)} objects, {rebuilt} categories rebuilt.")
+    return ObjectIndex(index_folder)
+
+
+class ObjectIndex:
+    """
+    Read side of the index: metadata for every object and read-only views of
+    the decoded pixels in the per-category stores.
+    """
+
+    def __init__(self, index_folder=INDEX_FOLDER):
+        self.folder = index_folder
+        self.entries = _read_index(index_folder)
+        self._stores = {}
+
+    def _store(self, category):
+        store = self._stores.get(category)
+        if store is None:
+            store = image_cache.SharedImageStore(os.path.join(self.folder, STORES_FOLDER, category))
+            self._stores[category] = store
+        return store
+
+    def get(self, path):
+        """
+        Decoded object (as cv2.imread with IMREAD_UNCHANGED), or None if it is
+        not indexed or the file changed since the index was built.
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        try:
+            stale = _stamp(path) != entry["stamp"]
+        except OSError:
+            stale = True
+        if stale:
+            log.debug(f"{path} changed since the object index was built; decoding it instead.")
+            return None
+        return self._store(entry["category"]).get(path, cv2.IMREAD_UNCHANGED)
+
+    def objects(self, min_coverage=0.0, min_size=0):
+        """
+        {category: [paths]} of the indexed objects whose alpha coverage and
+        shorter bbox side reach the limits; decided from metadata only.
+        """
+        selected = {}
+        for path, entry in sorted(self.entries.items()):
+            bbox = entry["bbox"]
+            if bbox is None or entry["coverage"] < min_coverage or min(bbox[2], bbox[3]) < min_size:
+                continue
+            selected.setdefault(entry["category"], []).append(path)
+        return selected
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Process-wide index used by the compositor; configured once per worker
+_index = None
+
+
+def configure(index_folder=None):
+    global _index
+    _index = ObjectIndex(index_folder) if index_folder else None
+
+
+def snapshot():
+    """The configured index, to be put back with restore()."""
+    return _index
+
+
+def restore(state):
+    global _index
+    _index = state
+
+
+def get(path):
+    """Decoded object from the configured index, or None."""
+    return _index.get(path) if _index is not None else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index prepared objects into a pre-decoded pixel store.")
+    parser.add_argument("--verbose", action="store_true", help="log the index summary")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+    index = build()
+    print(f"Indexed {len(index)} objects in {INDEX_FOLDER}")
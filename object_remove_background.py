@@ -1,8 +1,19 @@
 import os
-from rembg import remove
+import time
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
 from config import DATA_FOLDER
-from PIL import Image
-import io
+
+import config
+import metrics
+import object_index
+
+log = logging.getLogger(__name__)
 
 # Path to the input directory containing images.
 BATCH_INPUT_DIR = os.path.join(DATA_FOLDER, "raw_objects")
@@ -10,73 +21,143 @@ BATCH_INPUT_DIR = os.path.join(DATA_FOLDER, "raw_objects")
 # Path to the output directory where processed images will be saved.
 BATCH_OUTPUT_DIR = os.path.join(DATA_FOLDER, "prepared_objects")
 
+METRICS_FOLDER = os.path.join(DATA_FOLDER, "cache", "metrics")
+
 # Define the image file extensions that the script will process.
 SUPPORTED_FORMATS = (".png", ".jpg", ".jpeg", ".bmp", ".tiff")
 
-def remove_background_and_center(input_path, output_path):
+# Segmentation model used by rembg.
+MODEL_NAME = "u2net"
+
+# One model session per process, created on first use and reused for every image.
+_session = None
+
+
+def get_session(model_name=MODEL_NAME):
+    """
+    Returns the process-wide rembg session, loading the model on first use.
+
+    Args:
+        model_name (str): Name of the rembg model.
+    """
+    global _session
+    if _session is None:
+        # rembg pulls in onnxruntime and the model machinery, so it is imported on first use only
+        from rembg import new_session
+        _session = new_session(model_name)
+    return _session
+
+
+def load_rgb(input_path):
+    """
+    Loads an image as an RGB array, falling back to PIL for formats OpenCV cannot read.
+
+    Args:
+        input_path (str): Path to the input image.
+    """
+    image = cv2.imread(input_path, cv2.IMREAD_COLOR)
+    if image is not None:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    from PIL import Image
+
+    with Image.open(input_path) as pil_image:
+        return np.asarray(pil_image.convert("RGB"))
+
+
+def crop_to_alpha(rgba):
+    """
+    Crops an RGBA array to the bounding box of its non-transparent pixels.
+
+    A fully transparent image is returned unchanged.
+    """
+    alpha = rgba[:, :, 3]
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if rows.size == 0:
+        return rgba
+    cols = np.flatnonzero(alpha.any(axis=0))
+    return rgba[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+
+def remove_background_array(rgb, session=None):
+    """
+    Removes the background from an RGB array and returns the tightly cropped RGBA array.
+
+    Args:
+        rgb (np.ndarray): HxWx3 RGB image.
+        session: rembg session; the process-wide session is used when omitted.
+    """
+    from rembg import remove
+
+    rgba = remove(rgb, session=session or get_session())
+    return crop_to_alpha(np.asarray(rgba))
+
+
+def is_up_to_date(input_path, output_path):
+    """True if the output exists and is not older than its input."""
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+
+def remove_background_and_center(input_path, output_path, session=None):
     """
     Removes the background from a single image, centers the object, and saves the result.
 
     Args:
         input_path (str): Path to the input image.
         output_path (str): Path to save the output image with the background removed and object centered.
+        session: rembg session to reuse; the process-wide session is used when omitted.
+
+    Returns:
+        bool: True if the image was processed and saved.
     """
+    start = time.perf_counter()
     try:
-        with open(input_path, "rb") as input_file:
-            input_data = input_file.read()
-        output_data = remove(input_data)
-
-        # Load the output data into a PIL Image
-        image = Image.open(io.BytesIO(output_data)).convert("RGBA")
-
-        # Get the bounding box of the non-transparent pixels
-        bbox = image.getbbox()
-        if bbox:
-            # Crop the image to the bounding box
-            cropped_image = image.crop(bbox)
-        else:
-            # If bbox is None, the image is fully transparent
-            cropped_image = image
-
-        # Optional: If you want to resize the image to a specific size while keeping the object centered
-        # For example, resize to 512x512
-        # new_size = (512, 512)
-        # centered_image = Image.new("RGBA", new_size, (0, 0, 0, 0))
-        # cropped_image.thumbnail(new_size, Image.ANTIALIAS)
-        # paste_position = (
-        #     (new_size[0] - cropped_image.width) // 2,
-        #     (new_size[1] - cropped_image.height) // 2
-        # )
-        # centered_image.paste(cropped_image, paste_position)
-        # final_image = centered_image
-
-        # If you want the image to be tightly cropped without additional padding
-        final_image = cropped_image
+        # Work on arrays end to end: no PNG encode/decode between rembg and cropping
+        rgba = remove_background_array(load_rgb(input_path), session)
 
         # Ensure the output directory exists
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
         # Save the final image in PNG format to preserve transparency
-        final_image.save(output_path, format="PNG")
-        print(f"Processed: {input_path} -> {output_path}")
+        if not cv2.imwrite(output_path, cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGRA)):
+            raise IOError(f"Could not write {output_path}")
+        metrics.inc("items_total", stage="remove_background")
+        metrics.observe("item_seconds", time.perf_counter() - start, stage="remove_background")
+        log.debug(f"Processed: {input_path} -> {output_path}")
+        return True
     except Exception as e:
-        print(f"Failed to remove background from {input_path}. Error: {e}")
+        metrics.inc("failures_total", stage="remove_background")
+        log.error(f"Failed to remove background from {input_path}. Error: {e}")
+        return False
+
+
+def _init_worker(model_name, config_path=None):
+    # Workers use the parent's configuration; each one loads the model once
+    if config_path is not None:
+        config.load(config_path)
+    cv2.setNumThreads(1)
+    get_session(model_name)
+
 
-def batch_remove(input_dir, output_dir):
+def _process_task(task):
+    input_path, output_path = task
+    return remove_background_and_center(input_path, output_path)
+
+
+def collect_tasks(input_dir, output_dir, overwrite=False):
     """
-    Removes backgrounds from all supported images in a directory and its subdirectories,
-    centers the extracted objects, and preserves the directory structure in the output directory.
+    Lists (input, output) pairs for all supported images, preserving the directory structure.
 
     Args:
         input_dir (str): Path to the input directory containing images.
-        output_dir (str): Path to save the output images with backgrounds removed and objects centered.
-    """
-    if not os.path.exists(input_dir):
-        print(f"Error: Input directory does not exist: {input_dir}")
-        return
+        output_dir (str): Path to the output directory.
+        overwrite (bool): Also include images whose output is newer than the input.
 
-    processed_count = 0
+    Returns:
+        tuple: (tasks, skipped_unsupported, skipped_up_to_date)
+    """
+    tasks = []
     skipped_count = 0
+    up_to_date_count = 0
 
     # Walk through all subdirectories and files in the input directory
     for root, dirs, files in os.walk(input_dir):
@@ -85,29 +166,103 @@ def batch_remove(input_dir, output_dir):
         # Determine the corresponding directory in the output directory
         output_root = os.path.join(output_dir, relative_path)
 
-        for filename in files:
+        for filename in sorted(files):
             if filename.lower().endswith(SUPPORTED_FORMATS):
                 input_path = os.path.join(root, filename)
                 # Change output format to PNG to preserve transparency
                 base_filename, _ = os.path.splitext(filename)
-                output_filename = base_filename + ".png"
-                output_path = os.path.join(output_root, output_filename)
-                remove_background_and_center(input_path, output_path)
-                processed_count += 1
+                output_path = os.path.join(output_root, base_filename + ".png")
+                if not overwrite and is_up_to_date(input_path, output_path):
+                    up_to_date_count += 1
+                    continue
+                tasks.append((input_path, output_path))
             else:
-                print(f"Skipped (unsupported format): {os.path.join(root, filename)}")
+                log.debug(f"Skipped (unsupported format): {os.path.join(root, filename)}")
                 skipped_count += 1
 
+    return tasks, skipped_count, up_to_date_count
+
+
+def batch_remove(input_dir, output_dir, workers=1, executor="thread", overwrite=False, model_name=MODEL_NAME,
+                 inputs=None):
+    """
+    Removes backgrounds from all supported images in a directory and its subdirectories,
+    centers the extracted objects, and preserves the directory structure in the output directory.
+
+    Args:
+        input_dir (str): Path to the input directory containing images.
+        output_dir (str): Path to save the output images with backgrounds removed and objects centered.
+        workers (int): Number of images processed concurrently. Each image is
+            still one inference call; the model is not run on batches of images.
+        executor (str): "thread" shares one model session between threads (onnxruntime
+            releases the GIL during inference); "process" loads one session per process.
+        overwrite (bool): Reprocess images whose output is already newer than the input.
+        model_name (str): rembg model to use.
+        inputs (list): Only process these input paths, whether or not their output
+            is up to date (e.g. the files the pipeline found new or changed).
+    """
+    if not os.path.exists(input_dir):
+        log.error(f"Input directory does not exist: {input_dir}")
+        return
+
+    tasks, skipped_count, up_to_date_count = collect_tasks(input_dir, output_dir, overwrite or inputs is not None)
+    if inputs is not None:
+        selected = {os.path.normpath(path) for path in inputs}
+        tasks = [task for task in tasks if os.path.normpath(task[0]) in selected]
+
+    if workers <= 1:
+        session = get_session(model_name)
+        results = [remove_background_and_center(input_path, output_path, session)
+                   for input_path, output_path in tasks]
+    elif executor == "process":
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(model_name, config.load().path)) as pool:
+            results = pool.map(_process_task, tasks)
+            # Let the workers exit normally so that they write their last metrics snapshot
+            pool.close()
+            pool.join()
+    else:
+        get_session(model_name)
+        with ThreadPoolExecutor(workers) as pool:
+            results = list(pool.map(_process_task, tasks))
+
+    processed_count = sum(results)
+
     print("\nBatch processing completed.")
     print(f"Total images processed: {processed_count}")
+    if len(tasks) > processed_count:
+        print(f"Total images failed: {len(tasks) - processed_count}")
+    if up_to_date_count > 0:
+        print(f"Total images skipped (output is up to date): {up_to_date_count}")
     if skipped_count > 0:
         print(f"Total files skipped (unsupported formats): {skipped_count}")
 
-def main():
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove backgrounds from raw object images.")
+    parser.add_argument("--workers", type=int, default=1, help="images processed concurrently")
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread",
+                        help="run concurrent inference on threads (one shared session) or processes")
+    parser.add_argument("--overwrite", action="store_true", help="reprocess images whose output is up to date")
+    parser.add_argument("--model", default=MODEL_NAME, help="rembg model name")
+    parser.add_argument("--no-index", action="store_true",
+                        help="do not update the prepared-object index used by the compositor")
+    parser.add_argument("--verbose", action="store_true", help="log every processed image")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+    metrics.configure(METRICS_FOLDER, reset=True)
+
     print("=== Batch Image Background Remover and Centering Tool ===\n")
     print(f"Input Directory : {BATCH_INPUT_DIR}")
     print(f"Output Directory: {BATCH_OUTPUT_DIR}\n")
-    batch_remove(BATCH_INPUT_DIR, BATCH_OUTPUT_DIR)
+    batch_remove(BATCH_INPUT_DIR, BATCH_OUTPUT_DIR, args.workers, args.executor, args.overwrite, args.model)
+    if not args.no_index and os.path.isdir(BATCH_OUTPUT_DIR):
+        # Sizes, coverage and decoded pixels are recorded once here instead of on every use
+        index = object_index.build(BATCH_OUTPUT_DIR)
+        print(f"Indexed {len(index)} prepared objects in {index.folder}")
+    print(metrics.report())
+
 
 if __name__ == "__main__":
     main()
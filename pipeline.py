@@ -0,0 +1,321 @@
+"""
+Incremental in-process runner for the data-generation stages.
+
+Every stage lists its inputs, and the runner keeps a manifest with the
+content hash of each input and the artifacts it produced. On the next run a
+stage only processes inputs that are new, changed, or whose outputs have gone
+missing, so adding one video or a few raw objects does not rebuild everything.
+"""
+import os
+import json
+import math
+import time
+import hashlib
+import logging
+import argparse
+
+import config
+import categories
+import metrics
+
+# Relative to the data folder of the configuration
+MANIFEST_NAME = os.path.join("cache", "pipeline_manifest.json")
+METRICS_NAME = os.path.join("cache", "metrics")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".webm")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".webp", ".gif")
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def list_files(folder, extensions):
+    paths = []
+    if not os.path.isdir(folder):
+        return paths
+    for root, _, files in os.walk(folder):
+        for file in files:
+            if file.lower().endswith(extensions):
+                paths.append(os.path.join(root, file))
+    return sorted(paths)
+
+
+class Manifest:
+    """
+    Per-stage record of input hashes and produced outputs, stored as JSON.
+
+    With a root (the data folder), file paths are stored relative to it, so
+    the manifest stays valid whatever the working directory of the run.
+    """
+
+    def __init__(self, path, root=None):
+        self.path = path
+        self.root = root
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.stages = json.load(f)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.stages, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    def entries(self, stage):
+        return self.stages.setdefault(stage, {})
+
+    def relative(self, path):
+        return os.path.relpath(path, self.root) if self.root else path
+
+    def resolve(self, path):
+        return os.path.join(self.root, path) if self.root else path
+
+    def content_hash(self, stage, path):
+        """
+        Hash a file, reusing the stored hash while its size and mtime are unchanged
+        so that large videos are not re-read on every run.
+        """
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        entry = self.entries(stage).get(self.relative(path))
+        if entry and entry.get("stamp") == stamp:
+            return entry["hash"], stamp
+        return file_digest(path), stamp
+
+
+class Stage:
+    """
+    A pipeline stage.
+
+    Args:
+        name (str): Stage name used in the manifest and reports.
+        list_inputs (callable): Returns the stage's input keys; file paths are
+            content-hashed, other keys (e.g. category names) are hashed as text.
+        process (callable): Called with the list of new or changed inputs;
+            returns {input: [output paths]} for the inputs it handled.
+        uses_files (bool): Whether inputs are file paths.
+    """
+
+    def __init__(self, name, list_inputs, process, uses_files=True):
+        self.name = name
+        self.list_inputs = list_inputs
+        self.process = process
+        self.uses_files = uses_files
+
+
+def outputs_exist(outputs):
+    return all(os.path.exists(path) for path in outputs)
+
+
+def run_stage(stage, manifest, force=False):
+    """Run one stage on its new or changed inputs and update the manifest."""
+    start = time.perf_counter()
+    entries = manifest.entries(stage.name)
+    inputs = stage.list_inputs()
+
+    # Manifest keys and outputs are relative to the data folder; stages see the paths they listed
+    def stored(key):
+        return manifest.relative(key) if stage.uses_files else key
+
+    changed = []
+    hashes = {}
+    for key in inputs:
+        if stage.uses_files:
+            hashes[key] = manifest.content_hash(stage.name, key)
+        else:
+            hashes[key] = (text_digest(key), None)
+        entry = entries.get(stored(key))
+        if force or entry is None or entry["hash"] != hashes[key][0] or \
+                not outputs_exist(manifest.resolve(path) for path in entry["outputs"]):
+            changed.append(key)
+
+    # Inputs that disappeared are dropped from the manifest; their outputs are kept
+    for key in set(entries) - {stored(key) for key in inputs}:
+        del entries[key]
+
+    results = stage.process(changed) if changed else {}
+    for key, outputs in results.items():
+        digest, stamp = hashes[key]
+        entries[stored(key)] = {"hash": digest, "stamp": stamp,
+                                "outputs": sorted(manifest.relative(path) for path in outputs)}
+    manifest.save()
+
+    elapsed = time.perf_counter() - start
+    metrics.observe("stage_seconds", elapsed, stage=stage.name)
+    return {"stage": stage.name, "inputs": len(inputs), "changed": len(changed),
+            "processed": len(results), "seconds": elapsed}
+
+
+def run(stages, manifest_path, force=False, root=None):
+    manifest = Manifest(manifest_path, root)
+    reports = []
+    for stage in stages:
+        print(f"\n▶️ Stage: {stage.name}")
+        reports.append(run_stage(stage, manifest, force))
+
+    print("\nStage               inputs  changed  processed   wall time")
+    for report in reports:
+        print(f"{report['stage']:<18} {report['inputs']:>7} {report['changed']:>8} "
+              f"{report['processed']:>10} {report['seconds']:>10.1f}s")
+    print("\n" + metrics.report())
+    return reports
+
+
+# --- Stages of the synthetic data pipeline -------------------------------------------------------
+
+
+def frames_stage():
+    import background_capture_frames as frames
+
+    def process(videos):
+        counts = frames.extract_videos(videos, frames.EXTRACTED_FRAMES_FOLDER, frames.FRAMES_INTERVAL)
+        return {video: list_files(frames.video_output_folder(video), IMAGE_EXTENSIONS) for video in counts}
+
+    return Stage("frames", lambda: list_files(frames.VIDEO_FOLDER, VIDEO_EXTENSIONS), process)
+
+
+def download_stage(settings=None):
+    import object_download
+
+    settings = settings or config.load()
+    categories_path = os.path.join(settings.data_folder, "categories.csv")
+
+    def list_categories():
+        return categories.CategoryRegistry.from_csv(categories_path).names
+
+    def process(categories):
+        results = {}
+        for category in categories:
+            folder = os.path.join(object_download.IMAGE_FOLDER, object_download.sanitize_folder_name(category))
+            # Categories that already have raw images are not downloaded again
+            if not list_files(folder, IMAGE_EXTENSIONS):
+                object_download.download_query(category.replace("_", " "), settings=settings)
+            outputs = list_files(folder, IMAGE_EXTENSIONS)
+            if outputs:
+                results[category] = outputs
+        return results
+
+    return Stage("download", list_categories, process, uses_files=False)
+
+
+def remove_background_stage():
+    import object_remove_background as remover
+
+    def output_path(input_path):
+        relative = os.path.relpath(input_path, remover.BATCH_INPUT_DIR)
+        return os.path.join(remover.BATCH_OUTPUT_DIR, os.path.splitext(relative)[0] + ".png")
+
+    def process(inputs):
+        # One batch_remove call: the model session is loaded once for all new or changed images
+        remover.batch_remove(remover.BATCH_INPUT_DIR, remover.BATCH_OUTPUT_DIR, inputs=inputs)
+        return {input_path: [output_path(input_path)] for input_path in inputs
+                if os.path.exists(output_path(input_path))}
+
+    return Stage("remove_background", lambda: list_files(remover.BATCH_INPUT_DIR, remover.SUPPORTED_FORMATS),
+                 process)
+
+
+def composite_stage(workers=None, frames_per_object=None):
+    import combine_background_and_object as combine
+
+    frames_per_object = frames_per_object or combine.FRAMES_PER_OBJECT
+
+    def list_objects():
+        return list_files(combine.PREPARED_OBJECTS_FOLDER, IMAGE_EXTENSIONS)
+
+    def list_frames():
+        return list_files(combine.EXTRACTED_FRAMES_FOLDER, IMAGE_EXTENSIONS)
+
+    def process(changed):
+        changed = set(changed)
+        all_frames = list_frames()
+        new_frames = [frame for frame in all_frames if frame in changed]
+
+        changed_objects = {}
+        unchanged_objects = {}
+        for obj in list_objects():
+            category = os.path.basename(os.path.dirname(obj))
+            target = changed_objects if obj in changed else unchanged_objects
+            target.setdefault(category, []).append(obj)
+
+        # New or changed objects get the usual number of random frames
+        jobs = combine.build_jobs(all_frames, changed_objects, frames_per_object)
+        # Objects composited before only get their share of the new frames
+        if new_frames and unchanged_objects and len(new_frames) < len(all_frames):
+            share = math.ceil(frames_per_object * len(new_frames) / len(all_frames))
+            extra = combine.build_jobs(new_frames, unchanged_objects, share,
+                                       seed=combine.DEFAULT_SEED + len(all_frames))
+            jobs.extend(job._replace(index=job.index + len(jobs)) for job in extra)
+
+        os.makedirs(combine.OUTPUT_FOLDER, exist_ok=True)
+        if jobs:
+            combine.run_jobs(jobs, workers or os.cpu_count() or 1)
+
+        results = {frame: [] for frame in new_frames}
+        for job in jobs:
+            output_path = combine.output_path_for(job)
+            if not os.path.exists(output_path):
+                continue
+            for key in (job.frame_path, job.object_path):
+                if key in changed:
+                    results.setdefault(key, []).append(output_path)
+        # Objects whose composites all failed are retried on the next run
+        return results
+
+    return Stage("composite", lambda: list_objects() + list_frames(), process)
+
+
+STAGE_FACTORIES = {
+    "frames": frames_stage,
+    "download": download_stage,
+    "remove_background": remove_background_stage,
+    "composite": composite_stage,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the synthetic data pipeline incrementally.")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGE_FACTORIES), default=list(STAGE_FACTORIES),
+                        help="stages to run, in pipeline order")
+    parser.add_argument("--force", action="store_true", help="reprocess every input regardless of the manifest")
+    parser.add_argument("--workers", type=int, default=None, help="compositing worker processes")
+    parser.add_argument("--config", default=None,
+                        help="config.ini to use (default: RAILROAD_CONFIG or config.ini next to the code)")
+    parser.add_argument("--metrics-dir", default=None,
+                        help="folder for per-process metric snapshots and metrics.prom (default: <data>/cache/metrics)")
+    parser.add_argument("--verbose", action="store_true", help="log every processed item")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+
+    # Resolved once, before any stage module is imported; stage modules read the same settings
+    settings = config.load(args.config)
+    metrics.configure(args.metrics_dir or os.path.join(settings.data_folder, METRICS_NAME), reset=True)
+
+    stages = []
+    for name in STAGE_FACTORIES:
+        if name not in args.stages:
+            continue
+        if name == "composite":
+            stages.append(composite_stage(args.workers))
+        elif name == "download":
+            stages.append(download_stage(settings))
+        else:
+            stages.append(STAGE_FACTORIES[name]())
+    return run(stages, os.path.join(settings.data_folder, MANIFEST_NAME), force=args.force,
+               root=settings.data_folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Opt-in profiling hooks for the hot calls of the pipeline.
+
+Functions decorated with @hook("name") run unchanged unless profiling is
+enabled, either with configure() or the RAILROAD_PROFILE environment variable
+(inherited by worker processes):
+
+    RAILROAD_PROFILE=cprofile  - cProfile restricted to hooked calls, dumped
+                                 as <pid>.prof
+    RAILROAD_PROFILE=sample    - a background thread samples the stack every
+                                 RAILROAD_PROFILE_INTERVAL seconds while a hooked
+                                 call runs; dumped as <pid>.stacks in collapsed
+                                 (flame graph) format
+    RAILROAD_PROFILE=timing    - only per-hook call counts and wall time
+
+Every mode also writes per-hook timings to <pid>.json. Output goes to
+RAILROAD_PROFILE_DIR (default: profiles/).
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import functools
+import threading
+import multiprocessing.util
+
+MODES = ("off", "timing", "cprofile", "sample")
+DUMP_INTERVAL = 10.0
+
+_mode = "off"
+_output_dir = "profiles"
+_interval = 0.005
+_timings = {}
+_active = []
+_profiler = None
+_sampler = None
+_stacks = {}
+_last_dump = 0.0
+_lock = threading.Lock()
+
+
+def configure(mode=None, output_dir=None, interval=None):
+    """Enable profiling in this process; defaults come from the environment."""
+    global _mode, _output_dir, _interval, _profiler, _sampler, _last_dump
+    mode = mode or os.environ.get("RAILROAD_PROFILE", "off")
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiling mode '{mode}', expected one of {MODES}")
+    _mode = mode
+    _output_dir = output_dir or os.environ.get("RAILROAD_PROFILE_DIR", "profiles")
+    _interval = interval or float(os.environ.get("RAILROAD_PROFILE_INTERVAL", "0.005"))
+    _last_dump = time.monotonic()
+    if _mode == "off":
+        return
+    if _mode == "cprofile" and _profiler is None:
+        _profiler = cProfile.Profile()
+    if _mode == "sample" and _sampler is None:
+        _sampler = threading.Thread(target=_sample_loop, args=(threading.get_ident(),), daemon=True)
+        _sampler.start()
+    atexit.register(dump)
+
+
+def enabled():
+    return _mode != "off"
+
+
+def _sample_loop(thread_id):
+    while True:
+        time.sleep(_interval)
+        if not _active:
+            continue
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        stack = ";".join([_active[-1]] + names[::-1])
+        with _lock:
+            _stacks[stack] = _stacks.get(stack, 0) + 1
+
+
+def hook(name):
+    """Decorator that records calls of the wrapped function when profiling is enabled."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _mode == "off":
+                return func(*args, **kwargs)
+            return _profiled_call(name, func, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def _profiled_call(name, func, args, kwargs):
+    outermost = not _active
+    _active.append(name)
+    if outermost and _profiler is not None:
+        _profiler.enable()
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        if outermost and _profiler is not None:
+            _profiler.disable()
+        _active.pop()
+        with _lock:
+            count, total, worst = _timings.get(name, (0, 0.0, 0.0))
+            _timings[name] = (count + 1, total + elapsed, max(worst, elapsed))
+        # Pool workers may be terminated without running atexit, so dump periodically
+        if outermost and time.monotonic() - _last_dump > DUMP_INTERVAL:
+            dump()
+
+
+def timings():
+    """{hook: {"calls", "total_seconds", "mean_ms", "max_ms"}} for this process."""
+    with _lock:
+        items = dict(_timings)
+    return {name: {"calls": count, "total_seconds": total, "mean_ms": total / count * 1000,
+                   "max_ms": worst * 1000}
+            for name, (count, total, worst) in items.items()}
+
+
+def reset():
+    with _lock:
+        _timings.clear()
+        _stacks.clear()
+
+
+def dump():
+    """Write this process's profile data to the output directory."""
+    global _last_dump
+    _last_dump = time.monotonic()
+    if _mode == "off" or not _timings:
+        return
+    os.makedirs(_output_dir, exist_ok=True)
+    base = os.path.join(_output_dir, str(os.getpid()))
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(timings(), f, indent=1)
+    if _profiler is not None:
+        _profiler.dump_stats(base + ".prof")
+    if _mode == "sample":
+        with _lock:
+            lines = [f"{stack} {count}" for stack, count in sorted(_stacks.items())]
+        with open(base + ".stacks", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def _after_fork(_module):
+    # Threads do not survive fork and multiprocessing children leave through
+    # os._exit, which skips atexit: restart the sampler and dump from a finalizer
+    global _sampler, _profiler
+    _timings.clear()
+    _stacks.clear()
+    del _active[:]
+    _sampler = None
+    _profiler = None
+    if _mode != "off":
+        configure(_mode, _output_dir, _interval)
+        multiprocessing.util.Finalize(None, dump, exitpriority=0)
+
+
+multiprocessing.util.register_after_fork(sys.modules[__name__], _after_fork)
+
+if os.environ.get("RAILROAD_PROFILE", "off") != "off":
+    configure()
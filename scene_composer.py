@@ -0,0 +1,177 @@
+"""
+Placement of several objects in one frame.
+
+Objects are anchored at their bottom-centre point. Anchors are drawn from a
+track-region mask when one is available (so hazards land on the rails) or
+from a band in the lower middle of the frame otherwise. The y position of the
+anchor sets a depth-consistent size, and a grid spatial index rejects
+placements that overlap already placed objects too much.
+"""
+import numpy as np
+
+import compositing
+
+# Depth model: objects at the horizon are FAR_SCALE of their size at the bottom edge
+HORIZON = 0.4
+NEAR_SCALE = 1.0
+FAR_SCALE = 0.35
+
+# Anchor band used without a track mask, as fractions of the frame size
+DEFAULT_X_RANGE = (0.3, 0.7)
+DEFAULT_Y_RANGE = (0.55, 0.95)
+
+MAX_OVERLAP = 0.1
+PLACEMENT_ATTEMPTS = 20
+GRID_CELL = 64
+
+
+class GridIndex:
+    """Uniform-grid spatial index of axis-aligned boxes [x, y, w, h]."""
+
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.boxes = []
+        self.cells = {}
+
+    def _cells(self, box):
+        x, y, w, h = box
+        for row in range(y // self.cell, (y + h - 1) // self.cell + 1):
+            for col in range(x // self.cell, (x + w - 1) // self.cell + 1):
+                yield row, col
+
+    def insert(self, box):
+        index = len(self.boxes)
+        self.boxes.append(box)
+        for key in self._cells(box):
+            self.cells.setdefault(key, []).append(index)
+
+    def candidates(self, box):
+        found = set()
+        for key in self._cells(box):
+            found.update(self.cells.get(key, ()))
+        return [self.boxes[index] for index in sorted(found)]
+
+    def max_overlap(self, box):
+        """Largest intersection with a stored box, as a fraction of the smaller box's area."""
+        x, y, w, h = box
+        worst = 0.0
+        for ox, oy, ow, oh in self.candidates(box):
+            inter_w = min(x + w, ox + ow) - max(x, ox)
+            inter_h = min(y + h, oy + oh) - max(y, oy)
+            if inter_w > 0 and inter_h > 0:
+                worst = max(worst, inter_w * inter_h / min(w * h, ow * oh))
+        return worst
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+def depth_scale(y, frame_height, horizon=HORIZON, near=NEAR_SCALE, far=FAR_SCALE):
+    """Size multiplier for an object standing at row y: far at the horizon, near at the bottom."""
+    horizon_y = horizon * frame_height
+    depth = (y - horizon_y) / max(frame_height - horizon_y, 1)
+    return far + (near - far) * float(np.clip(depth, 0.0, 1.0))
+
+
+class AnchorSampler:
+    """Draws bottom-centre anchor points from a track mask or the default band."""
+
+    def __init__(self, frame_shape, track_mask=None):
+        self.height, self.width = frame_shape[:2]
+        self.points = None
+        if track_mask is not None:
+            if track_mask.shape[:2] != (self.height, self.width):
+                raise ValueError(f"Track mask shape {track_mask.shape[:2]} does not match frame "
+                                 f"{(self.height, self.width)}")
+            points = np.flatnonzero(track_mask.reshape(-1) > 0)
+            self.points = points if points.size else None
+
+    def sample(self, rng=np.random):
+        if self.points is not None:
+            point = int(self.points[rng.randint(len(self.points))])
+            return point % self.width, point // self.width
+        x = rng.uniform(*DEFAULT_X_RANGE) * self.width
+        y = rng.uniform(*DEFAULT_Y_RANGE) * self.height
+        return int(x), int(y)
+
+
+def alpha_box(obj):
+    """Bounding box [x, y, w, h] of the non-transparent pixels of a BGRA object, or None."""
+    return compositing.visible_box(obj.shape, obj, 0, 0)
+
+
+def scaled_box(box, obj_shape, size, x, y, frame_shape):
+    """
+    Estimate of box (in object pixels) once the object is resized to size
+    (width, height) and placed at (x, y), clipped to the frame; None if empty.
+    """
+    scale_x, scale_y = size[0] / obj_shape[1], size[1] / obj_shape[0]
+    left = max(x + int(box[0] * scale_x), 0)
+    top = max(y + int(box[1] * scale_y), 0)
+    right = min(x + int(np.ceil((box[0] + box[2]) * scale_x)), frame_shape[1])
+    bottom = min(y + int(np.ceil((box[1] + box[3]) * scale_y)), frame_shape[0])
+    if right <= left or bottom <= top:
+        return None
+    return [left, top, right - left, bottom - top]
+
+
+def compose_scene(frame, items, size, resize, rng=np.random, track_mask=None, max_overlap=MAX_OVERLAP,
+                  attempts=PLACEMENT_ATTEMPTS, use_cv2=False):
+    """
+    Place several objects into a frame, then blend them once all are placed.
+
+    Candidate anchors are checked on box arithmetic alone: the object's alpha
+    bounding box is scaled to the size the anchor's depth gives. Only an
+    accepted object is resized, once, and its exact box is recorded.
+
+    Args:
+        frame (np.ndarray): BGR frame, modified in place.
+        items (list): (object, category, pre_scale, scale_factor) tuples; objects
+            are BGRA arrays, pre_scale and scale_factor are passed on to size and resize.
+        size (callable): size(object, pre_scale, scale_factor) -> (width, height)
+            of the object at its final size.
+        resize (callable): resize(object, pre_scale, scale_factor) -> object at
+            its final size; scale_factor already includes the depth multiplier.
+        rng: Random source with randint/uniform (np.random or a RandomState).
+        track_mask (np.ndarray): Optional HxW mask; anchors are drawn from its
+            non-zero pixels.
+        max_overlap (float): Allowed overlap with an already placed object, as a
+            fraction of the smaller box.
+        attempts (int): Anchors tried per object before it is dropped.
+
+    Returns:
+        tuple: (frame, boxes) with boxes as [{"category": ..., "bbox": [x, y, w, h]}].
+    """
+    frame_height, frame_width = frame.shape[:2]
+    sampler = AnchorSampler(frame.shape, track_mask)
+    index = GridIndex()
+    placements = []
+    boxes = []
+
+    for obj, category, pre_scale, scale_factor in items:
+        object_box = alpha_box(obj)
+        if object_box is None:
+            continue
+        for _ in range(attempts):
+            anchor_x, anchor_y = sampler.sample(rng)
+            depth_factor = scale_factor * depth_scale(anchor_y, frame_height)
+            width, height = size(obj, pre_scale, depth_factor)
+            if height > frame_height or width > frame_width:
+                continue
+            # Bottom-centre on the anchor, shifted back inside the frame if needed
+            x = int(np.clip(anchor_x - width // 2, 0, frame_width - width))
+            y = int(np.clip(anchor_y - height, 0, frame_height - height))
+            box = scaled_box(object_box, obj.shape, (width, height), x, y, frame.shape)
+            if box is None or index.max_overlap(box) > max_overlap:
+                continue
+            placed = resize(obj, pre_scale, depth_factor)
+            box = compositing.visible_box(frame.shape, placed, x, y)
+            if box is None:
+                continue
+            index.insert(box)
+            placements.append((placed, x, y))
+            boxes.append({"category": category, "bbox": box})
+            break
+
+    compositing.blend_each(frame, placements, use_cv2=use_cv2)
+    return frame, boxes
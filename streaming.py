@@ -0,0 +1,102 @@
+"""
+Streaming of sampled video frames straight into compositing.
+
+extract_frames() hands every sampled frame to a writer. FrameStream is such a
+writer: instead of encoding a JPEG it queues the decoded frame for the
+compositing stage, so backgrounds are never re-encoded or read back from
+disk. Every frame between the decoder and the end of its compositing counts
+against one byte budget. The decoder blocks when the budget is spent, which
+keeps memory bounded however far decoding would otherwise run ahead.
+"""
+import queue
+import threading
+
+import image_cache
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ByteBudget:
+    """
+    Blocking byte counter. acquire() waits until the bytes fit; a single item
+    larger than the whole budget is let through when nothing else is held, so
+    it cannot deadlock.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._condition:
+            while self.used and self.used + nbytes > self.max_bytes:
+                self._condition.wait()
+            self.used += nbytes
+            self.peak = max(self.peak, self.used)
+
+    def release(self, nbytes):
+        with self._condition:
+            self.used -= nbytes
+            self._condition.notify_all()
+
+
+class FrameStream:
+    """
+    Writer for extract_frames() and extract_videos() that queues (path, frame)
+    pairs instead of writing files. Iterating over the stream yields the pairs
+    until the producer finishes; the consumer calls release(frame.nbytes) once
+    it no longer needs a frame. With max_side, frames are shrunk to that
+    longer side before they are queued and counted.
+    """
+
+    # Tells extract_frames not to create output folders
+    writes_files = False
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_side=None):
+        self.budget = ByteBudget(max_bytes)
+        self.max_side = max_side
+        # Unbounded by count: the byte budget is the bound
+        self.queue = queue.Queue()
+        self.written = 0
+        self.failed = 0
+        self.error = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def write(self, path, frame):
+        frame = image_cache.fit_max_side(frame, self.max_side)
+        # Blocks the decoder while the frames in flight use up the budget
+        self.budget.acquire(frame.nbytes)
+        with self._lock:
+            self.written += 1
+        self.queue.put((path, frame))
+
+    def release(self, nbytes):
+        self.budget.release(nbytes)
+
+    def start(self, produce, *args, **kwargs):
+        """Run produce(*args, writer=self, **kwargs) on a background thread."""
+        def run():
+            try:
+                produce(*args, writer=self, **kwargs)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.put(None)
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            yield item
+        if self._thread is not None:
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
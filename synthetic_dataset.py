@@ -0,0 +1,259 @@
+"""
+Synthetic samples generated on demand, for training loops that read the
+composites from memory instead of from a generated dataset on disk.
+
+SyntheticDataset is map-style: dataset[i] composes sample i of the current
+epoch. Each sample has its own seed, derived from the base seed, the epoch
+and the index. A sample can therefore be reproduced in any process, and
+set_epoch() gives new frames, placements and augmentations every epoch.
+SyntheticStream iterates over the dataset on a pool of worker processes, for
+a number of epochs or without end. It keeps a bounded number of samples in
+flight and yields them in order, so its output does not depend on the number
+of workers.
+
+    dataset = SyntheticDataset.from_folders(objects_per_frame=3, seed=7)
+    for sample in SyntheticStream(dataset, workers=4, epochs=None):
+        image, boxes = sample["image"], sample["boxes"]
+
+Both classes only rely on __len__, __getitem__ and __iter__, so either can
+be wrapped by a torch DataLoader. Inside DataLoader workers, SyntheticStream
+gives each worker every num_workers-th sample; keep workers=1 there, since
+DataLoader workers cannot start processes of their own.
+
+With workers=1 the stream renders in the calling process and configures it
+as a compositing worker (OpenCV threads, image cache, augmentation pipeline,
+object index). The previous settings are restored when the iteration ends
+or the iterator is closed.
+"""
+import sys
+import time
+import random
+import logging
+import itertools
+import contextlib
+import multiprocessing
+from collections import deque
+
+import numpy as np
+
+import combine_background_and_object as combine
+import config
+import image_cache
+import metrics
+import scene_composer
+
+log = logging.getLogger(__name__)
+
+# Samples in flight per worker process
+PREFETCH_PER_WORKER = 2
+
+_dataset = None
+
+
+def sample_seed(base_seed, epoch, index):
+    """Seed of one sample; independent of the worker that renders it."""
+    return int(np.random.SeedSequence([base_seed, epoch, index]).generate_state(1)[0])
+
+
+class SyntheticDataset:
+    """
+    Map-style dataset of composites.
+
+    Args:
+        frames (list): Background frame paths.
+        objects (dict): {category: [prepared object paths]}.
+        length (int): Samples per epoch; by default frames_per_object samples
+            per object, as many as combine_background_and_object generates.
+        objects_per_frame (int): Objects placed in each sample.
+        seed (int): Base seed.
+        target_size (int): Longer side of the samples in pixels; frames are
+            decoded at reduced size. None keeps the frame resolution.
+
+    Every epoch visits the objects in a new order, so each object appears
+    length / object count times per epoch; the frame of each sample is drawn
+    at random.
+    """
+
+    def __init__(self, frames, objects, length=None, objects_per_frame=1, seed=combine.DEFAULT_SEED,
+                 frames_per_object=combine.FRAMES_PER_OBJECT, max_overlap=scene_composer.MAX_OVERLAP,
+                 target_size=combine.DEFAULT_TARGET_SIZE):
+        if not frames:
+            raise ValueError("No background frames to compose samples on")
+        self.frames = [str(frame) for frame in frames]
+        self.instances = [(path, category) for category, paths in objects.items() for path in paths]
+        if not self.instances:
+            raise ValueError("No prepared objects to place on frames")
+        registry = combine.get_categories().validate(objects)
+        self.category_ids = {name: registry.id_of(name) for name in registry.names}
+        self.objects_per_frame = objects_per_frame
+        self.length = length or len(self.instances) * frames_per_object // objects_per_frame
+        self.seed = seed
+        self.max_overlap = max_overlap
+        self.target_size = target_size
+        self.epoch = 0
+        self._order = None
+
+    @classmethod
+    def from_folders(cls, frames_folder=combine.EXTRACTED_FRAMES_FOLDER,
+                     objects_folder=combine.PREPARED_OBJECTS_FOLDER, **kwargs):
+        """Dataset over extracted_frames and prepared_objects."""
+        return cls(combine.collect_frames(frames_folder), combine.collect_objects(objects_folder), **kwargs)
+
+    def __len__(self):
+        return self.length
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self._order = None
+
+    def job(self, index, epoch=None):
+        """The Job or SceneJob for sample index of an epoch (the current one by default)."""
+        if not 0 <= index < self.length:
+            raise IndexError(f"Sample {index} out of range for {self.length} samples")
+        epoch = self.epoch if epoch is None else epoch
+        if self._order is None or self._order[0] != epoch:
+            # Object order of the epoch; built once per epoch and process
+            rng = np.random.default_rng([self.seed, epoch])
+            self._order = (epoch, rng.permutation(len(self.instances)))
+        order = self._order[1]
+        seed = sample_seed(self.seed, epoch, index)
+        frame = self.frames[np.random.default_rng(seed).integers(len(self.frames))]
+        if self.objects_per_frame > 1:
+            start = index * self.objects_per_frame
+            objects = tuple(self.instances[order[(start + i) % len(order)]] for i in range(self.objects_per_frame))
+            return combine.SceneJob(index, frame, objects, seed)
+        path, category = self.instances[order[index % len(order)]]
+        return combine.Job(index, frame, path, category, seed)
+
+    def render(self, job):
+        """Compose a job into a sample dict: BGR image, boxes with category ids, and provenance."""
+        random.seed(job.seed)
+        np.random.seed(job.seed)
+        if isinstance(job, combine.SceneJob):
+            image, boxes = combine.compose_scene_sample(job.frame_path, job.objects, seed=job.seed,
+                                                        max_overlap=self.max_overlap, target_size=self.target_size)
+            objects = [path for path, _ in job.objects]
+        else:
+            image, boxes = combine.compose_sample(job.frame_path, job.object_path, job.category, seed=job.seed,
+                                                  target_size=self.target_size)
+            objects = [job.object_path]
+        for box in boxes:
+            box["category_id"] = self.category_ids.get(box["category"])
+        return {"image": image, "boxes": boxes, "index": job.index, "seed": job.seed,
+                "frame": job.frame_path, "objects": objects}
+
+    def __getitem__(self, index):
+        return self.render(self.job(index))
+
+
+def _init_worker(dataset, cache_bytes, store_path, augment_preset, index_folder=None, config_path=None):
+    global _dataset
+    combine.init_worker(cache_bytes, store_path, augment_preset, index_folder=index_folder,
+                        config_path=config_path)
+    _dataset = dataset
+
+
+@contextlib.contextmanager
+def _in_process_worker(dataset, cache_bytes, store_path, augment_preset, index_folder=None):
+    # Sets up the calling process like a pool worker and puts its previous state back afterwards
+    global _dataset
+    previous = combine.init_worker(cache_bytes, store_path, augment_preset, index_folder=index_folder)
+    previous_dataset = _dataset
+    _dataset = dataset
+    try:
+        yield
+    finally:
+        combine.restore_worker(previous)
+        _dataset = previous_dataset
+
+
+def _render(task):
+    # Failed samples are logged and skipped, as in combine_background_and_object
+    epoch, index = task
+    start = time.perf_counter()
+    try:
+        sample = _dataset.render(_dataset.job(index, epoch))
+    except Exception as e:
+        log.error(f"Error composing sample {index} of epoch {epoch}: {e}")
+        metrics.inc("failures_total", stage="dataset")
+        return None
+    sample["epoch"] = epoch
+    metrics.inc("items_total", stage="dataset")
+    metrics.observe("item_seconds", time.perf_counter() - start, stage="dataset")
+    return sample
+
+
+def _torch_worker_info():
+    # torch is optional: if it is not imported we cannot be inside a DataLoader worker
+    data = sys.modules.get("torch.utils.data")
+    return data.get_worker_info() if data is not None else None
+
+
+class SyntheticStream:
+    """
+    Iterate over a SyntheticDataset on worker processes.
+
+    Args:
+        dataset (SyntheticDataset): Samples to generate.
+        workers (int): Worker processes; 1 renders in the calling process.
+        epochs (int): Epochs to generate, starting at dataset.epoch; None
+            repeats without end.
+        shuffle (bool): Visit the samples of each epoch in a seeded random order.
+        prefetch (int): Samples in flight (default PREFETCH_PER_WORKER per worker).
+        cache_bytes, store_path, augment_preset, index_folder: As for
+            combine_background_and_object.init_worker.
+    """
+
+    def __init__(self, dataset, workers=1, epochs=1, shuffle=True, prefetch=None,
+                 cache_bytes=image_cache.DEFAULT_CACHE_BYTES, store_path=None, augment_preset="full",
+                 index_folder=None):
+        self.dataset = dataset
+        self.workers = workers
+        self.epochs = epochs
+        self.shuffle = shuffle
+        self.prefetch = prefetch or PREFETCH_PER_WORKER * max(workers, 1)
+        self.initargs = (cache_bytes, store_path, augment_preset, index_folder)
+
+    def __len__(self):
+        if self.epochs is None:
+            raise TypeError("An endless stream has no length")
+        return len(self.dataset) * self.epochs
+
+    def tasks(self):
+        """(epoch, index) pairs in generation order, split between DataLoader workers if any."""
+        first = self.dataset.epoch
+        epochs = itertools.count(first) if self.epochs is None else range(first, first + self.epochs)
+        tasks = ((epoch, int(index)) for epoch in epochs for index in self._indices(epoch))
+        info = _torch_worker_info()
+        if info is not None:
+            tasks = itertools.islice(tasks, info.id, None, info.num_workers)
+        return tasks
+
+    def _indices(self, epoch):
+        if not self.shuffle:
+            return range(len(self.dataset))
+        return np.random.default_rng([self.dataset.seed, epoch, 1]).permutation(len(self.dataset))
+
+    def __iter__(self):
+        if self.workers <= 1:
+            with _in_process_worker(self.dataset, *self.initargs):
+                for sample in map(_render, self.tasks()):
+                    if sample is not None:
+                        yield sample
+            return
+        with multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                  initargs=(self.dataset, *self.initargs, config.load().path)) as pool:
+            # At most prefetch samples are submitted ahead of the consumer; results come back in order
+            pending = deque()
+            tasks = self.tasks()
+            for task in itertools.islice(tasks, self.prefetch):
+                pending.append(pool.apply_async(_render, (task,)))
+            while pending:
+                sample = pending.popleft().get()
+                for task in itertools.islice(tasks, 1):
+                    pending.append(pool.apply_async(_render, (task,)))
+                if sample is not None:
+                    yield sample
+            # Let the workers exit normally so that their exit handlers run
+            pool.close()
+            pool.join()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import metrics
+from benchmarks.stub_server import StubServer
+
+
+@pytest.fixture
+def stub_server():
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def settings(tmp_path):
+    return config.Settings(str(tmp_path / "config.ini"), str(tmp_path / "data"), "test-key", "test-engine")
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
@@ -0,0 +1,32 @@
+import logging
+import os
+
+import categories
+from categories import CategoryRegistry
+
+DATA_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "categories.csv")
+
+
+def test_first_row_of_a_duplicate_wins_with_a_warning(caplog):
+    with caplog.at_level(logging.WARNING, logger="categories"):
+        registry = CategoryRegistry.from_csv(DATA_CSV)
+    assert registry["aluminum_can"].scale_factor == 0.05
+    assert registry["broken_car"].scale_factor == 0.2
+    assert registry["large_rock"].scale_factor == 0.15
+    assert len(set(registry.names)) == len(registry)
+    warned = " ".join(record.getMessage() for record in caplog.records)
+    assert "'broken_car' with scale factor 0.3 ignored" in warned
+    assert "'large_rock' with scale factor 0.4 ignored" in warned
+
+
+def test_validate_leaves_the_shared_registry_unchanged(tmp_path):
+    path = tmp_path / "categories.csv"
+    path.write_text("Object name,scale factor\nTree,0.3\nRock,0.2\n", encoding="utf-8")
+    shared = categories.load_registry(str(path))
+
+    validated = shared.validate(["tree", "ufo"])
+    assert validated.names == ["tree", "rock", "ufo"]
+    assert validated["ufo"].scale_factor == categories.DEFAULT_SCALE_FACTOR
+    assert validated.id_of("ufo") == 2
+    assert categories.load_registry(str(path)).names == ["tree", "rock"]
+    assert "ufo" not in shared
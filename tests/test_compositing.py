@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import compositing
+from benchmarks.blend_benchmark import legacy_overlay_float
+
+
+def test_div255_is_exact_rounding_over_the_whole_range():
+    values = np.arange(255 * 255 + 1, dtype=np.uint16)
+    expected = (2 * values.astype(np.int64) + 255) // 510
+    assert np.array_equal(compositing._div255(values.copy()), expected)
+
+
+def random_case(seed, height=70, width=90):
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    overlay = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    # Fully transparent and fully opaque strips take the shortcuts of the kernel
+    overlay[:20, :, 3] = 0
+    overlay[20:40, :, 3] = 255
+    return background, overlay
+
+
+@pytest.mark.parametrize("x, y", [(10, 15), (-30, -5), (120, 90)])
+def test_blend_matches_the_float_blend(x, y):
+    background, overlay = random_case(abs(x * 1000 + y))
+    blended = background.copy()
+    assert compositing.blend(blended, overlay, x, y)
+
+    # Rounded float blend: identical; the legacy blend truncated, so within one level
+    expected = background.astype(np.float64)
+    region = compositing.clip_region(background.shape, overlay.shape, x, y)
+    (rows, cols), overlay_slices = region
+    part = overlay[overlay_slices].astype(np.float64)
+    alpha = part[:, :, 3:] / 255.0
+    expected[rows, cols] = np.round(alpha * part[:, :, :3] + (1.0 - alpha) * expected[rows, cols])
+    assert np.array_equal(blended, expected.astype(np.uint8))
+
+    legacy = legacy_overlay_float(background.copy(), overlay, x, y)
+    assert np.abs(blended.astype(int) - legacy.astype(int)).max() <= 1
+
+    with_cv2 = background.copy()
+    compositing.blend(with_cv2, overlay, x, y, use_cv2=True)
+    assert np.abs(blended.astype(int) - with_cv2.astype(int)).max() <= 1
+
+
+def test_blend_outside_the_background_changes_nothing():
+    background, overlay = random_case(1)
+    blended = background.copy()
+    assert not compositing.blend(blended, overlay, 500, 500)
+    assert np.array_equal(blended, background)
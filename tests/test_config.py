@@ -0,0 +1,72 @@
+import os
+import multiprocessing
+
+import pytest
+
+import combine_background_and_object as combine
+import config
+
+
+@pytest.fixture(autouse=True)
+def fresh_settings(monkeypatch):
+    monkeypatch.setattr(config, "_settings", None)
+    monkeypatch.delenv("RAILROAD_CONFIG", raising=False)
+
+
+def write_config(folder, data_folder=None):
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, "config.ini")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[DEFAULT]\n")
+        if data_folder is not None:
+            f.write(f"path_to_data_folder = {data_folder}\n")
+    return path
+
+
+@pytest.mark.parametrize("data_folder, expected", [(None, "data"), ("", "data"), ("shared/../images", "images")])
+def test_relative_data_folder_is_absolute_against_the_config_file(tmp_path, monkeypatch, data_folder, expected):
+    path = write_config(str(tmp_path / "project"), data_folder)
+    # The working directory does not matter, including the config file's own directory
+    for cwd in (tmp_path, tmp_path / "project"):
+        monkeypatch.chdir(cwd)
+        settings = config.read(os.path.relpath(path))
+        assert settings.path == path
+        assert settings.data_folder == str(tmp_path / "project" / expected)
+
+
+def test_absolute_data_folder_is_kept(tmp_path):
+    data_folder = str(tmp_path / "elsewhere")
+    assert config.read(write_config(str(tmp_path), data_folder)).data_folder == data_folder
+
+
+def test_missing_file_gives_defaults_next_to_it(tmp_path):
+    settings = config.read(str(tmp_path / "missing.ini"))
+    assert settings.data_folder == str(tmp_path / "data")
+    assert settings.api_key is None and settings.search_engine_id is None
+    with pytest.raises(ValueError):
+        config.search_credentials(settings)
+
+
+def test_environment_variable_is_used_without_a_path(tmp_path, monkeypatch):
+    from_env = write_config(str(tmp_path / "env"))
+    explicit = write_config(str(tmp_path / "explicit"))
+    monkeypatch.setenv("RAILROAD_CONFIG", from_env)
+    assert config.read().path == from_env
+    assert config.read(explicit).path == explicit
+
+
+def test_load_caches_and_leaves_the_environment_alone(tmp_path):
+    path = write_config(str(tmp_path))
+    settings = config.load(path)
+    assert config.load() is settings
+    assert config.DATA_FOLDER == settings.data_folder
+    assert "RAILROAD_CONFIG" not in os.environ
+
+
+def test_spawned_worker_receives_the_config_path(tmp_path):
+    path = write_config(str(tmp_path), "worker_data")
+    initargs = (1024, None, "cheap", None, None, path)
+    with multiprocessing.get_context("spawn").Pool(1, initializer=combine.init_worker, initargs=initargs) as pool:
+        settings = pool.apply(config.load)
+    assert settings.path == path
+    assert settings.data_folder == str(tmp_path / "worker_data")
@@ -0,0 +1,37 @@
+import os
+import json
+import tarfile
+
+import numpy as np
+
+from dataset_writer import ShardWriter, make_sample
+
+
+def sample(index, boxes):
+    image = np.zeros((20, 30, 3), dtype=np.uint8)
+    return make_sample(f"{index:06d}", image, boxes, encoding="png")
+
+
+def test_boxes_of_unknown_categories_are_skipped(tmp_path):
+    boxes = [{"category": "tree", "bbox": [1, 2, 3, 4]}, {"category": "ufo", "bbox": [0, 0, 5, 5]}]
+    with ShardWriter(str(tmp_path), ["truck", "tree"]) as writer:
+        writer.write(sample(0, boxes))
+        writer.write(sample(1, boxes[1:]))
+    assert (writer.samples, writer.boxes, writer.skipped_boxes) == (2, 1, 2)
+
+    coco = json.loads((tmp_path / "annotations_coco.json").read_text(encoding="utf-8"))
+    assert [annotation["category_id"] for annotation in coco["annotations"]] == [2]
+    with tarfile.open(tmp_path / "shard-000000.tar") as tar:
+        assert tar.extractfile("000000.txt").read().decode("utf-8").startswith("1 ")
+        assert json.load(tar.extractfile("000001.json"))["boxes"] == []
+
+
+def test_shards_of_an_earlier_run_are_removed(tmp_path):
+    with ShardWriter(str(tmp_path), ["tree"], max_samples=1) as writer:
+        for index in range(3):
+            writer.write(sample(index, []))
+    (tmp_path / "keep.txt").write_text("unrelated", encoding="utf-8")
+
+    with ShardWriter(str(tmp_path), ["tree"], max_samples=1, annotations=("coco",)) as writer:
+        writer.write(sample(0, []))
+    assert sorted(os.listdir(tmp_path)) == ["annotations_coco.json", "keep.txt", "shard-000000.tar"]
@@ -0,0 +1,40 @@
+import os
+
+from benchmarks.stub_server import MISSING_EVERY, synthetic_jpeg
+from object_download import DownloadManifest, download_image, make_session
+
+
+def test_existing_files_skip_folders_and_broken_links(tmp_path):
+    folder = tmp_path / "tree"
+    folder.mkdir()
+    (folder / "image_1.jpg").write_bytes(synthetic_jpeg(1))
+    (folder / "nested").mkdir()
+    (folder / "broken_link.jpg").symlink_to(folder / "missing.jpg")
+
+    manifest = DownloadManifest(str(folder), str(tmp_path / "manifests"))
+    assert [entry["file"] for entry in manifest.images.values()] == ["image_1.jpg"]
+
+
+def test_only_permanent_failures_are_remembered(stub_server, tmp_path):
+    manifest = DownloadManifest(str(tmp_path / "tree"), str(tmp_path / "manifests"))
+    session = make_session(retries=1, backoff_factor=0)
+    flaky = f"{stub_server.url}/flaky/1.jpg?fail=5"
+    missing = f"{stub_server.url}/img/{MISSING_EVERY}.jpg"
+    assert not download_image(flaky, str(tmp_path), 1, session, manifest)
+    assert not download_image(missing, str(tmp_path), 2, session, manifest)
+
+    assert not manifest.seen(flaky) and manifest.seen(missing)
+    assert manifest.rejected == {missing: "download failed (HTTP 404)"}
+
+
+def test_failed_write_rolls_back_the_accepted_image(stub_server, tmp_path):
+    folder = tmp_path / "tree"
+    manifest = DownloadManifest(str(folder), str(tmp_path / "manifests"))
+    url = f"{stub_server.url}/img/1.jpg"
+    # The category folder does not exist, so the image cannot be written
+    assert not download_image(url, str(folder), 1, make_session(), manifest)
+    assert manifest.images == {} and len(manifest.hashes) == 0 and not manifest.seen(url)
+
+    folder.mkdir()
+    assert download_image(url, str(folder), 1, make_session(), manifest)
+    assert os.listdir(folder) == ["image_1.jpg"]
@@ -0,0 +1,34 @@
+import os
+
+from object_download import Downloader, download_image, make_session
+
+
+def test_503_is_retried_until_the_image_arrives(stub_server, tmp_path):
+    session = make_session(retries=3, backoff_factor=0)
+    url = f"{stub_server.url}/flaky/1.jpg?fail=2"
+    assert download_image(url, str(tmp_path), 1, session)
+    assert stub_server.requests.count("/flaky/1.jpg?fail=2") == 3
+    assert os.path.exists(tmp_path / "image_1.jpg")
+
+
+def test_retries_give_up_after_the_limit(stub_server, tmp_path):
+    session = make_session(retries=2, backoff_factor=0)
+    assert not download_image(f"{stub_server.url}/flaky/2.jpg?fail=10", str(tmp_path), 1, session)
+    assert len(stub_server.requests) == 3
+    assert os.listdir(tmp_path) == []
+
+
+def test_per_host_limit_does_not_starve_other_hosts(stub_server, tmp_path):
+    # Two host names for the same server: a busy one queued first, then a quiet one
+    port = stub_server.server.server_port
+    busy, quiet = f"127.0.0.1:{port}", f"localhost:{port}"
+    tasks = [(f"http://{busy}/img/{n}.jpg?delay=0.1", str(tmp_path), n) for n in range(1, 10)]
+    tasks += [(f"http://{quiet}/img/{n}.jpg?delay=0.1", str(tmp_path), n) for n in range(11, 13)]
+
+    with Downloader(max_workers=4, per_host=2, session=make_session(4, retries=0)) as downloader:
+        results = downloader.download_all(tasks)
+
+    assert results == [True] * len(tasks)
+    assert stub_server.max_active == {busy: 2, quiet: 2}
+    # The quiet host starts while the busy one still has a queue
+    assert {"/img/11.jpg?delay=0.1", "/img/12.jpg?delay=0.1"} <= set(stub_server.requests[:4])
@@ -0,0 +1,27 @@
+import cv2
+import numpy as np
+
+import image_cache
+
+
+def test_store_with_an_unreadable_source_is_not_rebuilt(tmp_path, monkeypatch):
+    good, broken = tmp_path / "good.png", tmp_path / "broken.png"
+    cv2.imwrite(str(good), np.full((12, 10, 3), 7, dtype=np.uint8))
+    broken.write_bytes(b"not an image")
+    sources = [(str(good), cv2.IMREAD_COLOR), (str(broken), cv2.IMREAD_COLOR)]
+    store_path = str(tmp_path / "store")
+
+    store = image_cache.build_store(store_path, sources, threads=1)
+    assert len(store) == 1 and str(broken) not in store
+    assert store.get(str(broken)) is None
+    assert store.get(str(good))[0, 0, 0] == 7
+
+    decoded = []
+    monkeypatch.setattr(image_cache, "decode", lambda path, *args: decoded.append(path))
+    assert image_cache.store_is_current(store_path, sources)
+    image_cache.build_store(store_path, sources, threads=1)
+    assert decoded == []
+
+    # Fixing the broken file makes the store out of date
+    cv2.imwrite(str(broken), np.zeros((12, 10, 3), dtype=np.uint8))
+    assert not image_cache.store_is_current(store_path, sources)
@@ -0,0 +1,68 @@
+import numpy as np
+
+import background_capture_frames
+import image_hash
+from image_hash import HashIndex
+
+
+def test_index_grows_past_its_capacity_and_round_trips(tmp_path):
+    index = HashIndex(str(tmp_path / "hashes.json"))
+    values = [int(value) for value in np.random.default_rng(0).integers(0, 2 ** 63, 3 * image_hash.INITIAL_CAPACITY)]
+    for n, value in enumerate(values):
+        index.add(f"frame_{n}.jpg", value)
+    assert len(index) == len(values)
+    assert index.nearest(values[-1]) == (f"frame_{len(values) - 1}.jpg", 0)
+
+    index.save()
+    loaded = HashIndex(str(tmp_path / "hashes.json"))
+    assert loaded.keys == index.keys
+    assert loaded.nearest(values[5]) == ("frame_5.jpg", 0)
+
+
+def test_remove_forgets_only_that_hash():
+    index = HashIndex()
+    index.add("a.jpg", 0)
+    index.add("b.jpg", 2 ** 40 - 1)
+    index.add("c.jpg", 2 ** 64 - 1)
+    assert index.remove("b.jpg") and not index.remove("b.jpg")
+    assert index.keys == ["a.jpg", "c.jpg"]
+    assert index.find_duplicate(2 ** 40 - 1, 4) is None
+    assert index.find_duplicate(2 ** 64 - 1, 0) == "c.jpg"
+
+
+def test_failed_write_does_not_suppress_later_frames(tmp_path, monkeypatch):
+    frame = np.random.default_rng(1).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    index = HashIndex(root=str(tmp_path))
+    monkeypatch.setattr(background_capture_frames.cv2, "imwrite", lambda path, image: False)
+    assert not background_capture_frames._save(None, str(tmp_path), 0, frame, index)
+    assert len(index) == 0
+
+    monkeypatch.undo()
+    assert background_capture_frames._save(None, str(tmp_path), 0, frame, index)
+    assert not background_capture_frames._save(None, str(tmp_path), 1, frame, index)
+    assert len(index) == 1
+
+
+def test_deleted_frames_are_forgotten_on_re_extraction(tmp_path):
+    root, index_path = tmp_path / "frames", str(tmp_path / "hashes.json")
+    frame = np.random.default_rng(2).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    (root / "v").mkdir(parents=True)
+    index = HashIndex(index_path, root=str(root))
+    assert background_capture_frames._save(None, str(root / "v"), 0, frame, index)
+    index.save()
+
+    # The video's folder is cleared, then the video is extracted again
+    (root / "v" / "frame_000000.jpg").unlink()
+    index = HashIndex(index_path, root=str(root))
+    assert index.update_from_tree(str(root)) == (0, 1)
+    assert "v/frame_000000.jpg" not in index and len(index) == 0
+    assert len(HashIndex(index_path, root=str(root))) == 0
+    assert background_capture_frames._save(None, str(root / "v"), 0, frame, index)
+
+
+def test_update_from_tree_keeps_frames_outside_the_tree(tmp_path):
+    index = HashIndex(root=str(tmp_path))
+    index.add(str(tmp_path / "other" / "frame_000000.jpg"), 1)
+    (tmp_path / "v").mkdir()
+    assert index.update_from_tree(str(tmp_path / "v")) == (0, 0)
+    assert len(index) == 1
@@ -0,0 +1,63 @@
+from collections import Counter
+
+import pytest
+
+from job_scheduler import CyclicOrder, category_quotas, interleave, schedule
+
+
+@pytest.mark.parametrize("total", [0, 1, 7, 100, 1001])
+def test_quotas_add_up_to_the_total(total):
+    weights = {"tree": 1.0, "rock": 2.0, "cow": 3.5, "can": 0.25}
+    counts = category_quotas(total, weights)
+    assert sum(counts.values()) == total
+    assert list(counts) == list(weights)
+    weight_sum = sum(weights.values())
+    # Largest remainder: every count is its exact share rounded down or up
+    for name, weight in weights.items():
+        assert abs(counts[name] - total * weight / weight_sum) < 1
+
+
+def test_explicit_quotas_are_kept_and_the_rest_is_shared():
+    counts = category_quotas(10, {"tree": 1.0, "rock": 1.0, "cow": 0.0}, {"tree": 7})
+    assert counts == {"tree": 7, "rock": 3, "cow": 0}
+    with pytest.raises(ValueError):
+        category_quotas(5, {"tree": 1.0}, {"tree": 6})
+    with pytest.raises(ValueError):
+        category_quotas(5, {"tree": 1.0}, {"ufo": 1})
+
+
+def test_interleave_spreads_every_category():
+    quotas = {"tree": 50, "rock": 30, "cow": 20, "can": 1}
+    names = list(interleave(quotas))
+    assert Counter(names) == quotas
+    total = len(names)
+    # In every prefix each category is within one use of its share
+    for length in range(1, total + 1):
+        used = Counter(names[:length])
+        for name, quota in quotas.items():
+            assert abs(used[name] - length * quota / total) <= 1
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 4, 12, 13, 97, 100])
+def test_cyclic_order_is_a_permutation_in_every_cycle(n):
+    items = list(range(n))
+    order = CyclicOrder(items, (5, 1))
+    cycles = [[order[cycle * n + k] for k in range(n)] for cycle in range(4)]
+    for cycle in cycles:
+        assert sorted(cycle) == items
+    if n > 3:
+        assert len({tuple(cycle) for cycle in cycles}) > 1
+
+
+def test_schedule_balances_frames_and_objects():
+    frames = [f"frame_{n}" for n in range(7)]
+    objects = {"tree": ["t0", "t1", "t2"], "rock": ["r0"], "empty": []}
+    samples = list(schedule(frames, objects, 40, weights={"tree": 3.0, "rock": 1.0}, objects_per_frame=2, seed=3))
+    assert len(samples) == 40
+    frame_uses = Counter(frame for frame, _ in samples)
+    assert set(frame_uses.values()) <= {40 // 7, 40 // 7 + 1}
+    picks = Counter(pick for _, chosen in samples for pick in chosen)
+    assert sum(picks.values()) == 80
+    assert sum(count for (_, name), count in picks.items() if name == "tree") == 60
+    tree_uses = [count for (path, name), count in picks.items() if name == "tree"]
+    assert max(tree_uses) - min(tree_uses) <= 1
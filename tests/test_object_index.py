@@ -0,0 +1,77 @@
+import os
+
+import cv2
+import numpy as np
+
+import combine_background_and_object as combine
+import object_index
+
+
+def write_object(path, value):
+    image = np.full((8, 6, 4), value, dtype=np.uint8)
+    image[:, :, 3] = 255
+    assert cv2.imwrite(str(path), image)
+
+
+def test_changed_object_is_decoded_instead_of_served_from_the_index(tmp_path):
+    objects = tmp_path / "objects"
+    (objects / "tree").mkdir(parents=True)
+    path = objects / "tree" / "0.png"
+    write_object(path, 10)
+    index = object_index.build(str(objects), str(tmp_path / "index"))
+    assert np.array_equal(index.get(str(path)), cv2.imread(str(path), cv2.IMREAD_UNCHANGED))
+    assert index.entries[str(path)]["coverage"] == 1.0
+
+    write_object(path, 200)
+    os.utime(path, ns=(0, 0))
+    assert index.get(str(path)) is None
+    # Only the changed category is rebuilt, and it then serves the new pixels
+    assert object_index.build(str(objects), str(tmp_path / "index")).get(str(path))[0, 0, 0] == 200
+    os.remove(path)
+    assert index.get(str(path)) is None
+
+
+def test_stream_without_a_built_index_reads_the_new_pixels(tmp_path):
+    objects = tmp_path / "objects"
+    (objects / "tree").mkdir(parents=True)
+    path = objects / "tree" / "0.png"
+    write_object(path, 10)
+    object_index.build(str(objects), str(tmp_path / "index"))
+    write_object(path, 200)
+    os.utime(path, ns=(0, 0))
+
+    previous = combine.init_worker(cache_bytes=0, augment_preset="cheap", index_folder=str(tmp_path / "index"))
+    try:
+        obj, _ = combine.load_object(str(path), (80, 60, 3), 1.0, seed=0)
+    finally:
+        combine.restore_worker(previous)
+    assert obj[:, :, 3].max() == 255
+    assert obj[:, :, :3].max() > 100
+
+
+def test_stores_of_removed_categories_are_deleted(tmp_path):
+    objects = tmp_path / "objects"
+    for category in ("tree", "rock"):
+        (objects / category).mkdir(parents=True)
+        write_object(objects / category / "0.png", 10)
+    object_index.build(str(objects), str(tmp_path / "index"))
+    (objects / "rock" / "0.png").unlink()
+    (objects / "rock").rmdir()
+
+    index = object_index.build(str(objects), str(tmp_path / "index"))
+    assert sorted(os.listdir(tmp_path / "index" / object_index.STORES_FOLDER)) == ["tree.bin", "tree.json"]
+    assert list(index.objects()) == ["tree"]
+
+
+def test_category_with_an_unreadable_object_is_not_rebuilt(tmp_path, monkeypatch):
+    objects = tmp_path / "objects"
+    (objects / "tree").mkdir(parents=True)
+    write_object(objects / "tree" / "0.png", 10)
+    (objects / "tree" / "1.png").write_bytes(b"not an image")
+    index = object_index.build(str(objects), str(tmp_path / "index"))
+    assert list(index.entries) == [str(objects / "tree" / "0.png")]
+
+    rebuilt = []
+    monkeypatch.setattr(object_index.image_cache, "build_store", lambda *args: rebuilt.append(args))
+    assert len(object_index.build(str(objects), str(tmp_path / "index")).entries) == 1
+    assert rebuilt == []
@@ -0,0 +1,112 @@
+import os
+import json
+from functools import partial
+
+import combine_background_and_object as combine
+import pipeline
+from pipeline import Manifest, Stage, run_stage
+
+
+def write(path, text="x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def copy_stage(data, calls):
+    # One output per input: <data>/out/<name>
+    def process(inputs):
+        calls.append(sorted(inputs))
+        results = {}
+        for path in inputs:
+            output = os.path.join(data, "out", os.path.basename(path))
+            write(output)
+            results[path] = [output]
+        return results
+
+    return Stage("copy", lambda: pipeline.list_files(os.path.join(data, "in"), (".txt",)), process)
+
+
+def test_unchanged_inputs_are_skipped_and_changes_rerun(tmp_path, monkeypatch):
+    data = str(tmp_path / "data")
+    manifest_path = os.path.join(data, pipeline.MANIFEST_NAME)
+    first, second = os.path.join(data, "in", "a.txt"), os.path.join(data, "in", "b.txt")
+    write(first)
+    write(second)
+    calls = []
+    stage = copy_stage(data, calls)
+
+    run_stage(stage, Manifest(manifest_path, data))
+    report = run_stage(stage, Manifest(manifest_path, data))
+    assert calls == [[first, second]] and report["changed"] == 0
+
+    # A size change reruns; a new mtime only re-hashes, and the same content is not rerun
+    hashed = []
+    monkeypatch.setattr(pipeline, "file_digest", lambda path, digest=pipeline.file_digest: hashed.append(path)
+                        or digest(path))
+    write(first, "longer")
+    os.utime(second, ns=(1, 1))
+    run_stage(stage, Manifest(manifest_path, data))
+    assert calls[-1] == [first] and sorted(hashed) == [first, second]
+    write(second, "y")
+    run_stage(stage, Manifest(manifest_path, data))
+    assert calls[-1] == [second]
+    os.remove(os.path.join(data, "out", "b.txt"))
+    run_stage(stage, Manifest(manifest_path, data))
+    assert calls[-1] == [second]
+    # force reprocesses everything
+    run_stage(stage, Manifest(manifest_path, data), force=True)
+    assert calls[-1] == [first, second]
+
+
+def test_keys_are_relative_to_the_data_folder(tmp_path, monkeypatch):
+    write(str(tmp_path / "data" / "in" / "a.txt"))
+    calls = []
+
+    monkeypatch.chdir(tmp_path)
+    run_stage(copy_stage("data", calls), Manifest(os.path.join("data", "manifest.json"), "data"))
+    with open(tmp_path / "data" / "manifest.json", "r", encoding="utf-8") as f:
+        stored = json.load(f)["copy"]
+    assert list(stored) == [os.path.join("in", "a.txt")]
+    assert stored[os.path.join("in", "a.txt")]["outputs"] == [os.path.join("out", "a.txt")]
+
+    # The same data seen from another working directory is up to date
+    monkeypatch.chdir(tmp_path / "data")
+    report = run_stage(copy_stage(".", calls), Manifest("manifest.json", "."))
+    assert report["changed"] == 0 and len(calls) == 1
+
+
+def test_composite_stage_gives_old_objects_only_a_share_of_new_frames(tmp_path, monkeypatch):
+    frames_folder, objects_folder = tmp_path / "frames", tmp_path / "objects"
+    for n in range(10):
+        write(str(frames_folder / f"frame_{n:02d}.jpg"))
+    for category in ("tree", "rock"):
+        write(str(objects_folder / category / "0.png"))
+    monkeypatch.setattr(combine, "EXTRACTED_FRAMES_FOLDER", str(frames_folder))
+    monkeypatch.setattr(combine, "PREPARED_OBJECTS_FOLDER", str(objects_folder))
+    monkeypatch.setattr(combine, "OUTPUT_FOLDER", str(tmp_path / "out"))
+    monkeypatch.setattr(combine, "output_path_for", partial(combine.output_path_for,
+                                                            output_folder=str(tmp_path / "out")))
+    batches = []
+
+    def run_jobs(jobs, workers):
+        batches.append(list(jobs))
+        for job in jobs:
+            write(combine.output_path_for(job))
+
+    monkeypatch.setattr(combine, "run_jobs", run_jobs)
+    manifest_path = str(tmp_path / "manifest.json")
+    stage = pipeline.composite_stage(workers=1, frames_per_object=4)
+
+    run_stage(stage, Manifest(manifest_path, str(tmp_path)))
+    assert len(batches[-1]) == 8
+
+    new_frames = {str(frames_folder / "frame_10.jpg"), str(frames_folder / "frame_11.jpg")}
+    for frame in new_frames:
+        write(frame)
+    report = run_stage(stage, Manifest(manifest_path, str(tmp_path)))
+    assert report["changed"] == 2
+    # ceil(4 * 2 / 12) = 1 new frame per unchanged object
+    assert len(batches[-1]) == 2
+    assert {job.frame_path for job in batches[-1]} <= new_frames
+    assert run_stage(stage, Manifest(manifest_path, str(tmp_path)))["changed"] == 0
@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+
+import compositing
+import scene_composer
+
+
+def make_object(width, height):
+    obj = np.zeros((height, width, 4), dtype=np.uint8)
+    obj[height // 4:, width // 4:width - width // 4] = 200
+    return obj
+
+
+def test_only_accepted_objects_are_resized():
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    items = [(make_object(120, 160), f"object_{n}", 1.0, 1.0) for n in range(12)]
+    sizes, resized = [], []
+
+    def size(obj, pre_scale, scale_factor):
+        sizes.append(scale_factor)
+        return max(int(obj.shape[1] * scale_factor), 1), max(int(obj.shape[0] * scale_factor), 1)
+
+    def resize(obj, pre_scale, scale_factor):
+        resized.append(scale_factor)
+        shape = max(int(obj.shape[1] * scale_factor), 1), max(int(obj.shape[0] * scale_factor), 1)
+        return cv2.resize(obj, shape, interpolation=cv2.INTER_AREA)
+
+    frame, boxes = scene_composer.compose_scene(frame, items, size, resize, np.random.RandomState(3),
+                                                max_overlap=0.0)
+    assert 0 < len(boxes) < len(items)
+    # Rejected anchors only cost a size computation
+    assert len(resized) == len(boxes) < len(sizes)
+    index = scene_composer.GridIndex()
+    for box in boxes:
+        assert index.max_overlap(box["bbox"]) == 0.0
+        index.insert(box["bbox"])
+
+
+def test_scaled_box_matches_the_resized_object():
+    obj = make_object(120, 160)
+    resized = cv2.resize(obj, (45, 60), interpolation=cv2.INTER_AREA)
+    box = scene_composer.scaled_box(scene_composer.alpha_box(obj), obj.shape, (45, 60), 10, 20, (360, 640))
+    assert box == compositing.visible_box((360, 640), resized, 10, 20)
+    assert scene_composer.scaled_box([0, 0, 10, 10], (10, 10), (10, 10), 700, 0, (360, 640)) is None
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+
+import pytest
+
+import metrics
+import object_download
+from object_download import SearchCache, get_search_results
+
+
+def counter(name, **labels):
+    return sum(value for counter_name, counter_labels, value in metrics.snapshot()["counters"]
+               if counter_name == name and counter_labels == labels)
+
+
+def search_requests(server):
+    return [path for path in server.requests if path.startswith("/search")]
+
+
+@pytest.fixture(autouse=True)
+def search_url(stub_server, monkeypatch):
+    monkeypatch.setattr(object_download, "SEARCH_URL", stub_server.url + "/search")
+
+
+def age_entries(folder, seconds):
+    # Pretend every entry was fetched `seconds` ago
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        entry["fetched"] -= seconds
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+
+
+def test_cached_response_is_served_without_a_request(stub_server, settings, tmp_path):
+    cache = SearchCache(str(tmp_path / "search"))
+    first = get_search_results("rusty barrel", 1, settings=settings, cache=cache)
+    second = get_search_results("rusty barrel", 1, settings=settings, cache=cache)
+    assert first == second and len(first["items"]) == object_download.PER_PAGE
+    assert len(search_requests(stub_server)) == 1
+    assert counter("cache_hits_total", stage="search") == 1
+
+
+def test_key_leaves_out_the_api_key(stub_server, settings, tmp_path):
+    params = {"q": "tree", "start": 1}
+    assert SearchCache.key("url", dict(params, key="a")) == SearchCache.key("url", dict(params, key="b"))
+    assert SearchCache.key("url", params) != SearchCache.key("url", dict(params, start=11))
+
+    cache = SearchCache(str(tmp_path / "search"))
+    get_search_results("tree", 1, settings=settings, cache=cache)
+    rotated = settings._replace(api_key="rotated-key")
+    get_search_results("tree", 1, settings=rotated, cache=cache)
+    assert len(search_requests(stub_server)) == 1
+    stored = json.loads(next((tmp_path / "search").iterdir()).read_text(encoding="utf-8"))
+    assert "key" not in stored["params"]
+
+
+def test_expired_entry_is_fetched_again(stub_server, settings, tmp_path):
+    folder = str(tmp_path / "search")
+    cache = SearchCache(folder, ttl=60)
+    get_search_results("bucket", 1, settings=settings, cache=cache)
+    age_entries(folder, 30)
+    get_search_results("bucket", 1, settings=settings, cache=cache)
+    assert len(search_requests(stub_server)) == 1
+
+    age_entries(folder, 60)
+    get_search_results("bucket", 1, settings=settings, cache=cache)
+    assert len(search_requests(stub_server)) == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    folder = str(tmp_path / "search")
+    response = {"items": [{"link": f"http://example.com/{i}.jpg"} for i in range(10)]}
+    probe = SearchCache(str(tmp_path / "probe"))
+    probe.put("url", {"start": 0}, response)
+    entry_size = probe.size
+
+    cache = SearchCache(folder, max_bytes=int(entry_size * 3.5))
+    now = time.time()
+    for start in range(3):
+        cache.put("url", {"start": start}, response)
+        # Distinct use times, oldest first, independent of the file system's time resolution
+        os.utime(cache._path(cache.key("url", {"start": start})), (now - 100 + start, now - 100 + start))
+    # Using the oldest entry makes it the most recent one
+    assert cache.get("url", {"start": 0}) == response
+    cache.put("url", {"start": 3}, response)
+    cache.put("url", {"start": 4}, response)
+
+    assert cache.size <= cache.max_bytes
+    assert cache.size == sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+    kept = [start for start in range(5) if cache.get("url", {"start": start}) is not None]
+    assert kept == [0, 3, 4]
+    assert counter("evictions_total", stage="search") == 2
+
+
+def test_offline_serves_only_cached_pages(stub_server, settings, tmp_path):
+    folder = str(tmp_path / "search")
+    get_search_results("dead cow", 1, settings=settings, cache=SearchCache(folder, ttl=60))
+    age_entries(folder, 3600)
+
+    offline = SearchCache(folder, ttl=60, offline=True)
+    no_key = settings._replace(api_key=None)
+    # An expired entry is still served offline, without credentials
+    assert get_search_results("dead cow", 1, settings=no_key, cache=offline) is not None
+    assert get_search_results("dead cow", 11, settings=no_key, cache=offline) is None
+    assert len(search_requests(stub_server)) == 1
+    assert counter("failures_total", stage="search", reason="offline") == 1
+
+
+
+@pytest.mark.parametrize("content", ['{"response": {}}', '["not", "an", "entry"]', '{"fetched": "yesterday"}',
+                                     '{"fetched": 1, "respo'])
+def test_malformed_entry_is_a_miss_and_removed(stub_server, settings, tmp_path, content):
+    cache = SearchCache(str(tmp_path / "search"))
+    params = {"q": "broken", "start": 1}
+    path = cache._path(cache.key("url", params))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    cache.size += os.path.getsize(path)
+
+    assert cache.get("url", params) is None
+    assert not os.path.exists(path) and cache.size == 0
+
+    get_search_results("broken", 1, settings=settings, cache=cache)
+    assert get_search_results("broken", 1, settings=settings, cache=cache) is not None
+    assert len(search_requests(stub_server)) == 1
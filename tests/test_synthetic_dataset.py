@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+
+import combine_background_and_object as combine
+import image_cache
+import object_augment
+import object_index
+import synthetic_dataset
+from synthetic_dataset import SyntheticDataset, SyntheticStream
+
+
+def write_data(tmp_path):
+    frame = tmp_path / "frame.jpg"
+    cv2.imwrite(str(frame), np.full((90, 160, 3), 80, dtype=np.uint8))
+    (tmp_path / "tree").mkdir()
+    obj = np.zeros((40, 30, 4), dtype=np.uint8)
+    obj[5:35, 5:25] = 200
+    cv2.imwrite(str(tmp_path / "tree" / "0.png"), obj)
+    return [str(frame)], {"tree": [str(tmp_path / "tree" / "0.png")]}
+
+
+def state():
+    return (cv2.getNumThreads(), combine._target_size, image_cache.snapshot(), object_augment.snapshot(),
+            object_index.snapshot(), synthetic_dataset._dataset)
+
+
+def test_in_process_stream_restores_the_caller_state(tmp_path):
+    frames, objects = write_data(tmp_path)
+    dataset = SyntheticDataset(frames, objects, length=2, target_size=64)
+    before = state()
+
+    stream = iter(SyntheticStream(dataset, workers=1, augment_preset="cheap"))
+    sample = next(stream)
+    assert max(sample["image"].shape[:2]) == 64
+    assert object_augment.PIPELINE_PRESET == "cheap" and synthetic_dataset._dataset is dataset
+    stream.close()
+    assert state() == before
+
+    assert len(list(SyntheticStream(dataset, workers=1, augment_preset="cheap"))) == 2
+    assert state() == before